@@ -0,0 +1,104 @@
+import asyncio
+from motion_executor import executor_for
+
+class AsyncMotion:
+    """
+    Description: This class is the asyncio side of the motion executor. Motion
+    commands return awaitables that resolve once the controller has finished
+    them, so a long move never blocks the event loop. Status reads run in a
+    worker thread and can be awaited while a motion is still in flight.
+    Parameters: robot (obj), executor (MotionExecutor)
+    """
+
+    def __init__(self, robot, executor=None):
+        self.robot = robot
+        self.executor = executor if executor is not None else executor_for(robot)
+
+    def submit(self, commands, progress=None):
+        """
+        Description: This function starts streaming the commands and returns
+        a future for their completion. Cancelling the future halts the robot.
+        Parameters: self (obj), commands (list), progress (function) called on
+        the event loop with the number of completed commands
+        Returns: future (asyncio.Future) resolving to the MotionHandle
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        report = None
+        if progress is not None:
+            # the executor reports from its thread
+            report = lambda handle: loop.call_soon_threadsafe(progress, handle.completed)
+        handle = self.executor.submit(commands, report)
+
+        def resolve(handle):
+            if future.done():
+                return
+            if handle.error is not None:
+                future.set_exception(handle.error)
+            elif handle.cancelled:
+                future.cancel()
+            else:
+                future.set_result(handle)
+
+        def forward_cancel(future):
+            if future.cancelled():
+                handle.cancel()
+
+        future.add_done_callback(forward_cancel)
+        # the handle finishes on the executor's thread
+        handle.add_done_callback(lambda handle: loop.call_soon_threadsafe(resolve, handle))
+
+        return future
+
+    async def run(self, commands, progress=None):
+        """
+        Description: This function streams the commands and waits for them
+        without blocking the event loop
+        Parameters: self (obj), commands (list), progress (function) called
+        with the number of completed commands
+        Returns: handle (MotionHandle)
+        """
+        return await self.submit(commands, progress)
+
+    async def jmove(self, **kwargs):
+        """
+        Description: This function is the awaitable version of robot.jmove
+        Parameters: self (obj), kwargs (dict)
+        Returns: handle (MotionHandle)
+        """
+        return await self.run([dict(kwargs, cmd="jmove")])
+
+    async def lmove(self, **kwargs):
+        """
+        Description: This function is the awaitable version of robot.lmove
+        Parameters: self (obj), kwargs (dict)
+        Returns: handle (MotionHandle)
+        """
+        return await self.run([dict(kwargs, cmd="lmove")])
+
+    async def _read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def joints(self):
+        """
+        Description: This function reads all the joint values of the robot
+        Parameters: self (obj)
+        Returns: joints (list)
+        """
+        return await self._read(self.robot.get_all_joint)
+
+    async def pose(self):
+        """
+        Description: This function reads the cartesian pose of the robot
+        Parameters: self (obj)
+        Returns: pose (list)
+        """
+        return await self._read(self.robot.get_all_pose)
+
+    async def claw(self):
+        """
+        Description: This function reads the position of the claw (j5)
+        Parameters: self (obj)
+        Returns: j5 (float)
+        """
+        return await self._read(self.robot.get_joint, 5)
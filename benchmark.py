@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+from time import perf_counter, sleep
+from dorna_simulator import SimulatedDorna
+from robot_session import RobotSession
+from station_index import StationIndex
+from position_store import load_positions, import_positions
+
+# file the baseline numbers are kept in
+BASELINE = "benchmark_baseline.json"
+
+# a metric more than this much worse than its baseline is a regression
+THRESHOLD = 0.2
+
+# fewest samples taken of the tools, each one runs whole actions
+TOOL_SAMPLES = 10
+
+def _stats(samples, unit="ms", scale=1000):
+    # summarizes timings in seconds, lower is better
+    samples = sorted(samples)
+    return {
+        "value": scale * sum(samples) / len(samples),
+        "p50": scale * samples[len(samples) // 2],
+        "p95": scale * samples[min(len(samples)-1, int(len(samples) * 0.95))],
+        "max": scale * samples[-1],
+        "samples": len(samples),
+        "unit": unit,
+        "better": "lower",
+    }
+
+def _rate(count, seconds, unit="1/s"):
+    # a throughput, higher is better
+    return {"value": count / seconds, "samples": count, "unit": unit, "better": "higher"}
+
+def _time(function, *args):
+    start = perf_counter()
+    function(*args)
+    return perf_counter() - start
+
+def bench_commands(robot, iterations):
+    """
+    Description: This function measures the round-trip of single blocking
+    jmove and lmove commands
+    Parameters: robot (obj), iterations (int)
+    Returns: metrics (dict)
+    """
+    jmove = [_time(lambda: robot.jmove(rel=1, j0=0.1 if i % 2 else -0.1, vel=100)) for i in range(iterations)]
+    lmove = [_time(lambda: robot.lmove(rel=1, z=0.1 if i % 2 else -0.1, vel=100)) for i in range(iterations)]
+
+    return {"jmove_latency": _stats(jmove), "lmove_latency": _stats(lmove)}
+
+def bench_positions(iterations):
+    """
+    Description: This function measures how fast positions are loaded, from
+    the cache and parsed from the files, and how fast microscope positions
+    are worked out
+    Parameters: iterations (int)
+    Returns: metrics (dict)
+    """
+    from movements import get_microscope_position
+
+    metrics = {}
+    for path in ("positions.json", "keyPositions.csv"):
+        name = os.path.splitext(path)[0]
+        seconds = sum(_time(import_positions, path) for i in range(iterations))
+        metrics["parse_%s" % name] = _rate(iterations, seconds)
+        seconds = sum(_time(load_positions, path) for i in range(iterations))
+        metrics["load_%s" % name] = _rate(iterations, seconds)
+
+    positions = load_positions("positions.json")
+    ML1 = positions.get("ML1", positions.get("MicroscopeLeft1"))
+    names = ["Microscope%s%d" % (side, number) for side in ("Left", "Right") for number in range(1, 5)]
+    start = perf_counter()
+    for i in range(iterations):
+        for name in names:
+            get_microscope_position(ML1, name)
+    metrics["get_microscope_position"] = _rate(iterations * len(names), perf_counter() - start)
+
+    start = perf_counter()
+    for i in range(iterations):
+        StationIndex(positions)
+    metrics["station_index"] = _rate(iterations, perf_counter() - start)
+
+    return metrics
+
+def bench_tools(time_scale, iterations):
+    """
+    Description: This function measures the end-to-end latency of each tool
+    of the chatbot extension on the simulated robot, from creating the arm
+    (connect) to closing its session
+    Parameters: time_scale (float), iterations (int)
+    Returns: metrics (dict)
+    """
+    from robotic_arm_chatbot_extension import (RoboticArm, GrabFromHolderInput, PlacesAtHolderInput,
+                                               GrabFromMicroscopeInput, PlacesAtMicroscopeInput)
+
+    async def run():
+        metrics = {}
+        connect, close = [], []
+        tools = {"grab_from_holder": [], "place_at_holder": [], "grab_from_microscope": [], "place_at_microscope": []}
+        for i in range(iterations):
+            start = perf_counter()
+            # the benchmark doesn't touch the inventory of the bench
+            arm = RoboticArm(simulation=True, time_scale=time_scale, inventory=None)
+            connect.append(perf_counter() - start)
+
+            holder = arm.stations.names("holder")[0]
+            calls = [
+                ("grab_from_holder", GrabFromHolderInput(position=holder)),
+                ("place_at_microscope", PlacesAtMicroscopeInput(position="MicroscopeLeft1")),
+                ("grab_from_microscope", GrabFromMicroscopeInput(position="MicroscopeLeft1")),
+                ("place_at_holder", PlacesAtHolderInput(position=holder)),
+            ]
+            for tool, config in calls:
+                start = perf_counter()
+                await getattr(arm, tool)(config)
+                tools[tool].append(perf_counter() - start)
+
+            start = perf_counter()
+            await arm.scheduler.stop()
+            arm.session.close()
+            close.append(perf_counter() - start)
+
+        metrics["tool_connect"] = _stats(connect)
+        for tool, samples in tools.items():
+            metrics["tool_%s" % tool] = _stats(samples)
+        metrics["tool_close"] = _stats(close)
+        return metrics
+
+    return asyncio.run(run())
+
+def bench_teleop(robot, seconds=2):
+    """
+    Description: This function measures the command rate of the jog engine
+    and the delay from a stick moving to the move being sent, with a
+    scripted controller that keeps moving the left stick
+    Parameters: robot (obj), seconds (float)
+    Returns: metrics (dict)
+    """
+    import pygame
+    from controller_calibration import JogEngine
+
+    engine = JogEngine(robot)
+    start = perf_counter()
+    polls = [0]
+
+    def events(timeout):
+        # the stick changes every poll and start is pressed once the time is up
+        sleep(timeout)
+        polls[0] += 1
+        if perf_counter() - start > seconds:
+            return [pygame.event.Event(pygame.JOYBUTTONDOWN, button=7)]
+        return [pygame.event.Event(pygame.JOYAXISMOTION, axis=0, value=0.5 + 0.1 * (polls[0] % 2))]
+
+    report = engine.run(events)
+
+    return {
+        "teleop_command_rate": _rate(report["sent"], report["elapsed"], "Hz"),
+        "teleop_latency": _stats(list(engine.latencies)),
+    }
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Description: This function compares the results with the baseline and
+    flags the metrics that got worse by more than the threshold. Timings are
+    compared on their median, which a single slow sample doesn't move.
+    Parameters: results (dict), baseline (dict), threshold (float)
+    Returns: regressions (list) of the names of the metrics that regressed
+    """
+    regressions = []
+    for name, metric in results["metrics"].items():
+        if name not in baseline.get("metrics", {}):
+            continue
+        key = "p50" if "p50" in metric and "p50" in baseline["metrics"][name] else "value"
+        old = baseline["metrics"][name][key]
+        new = metric[key]
+        if metric["better"] == "lower":
+            change = (new - old) / old if old else 0
+        else:
+            change = (old - new) / old if old else 0
+        metric["baseline"] = old
+        metric["regression"] = change > threshold
+        if metric["regression"]:
+            regressions.append(name)
+
+    return regressions
+
+def run(suites, iterations=200, time_scale=0):
+    """
+    Description: This function runs the benchmarks against the simulated
+    robot. Suites that need a library that isn't installed are skipped and
+    listed with the reason.
+    Parameters: suites (list), iterations (int), time_scale (float)
+    Returns: results (dict)
+    """
+    results = {"time_scale": time_scale, "iterations": iterations, "metrics": {}, "skipped": {}}
+
+    robot = SimulatedDorna(time_scale)
+    session = RobotSession(robot=robot, heartbeat=0)
+    session.start()
+    robot.set_motor(1)
+
+    benchmarks = {
+        "commands": lambda: bench_commands(robot, iterations),
+        "positions": lambda: bench_positions(iterations),
+        "tools": lambda: bench_tools(time_scale, max(TOOL_SAMPLES, iterations // 20)),
+        "teleop": lambda: bench_teleop(robot),
+    }
+    for suite in suites:
+        try:
+            with session:
+                results["metrics"].update(benchmarks[suite]())
+        except ImportError as e:
+            results["skipped"][suite] = str(e)
+            print("Skipping %s: %s" % (suite, e), file=sys.stderr)
+
+    session.close()
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the robot code against the simulated robot."
+    )
+    parser.add_argument("suites", nargs="*", default=["commands", "positions", "tools", "teleop"],
+                        help="suites to run (default: all)")
+    parser.add_argument("--iterations", type=int, default=200, help="iterations per benchmark (default: 200)")
+    parser.add_argument("--time-scale", type=float, default=0, help="simulated motion time, 0 is instant (default: 0)")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file (default: %s)" % BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown (default: 0.2)")
+    parser.add_argument("--output", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.suites, args.iterations, args.time_scale)
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent = 4)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+    results["regressions"] = regressions
+
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent = 4)
+
+    # a failing exit status lets CI catch the regressions
+    sys.exit(1 if regressions else 0)
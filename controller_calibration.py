@@ -1,7 +1,308 @@
 import pygame
-from dorna2 import Dorna
-from time import sleep
-import json
+import threading
+from collections import deque
+from time import sleep, monotonic
+from robot_session import DEFAULT_HOST
+from position_store import load_positions, get_store
+
+# rate at which jog commands are sent to the robot in Hz
+JOG_RATE = 50
+# jog speed at full stick deflection and sensitivity 1, in mm/s or deg/s
+JOG_SPEED = 50
+# a held button or dpad repeats its action this often, in seconds
+DEBOUNCE = 0.3
+# at most this many jog commands are queued on the robot
+JOG_IN_FLIGHT = 2
+
+# stick deflections smaller than these are ignored
+DEADZONES = {0: 0.05, 1: 0.05, 3: 0.15}
+
+# which stick moves what, with the sign of the motion, in each coordinate system
+STICKS = {
+    "cartesian": {0: ("x", 1), 1: ("y", -1), 3: ("z", -1)},
+    "joint": {0: ("j0", 1), 1: ("j1", -1), 3: ("j2", -1)},
+}
+# the triggers move the sliding rail, the right one forward and the left one back
+TRIGGERS = {"cartesian": "d", "joint": "j6"}
+# the dpad rotates the claw, the bumpers open and close it
+DPAD = {"cartesian": ("b", "a"), "joint": ("j4", "j3")}
+CLAW = {"cartesian": "c", "joint": "j5"}
+
+class JogEngine:
+    """
+    Description: This class jogs the robotic arm with a game controller. The
+    controller's events only update the state of the sticks and buttons, a
+    separate thread sends one move per tick at a fixed rate that merges every
+    deflected stick, so reading the controller never waits on the network.
+    Buttons act when pressed and repeat while held without blocking. The
+    achieved command rate and the delay between a stick moving and the
+    matching move being sent are measured.
+    Parameters: robot (obj), rate (float) in Hz, speed (float), debounce
+    (float), on_record (function) called to record a position
+    """
+
+    def __init__(self, robot, rate=JOG_RATE, speed=JOG_SPEED, debounce=DEBOUNCE, on_record=None):
+        self.robot = robot
+        self.rate = rate
+        self.speed = speed
+        self.debounce = debounce
+        self.on_record = on_record
+
+        self.coordsys = "cartesian"
+        self.sensitivity = 1
+        self.axes = {}
+        self.hat = (0, 0)
+        # buttons and the dpad being held, with the time they act again
+        self._held = {}
+        # one-off moves and actions for the sending thread
+        self._actions = deque()
+        # motion left over when a tick could not be sent
+        self._carry = {}
+        self._in_flight = deque()
+        self._next_id = 5000
+        self._input_time = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self.ticks = 0
+        self.sent = 0
+        self.skipped = 0
+        self.latencies = deque(maxlen=1000)
+        self.started = None
+        self.stopped = None
+
+    def handle_event(self, event, now=None):
+        """
+        Description: This function updates the state from one controller event
+        Parameters: self (obj), event (pygame.event.Event), now (float)
+        Returns: (bool) False once the start button was pressed
+        """
+        now = monotonic() if now is None else now
+        with self._lock:
+            if event.type == pygame.JOYAXISMOTION:
+                value = event.value
+                if event.axis in (4, 5):
+                    value = 1 if value > 0 else 0
+                elif abs(value) <= DEADZONES.get(event.axis, 0.05):
+                    value = 0
+                if value != self.axes.get(event.axis, 0):
+                    self.axes[event.axis] = value
+                    if value and self._input_time is None:
+                        self._input_time = now
+            elif event.type == pygame.JOYHATMOTION:
+                self.hat = tuple(event.value)
+                if self.hat != (0, 0):
+                    self._held["hat"] = now + self.debounce
+                    self._press("hat")
+                else:
+                    self._held.pop("hat", None)
+            elif event.type == pygame.JOYBUTTONDOWN:
+                if event.button == 7:
+                    return False
+                if event.button in (4, 5):
+                    self._held[event.button] = now + self.debounce
+                self._press(event.button)
+            elif event.type == pygame.JOYBUTTONUP:
+                self._held.pop(event.button, None)
+            elif event.type == pygame.QUIT:
+                return False
+
+        return True
+
+    def _press(self, button):
+        # what a button does, called with the lock held
+        if button == "hat":
+            first, second = DPAD[self.coordsys]
+            cmd = {"cmd": "lmove" if self.coordsys == "cartesian" else "jmove", "rel": 1, "vel": 100,
+                   first: self.hat[0] * self.sensitivity, second: self.hat[1] * self.sensitivity}
+            self._actions.append(cmd)
+        elif button in (4, 5):
+            # closes the claw with the left bumper and opens it with the right one
+            cmd = {"cmd": "lmove" if self.coordsys == "cartesian" else "jmove", "rel": 1, "vel": 100,
+                   CLAW[self.coordsys]: (-1 if button == 4 else 1) * self.sensitivity}
+            self._actions.append(cmd)
+        elif button == 1:
+            if self.on_record is not None:
+                self._actions.append(self.on_record)
+        elif button == 0:
+            self.sensitivity *= 0.5
+            print("Sensitivity is now %f" % self.sensitivity)
+        elif button == 3:
+            self.sensitivity *= 2
+            print("Sensitivity is now %f" % self.sensitivity)
+        elif button == 2:
+            self.coordsys = "joint" if self.coordsys != "joint" else "cartesian"
+            self.axes = {}
+            self._carry = {}
+            print("Coordinate system is now %s" % self.coordsys)
+
+    def repeat(self, now=None):
+        """
+        Description: This function repeats the action of the held buttons
+        whose time has come
+        Parameters: self (obj), now (float)
+        Returns: None
+        """
+        now = monotonic() if now is None else now
+        with self._lock:
+            for button, due in list(self._held.items()):
+                if now >= due:
+                    self._held[button] = now + self.debounce
+                    self._press(button)
+
+    def velocity(self):
+        """
+        Description: This function merges the deflected sticks and triggers
+        into one velocity
+        Parameters: self (obj)
+        Returns: velocity (dict) coordinate -> speed
+        """
+        velocity = {}
+        speed = self.speed * self.sensitivity
+        for axis, (key, sign) in STICKS[self.coordsys].items():
+            if self.axes.get(axis):
+                velocity[key] = sign * self.axes[axis] * speed
+        rail = self.axes.get(4, 0) - self.axes.get(5, 0)
+        if rail:
+            velocity[TRIGGERS[self.coordsys]] = rail * speed
+
+        return velocity
+
+    def _ready(self, timeout):
+        # whether another move may be queued, waits for the oldest one if not
+        while self._in_flight:
+            if self.robot.wait(id=self._in_flight[0], stat=2, timeout=0):
+                self._in_flight.popleft()
+            elif len(self._in_flight) < JOG_IN_FLIGHT:
+                return True
+            else:
+                if not self.robot.wait(id=self._in_flight[0], stat=2, timeout=timeout):
+                    return False
+                self._in_flight.popleft()
+        return True
+
+    def _send(self, cmd):
+        self._next_id += 1
+        self.robot.play(timeout=0, **dict(cmd, id=self._next_id))
+        self._in_flight.append(self._next_id)
+        self.sent += 1
+
+    def tick(self, dt):
+        """
+        Description: This function sends what the controller asks for during
+        one tick: the queued one-off moves and actions, then one move
+        covering every deflected stick
+        Parameters: self (obj), dt (float) length of the tick in seconds
+        Returns: None
+        """
+        with self._lock:
+            actions = list(self._actions)
+            self._actions.clear()
+            velocity = self.velocity()
+            coordsys = self.coordsys
+            inputTime, self._input_time = self._input_time, None
+        self.ticks += 1
+
+        for action in actions:
+            if callable(action):
+                action()
+            elif self._ready(dt):
+                self._send(action)
+
+        for key, value in velocity.items():
+            self._carry[key] = self._carry.get(key, 0) + value * dt
+        if not self._carry:
+            return
+        if not self._ready(dt / 2):
+            # the motion is kept and sent with the next tick
+            self.skipped += 1
+            if inputTime is not None:
+                with self._lock:
+                    self._input_time = self._input_time or inputTime
+            return
+
+        # cont lets the controller blend the moves of consecutive ticks
+        cmd = {"cmd": "lmove" if coordsys == "cartesian" else "jmove", "rel": 1, "cont": 1,
+               "vel": max(abs(value) for value in velocity.values()) if velocity else self.speed * self.sensitivity}
+        cmd.update(self._carry)
+        self._carry = {}
+        self._send(cmd)
+        if inputTime is not None:
+            self.latencies.append(monotonic() - inputTime)
+
+    def _sender(self):
+        # sends at a fixed rate, a late tick is not made up for
+        period = 1 / self.rate
+        deadline = monotonic()
+        while not self._stop.is_set():
+            try:
+                self.tick(period)
+            except Exception as e:
+                print("Jog command failed: %s" % e)
+            deadline += period
+            now = monotonic()
+            if deadline < now:
+                deadline = now
+            self._stop.wait(deadline - now)
+
+    def run(self, events=None):
+        """
+        Description: This function jogs the arm until the start button is
+        pressed. Controller events are read on this thread, the moves are
+        sent from another one.
+        Parameters: self (obj), events (function) gives the next events,
+        waiting up to the given number of seconds, pygame's queue if not given
+        Returns: report (dict)
+        """
+        if events is None:
+            def events(timeout):
+                # waits for the first event, then takes whatever else is queued
+                event = pygame.event.wait(int(timeout * 1000))
+                return ([event] if event.type != pygame.NOEVENT else []) + pygame.event.get()
+
+        self.started = monotonic()
+        sender = threading.Thread(target=self._sender, daemon=True)
+        sender.start()
+        try:
+            running = True
+            while running:
+                for event in events(self.debounce / 4):
+                    if not self.handle_event(event):
+                        running = False
+                        break
+                self.repeat()
+        finally:
+            self._stop.set()
+            sender.join()
+            self.stopped = monotonic()
+
+        return self.report()
+
+    def report(self):
+        """
+        Description: This function gives the achieved command rate and the
+        delay between the controller and the robot
+        Parameters: self (obj)
+        Returns: report (dict)
+        """
+        elapsed = ((self.stopped or monotonic()) - self.started) if self.started is not None else 0
+        latencies = sorted(self.latencies)
+        report = {
+            "elapsed": elapsed,
+            "ticks": self.ticks,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "tick_rate": self.ticks / elapsed if elapsed else 0,
+            "command_rate": self.sent / elapsed if elapsed else 0,
+        }
+        if latencies:
+            report["latency"] = {
+                "p50": latencies[len(latencies) // 2],
+                "p95": latencies[min(len(latencies)-1, int(len(latencies) * 0.95))],
+                "max": latencies[-1],
+            }
+
+        return report
 
 class RoboticArmController:
     def __init__(self, *args):
@@ -18,17 +319,20 @@ class RoboticArmController:
         self.sensitivity = 1
         self.pos_counter = 0
 
-        # if this class is initialized in the chatbot extension
+        # if this class is initialized in the chatbot extension, the robot is
+        # already connected through its session and stays open afterwards
         if len(args) > 1: 
             self.robot = args[0]
-            self.robot.connect("192.168.2.20")
             self.positions = args[1]
+            self.owns_robot = False
         else:
+            from dorna2 import Dorna
+
             self.robot = Dorna()
-            self.robot.connect("192.168.2.20")
+            self.robot.connect(DEFAULT_HOST)
+            self.owns_robot = True
             self.robot.set_motor(1)
-            with open("positions.json", 'r') as positions_file: 
-                self.positions = json.load(positions_file)
+            self.positions = load_positions("positions.json")
         
     def record_pos(self):
         """
@@ -53,217 +357,41 @@ class RoboticArmController:
             "j4": pos_joint[4],
             "j6": pos_joint[6],
         }
-        self.positions["New Position %d" % self.pos_counter] = current_pos
+        # appends the position to the journal instead of rewriting the file,
+        # the store also updates the positions dictionary
+        store = get_store("positions.json")
+        name = store.next_name("New Position")
+        store.record(name, current_pos)
+        if self.positions is not store.load():
+            self.positions[name] = current_pos
+        print("Recorded %s" % name)
 
-        with open("positions.json", 'w') as filename:
-            json.dump(self.positions, filename, indent = 4)
-        
         self.pos_counter += 1
-    
-    """
-    Description: These functions take the input from the controller and moves in the  
-    cartesian coordinate system accordingly
-    Parameter: self (obj), val (float)
-    Return Val: None
-    """
-    def move_x(self, val):
-        deltaX = val*self.sensitivity
-        self.robot.lmove(rel=1, x=deltaX, vel=100)
-        print("Moving X by this value: %f" % deltaX)
-        print("Current Pos: %s" % self.robot.get_all_pose())
-    def move_y(self, val):
-        deltaY = val*self.sensitivity
-        self.robot.lmove(rel=1, y=deltaY, vel=100)   
-        print("Moving Y by this value: %f" % deltaY)
-        print("Current Pos: %s" % self.robot.get_all_pose())
-    def move_z(self, val):
-        deltaZ = val*self.sensitivity
-        self.robot.lmove(rel=1, z=deltaZ, vel=100)   
-        print("Moving Z by this value: %f" % deltaZ)
-        print("Current Pos: %s" % self.robot.get_all_pose())
-    def move_a(self, val):
-        deltaA = val*self.sensitivity
-        self.robot.lmove(rel=1, a=deltaA, vel=100)   
-        print("Moving A by this value: %f" % deltaA)
-        print("Current Pos: %s" % self.robot.get_all_pose())
-    def move_b(self, val):
-        deltaB = val*self.sensitivity
-        self.robot.lmove(rel=1, b=deltaB, vel=100)   
-        print("Moving B by this value: %f" % deltaB)
-        print("Current Pos: %s" % self.robot.get_all_pose())
-    def move_c(self, val):
-        deltaC = val*self.sensitivity
-        self.robot.lmove(rel=1, c=deltaC, vel=100)   
-        print("Moving C by this value: %f" % deltaC)
-        print("Current Pos: %s" % self.robot.get_all_pose())
-    def move_d(self, val):
-        deltaD = val*self.sensitivity
-        self.robot.lmove(rel=1, d=deltaD, vel=100)   
-        print("Moving D by this value: %f" % deltaD)
-        print("Current Pos: %s" % self.robot.get_all_pose())
-    
-    """
-    Description: These functions take the input from the controller and moves in the  
-    joint coordinate system accordingly
-    Parameter: self (obj), val (float)
-    Return Val: None
-    """
-    def move_j0(self, val):
-        deltaJ0 = val*self.sensitivity
-        j0 = self.robot.get_joint(0)
-        self.robot.jmove(rel=1, j0=deltaJ0, vel=100)
-        print("Moving j0 by this value: %f" % deltaJ0)
-        print("Current Pos: %s" % self.robot.get_all_joint())
-    def move_j1(self, val):
-        deltaJ1 = val*self.sensitivity
-        j1 = self.robot.get_joint(1)
-        self.robot.jmove(rel=1, j1=deltaJ1, vel=100)
-        print("Moving j1 by this value: %f" % deltaJ1)
-        print("Current Pos: %s" % self.robot.get_all_joint())
-    def move_j2(self, val):
-        deltaJ2 = val*self.sensitivity
-        j2 = self.robot.get_joint(2)
-        self.robot.jmove(rel=1, j2=deltaJ2, vel=100)
-        print("Moving j2 by this value: %f" % deltaJ2)
-        print("Current Pos: %s" % self.robot.get_all_joint())
-    def move_j3(self, val):
-        deltaJ3 = val*self.sensitivity
-        j3 = self.robot.get_joint(3)
-        self.robot.jmove(rel=1, j3=deltaJ3, vel=100)
-        print("Moving j3 by this value: %f" % deltaJ3)
-        print("Current Pos: %s" % self.robot.get_all_joint())
-    def move_j4(self, val):
-        deltaJ4 = val*self.sensitivity
-        j4 = self.robot.get_joint(4)
-        self.robot.jmove(rel=1, j4=deltaJ4, vel=100)
-        print("Moving j4 by this value: %f" % deltaJ4)
-        print("Current Pos: %s" % self.robot.get_all_joint())
-    def move_j5(self, val):
-        deltaJ5 = val*self.sensitivity
-        j5 = self.robot.get_joint(5)
-        self.robot.jmove(rel=1, j5=deltaJ5, vel=100)
-        print("Moving j5 by this value: %f" % deltaJ5)
-        print("Current Pos: %s" % self.robot.get_all_joint())
-    def move_j6(self, val):
-        deltaJ6 = val*self.sensitivity
-        j6 = self.robot.get_joint(6)
-        self.robot.jmove(rel=1, j6=deltaJ6, vel=100)
-        print("Moving j6 by this value: %f" % deltaJ6)
-        print("Current Pos: %s" % self.robot.get_all_joint())
 
     def calibrate_arm(self):
         """
-        Description: This function runs a while loop until stopped from by the 
-        controller. This while loop continuously takes input from the controller 
-        to move the robotic arm, records the position of the robotic arm, and 
-        updates settings. 
+        Description: This function jogs the robotic arm with the controller
+        until the start button is pressed. The sticks move the arm, B records
+        the position, Y and A halve and double the sensitivity, X switches
+        between the joint and cartesian coordinate systems, the dpad rotates
+        the claw, the bumpers open and close it and the triggers move the
+        sliding rail. Moves are streamed at a fixed rate by the jog engine.
         Parameters: self (obj)
-        Return Val: None
+        Return Val: report (dict) the achieved command rate and latency
         """
-        while(self.controller.get_button(7) == 0):
-            # updates the event log of the controller
-            pygame.event.pump()
-
-            # record the position if button B is pressed
-            if self.controller.get_button(1) != 0:
-                self.record_pos()
-                sleep(0.3)
-
-            # increase the sensitivty if button Y is pressed
-            if self.controller.get_button(0) != 0:
-                self.sensitivity *= 0.5
-                print("Sensitivity is now %f" % self.sensitivity)
-                sleep(0.3)
-            # decrease the sensitivity if button A is pressed
-            if self.controller.get_button(3) != 0:
-                self.sensitivity *= 2
-                print("Sensitivity is now %f" % self.sensitivity)
-                sleep(0.3)
-
-            # change the coordinate system between joint and cartesian is button X is pressed
-            if self.controller.get_button(2) != 0:
-                if self.coordsys != "joint":
-                    self.coordsys = "joint"
-                else:
-                    self.coordsys = "cartesian"
-                print("Coordinate system is now %s" % self.coordsys)
-                sleep(0.3)
-
-            # controls for the cartesian coordinate system
-            if self.coordsys == "cartesian":
-                # moves the robotic arm in the X-axis if the left joystick is moved left or right
-                if (self.controller.get_axis(0) < -0.05) or (self.controller.get_axis(0) > 0.05):
-                    self.move_x(self.controller.get_axis(0))
-                # moves the robotic arm in the Y-axis if the left joystick is moved up or down
-                if (self.controller.get_axis(1) < -0.05) or (self.controller.get_axis(1) > 0.05):
-                    self.move_y(-self.controller.get_axis(1))
-                # moves the robotic arm in the Z-axis if the right joystick is moved up or down
-                if (self.controller.get_axis(3) < -0.15) or (self.controller.get_axis(3) > 0.15):
-                    self.move_z(-self.controller.get_axis(3))
-                
-                # if the dpad is pushed
-                if self.controller.get_hat(0) != (0,0):
-                    # moves the claw up or down if the dpad is moved up or down
-                    self.move_a(self.controller.get_hat(0)[1])
-                    # moves the claw side to side if the dpad is moved left or right
-                    self.move_b(self.controller.get_hat(0)[0])
-                    sleep(0.3)
-                
-                # closes the claw if the left bumper is pressed
-                if self.controller.get_button(4) != 0:
-                    self.move_c(-1)
-                    sleep(0.3)
-                # opens the claw if the right bumper is pressed
-                if self.controller.get_button(5) != 0:
-                    self.move_c(1)
-                    sleep(0.3)
-
-                # moves the slide rail to the right if the right trigger is pressed
-                if self.controller.get_axis(4) > 0:
-                    self.move_d(1)
-                # moves the slide rail to the left if the left trigger is pressed
-                if self.controller.get_axis(5) > 0:
-                    self.move_d(-1)
-            
-            # controls for the joint coordinate system
-            else:
-                # rotates j0 based on the inputs from moving the left stick left or right
-                if (self.controller.get_axis(0) < -0.05) or (self.controller.get_axis(0) > 0.05):
-                    self.move_j0(self.controller.get_axis(0))
-                # rotates j1 based on the inputs from moving the left stick up or down
-                if (self.controller.get_axis(1) < -0.05) or (self.controller.get_axis(1) > 0.05):
-                    self.move_j1(-self.controller.get_axis(1))
-                # rotates j2 based on the inputs from moving the right stick up or down
-                if (self.controller.get_axis(3) < -0.15) or (self.controller.get_axis(3) > 0.15):
-                    self.move_j2(-self.controller.get_axis(3))
-                
-                # if the dpad is pushed
-                if self.controller.get_hat(0) != (0,0):
-                    # moves the claw up or down if the dpad is moved up or down
-                    self.move_j3(self.controller.get_hat(0)[1])
-                    # moves the claw side to side if the dpad is moved left or right
-                    self.move_j4(self.controller.get_hat(0)[0])
-                    sleep(0.3)
-
-                # closes the claw if the left bumper is pressed
-                if self.controller.get_button(4) != 0:
-                    self.move_j5(-1)
-                    sleep(0.3)
-                # opens the claw if the right bumper is pressed
-                if self.controller.get_button(5) != 0:
-                    self.move_j5(1)
-                    sleep(0.3)
-
-                # moves the slide rail to the right if the right trigger is pressed
-                if self.controller.get_axis(4) > 0:
-                    self.move_j6(1)
-                # moves the slide rail to the left if the left trigger is pressed
-                if self.controller.get_axis(5) > 0:
-                    self.move_j6(-1)
-
+        engine = JogEngine(self.robot, on_record=self.record_pos)
+        engine.coordsys = self.coordsys
+        engine.sensitivity = self.sensitivity
+        report = engine.run()
+        self.coordsys = engine.coordsys
+        self.sensitivity = engine.sensitivity
+        print("Jog report: %s" % report)
 
         pygame.quit()
-        self.robot.close()
+        if self.owns_robot:
+            self.robot.close()
+
+        return report
 
 if __name__ == "__main__":
     # """
@@ -306,7 +434,7 @@ if __name__ == "__main__":
     """
         # Connect to Dorna2 Arm
         robot = Dorna()
-        robot.connect("192.168.2.20")
+        robot.connect(DEFAULT_HOST)
         robot.set_motor(1)
     
     try:
@@ -0,0 +1,308 @@
+import argparse
+import math
+from route_planner import FOLD_POSE
+from station_index import StationIndex
+from position_store import load_positions
+from script_replay import parse_script, find_macro, DEFAULT_PROFILE
+from tracing import PHASE_KEY
+from gripper import Gripper, OPEN, HOLDING
+
+try:
+    from kinematics import forward_dict, inverse_dict
+except ImportError:
+    # without numpy, cartesian moves are approximated from the stations
+    forward_dict = inverse_dict = None
+
+JOINT_KEYS = ("j0", "j1", "j2", "j3", "j4", "j5", "j6", "j7")
+CARTESIAN_KEYS = ("x", "y", "z", "a", "b", "d")
+
+# the initial position of the arm, folded at the start of the rail with the claw open
+START = dict({"j0": 0, "j5": 0, "j6": 0, "j7": 0}, **FOLD_POSE)
+
+# a cartesian target this close (in mm) to a station is reached with about its joints
+STATION_RADIUS = 150
+
+ARM_JOINTS = ("j0", "j1", "j2", "j3", "j4")
+
+def _accel_time(vel, accel, jerk):
+    # time to go from rest to vel, with or without reaching the acceleration limit
+    if vel * jerk >= accel * accel:
+        return vel/accel + accel/jerk
+    return 2 * math.sqrt(vel/jerk)
+
+def profile_time(distance, vel, accel, jerk):
+    """
+    Description: This function gives the duration of a move that starts and
+    ends at rest with a jerk-limited (S-curve) velocity profile. Short moves
+    never reach vel, the peak velocity is then found so that speeding up and
+    slowing down cover exactly the distance.
+    Parameters: distance (float), vel (float), accel (float), jerk (float)
+    Returns: time (float) in seconds, peak (float) the highest velocity reached
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0, 0.0
+
+    # speeding up to vel and slowing down again covers vel*accelTime
+    accelTime = _accel_time(vel, accel, jerk)
+    if distance >= vel * accelTime:
+        return distance/vel + accelTime, vel
+
+    # vel is not reached, the covered distance grows with the peak velocity
+    low, high = 0.0, vel
+    for i in range(60):
+        peak = (low + high) / 2
+        if peak * _accel_time(peak, accel, jerk) < distance:
+            low = peak
+        else:
+            high = peak
+    peak = (low + high) / 2
+
+    return 2 * _accel_time(peak, accel, jerk), peak
+
+class _State:
+    # what is known about the arm between two commands
+    def __init__(self, joints, pose):
+        self.joints = dict(joints)
+        self.pose = dict(pose)
+
+def _norm(deltas):
+    return math.sqrt(sum(value*value for value in deltas.values()))
+
+def _match_joints(joints, stations):
+    # the station the arm is at when its joints are given
+    for station in stations:
+        if all(abs(joints.get(key, float("inf")) - station[key]) < 0.5 for key in ("j0", "j1", "j2", "j3", "j4")):
+            return station
+    return None
+
+def _near_station(pose, stations):
+    # the closest station to a cartesian target, if it is close enough
+    best, bestDistance = None, STATION_RADIUS
+    for station in stations:
+        if any(key not in pose for key in ("x", "y", "z")):
+            return None
+        distance = math.sqrt(sum((pose[key] - station[key])**2 for key in ("x", "y", "z", "d")))
+        if distance < bestDistance:
+            best, bestDistance = station, distance
+    return best
+
+def _pose_of(joints):
+    # the pose of a joint state through the kinematics, None if it can't be told
+    if forward_dict is None or any(key not in joints for key in ARM_JOINTS):
+        return None
+    pose = forward_dict(joints)
+    return {key: pose[key] for key in CARTESIAN_KEYS if key in pose}
+
+def _joints_of(pose, joints):
+    # the joints of a pose through the kinematics, None if it can't be told
+    if inverse_dict is None or any(key not in pose for key in ("x", "y", "z", "a", "b")):
+        return None
+    solved = dict(joints, **inverse_dict({key: pose[key] for key in ("x", "y", "z", "a", "b")}))
+    if "d" in pose:
+        solved["j6"] = pose["d"]
+    return solved
+
+def _target(cmd, current, keys):
+    # the absolute target of a command, joints it doesn't give stay where they are
+    target = dict(current)
+    for key in keys:
+        if key in cmd:
+            if cmd.get("rel", 0):
+                if key in current:
+                    target[key] = current[key] + cmd[key]
+            else:
+                target[key] = cmd[key]
+    return target
+
+def estimate(commands, start=None, stations=()):
+    """
+    Description: This function predicts how long a sequence of commands takes
+    without touching the robot. Every move starts and ends at rest and follows
+    the jerk-limited profile given by its vel, accel and jerk arguments. As on
+    the controller, a jmove interpolates all its joints together, so its
+    length is taken in joint space, and an lmove is taken in cartesian space.
+    The joints and the pose are kept in step through the kinematics, so a
+    jmove given in cartesian coordinates is timed in joint space too and
+    targets out of reach are rejected with a ValueError. Without numpy such a
+    jmove is only approximated, from the joints of the nearest station when
+    there is one and the cartesian distance otherwise. Approximated segments,
+    and those starting from an unknown coordinate, are marked as such.
+    Parameters: commands (list), start (dict) joint values before the first
+    command, the initial position if not given, stations (list) positions
+    holding both the joint and cartesian coordinates
+    Returns: estimate (dict) the segments and the total time
+    """
+    stations = list(stations)
+    state = _State(START if start is None else start, {})
+    station = _match_joints(state.joints, stations)
+    if station is not None:
+        state.pose = {key: station[key] for key in CARTESIAN_KEYS}
+    state.pose = _pose_of(state.joints) or state.pose
+
+    segments = []
+    for index, cmd in enumerate(commands):
+        kind = cmd.get("cmd")
+        segment = {"index": index, "cmd": kind, "phase": cmd.get(PHASE_KEY), "distance": 0.0, "time": 0.0,
+                   "peak": 0.0, "approximate": False}
+
+        if kind == "sleep":
+            segment["time"] = float(cmd.get("time", 0))
+        elif kind in DEFAULT_PROFILE:
+            profile = dict(DEFAULT_PROFILE[kind], **{key: cmd[key] for key in ("vel", "accel", "jerk") if key in cmd})
+            jointTarget = _target(cmd, state.joints, JOINT_KEYS)
+            poseTarget = _target(cmd, state.pose, CARTESIAN_KEYS)
+            cartesian = any(key in cmd for key in CARTESIAN_KEYS)
+
+            # coordinates the command gives but whose current value is unknown
+            unknown = [key for key in JOINT_KEYS + CARTESIAN_KEYS if key in cmd and
+                       key not in (state.pose if key in CARTESIAN_KEYS else state.joints)]
+            segment["approximate"] = bool(unknown)
+
+            if kind == "jmove" and not cartesian:
+                deltas = {key: jointTarget[key] - state.joints[key] for key in jointTarget if key in state.joints}
+                # the claw alone doesn't move the arm, otherwise the pose is only
+                # known when the arm ends up at a station
+                if any(deltas.get(key) for key in ("j0", "j1", "j2", "j3", "j4", "j6")):
+                    match = _match_joints(jointTarget, stations)
+                    poseTarget = {key: match[key] for key in CARTESIAN_KEYS} if match is not None else {}
+                    poseTarget = _pose_of(jointTarget) or poseTarget
+            elif kind == "jmove" and _joints_of(poseTarget, jointTarget) is not None:
+                jointTarget = _joints_of(poseTarget, jointTarget)
+                deltas = {key: jointTarget[key] - state.joints[key] for key in jointTarget if key in state.joints}
+            elif kind == "jmove":
+                # the joints of the station the target is near stand in for the kinematics
+                near = _near_station(poseTarget, stations)
+                segment["approximate"] = True
+                if near is not None:
+                    jointTarget = dict(jointTarget, **{key: near[key] for key in ("j0", "j1", "j2", "j3", "j4", "j6")})
+                    deltas = {key: jointTarget[key] - state.joints[key] for key in jointTarget if key in state.joints}
+                else:
+                    deltas = {key: poseTarget[key] - state.pose[key] for key in poseTarget if key in state.pose}
+            else:
+                deltas = {key: poseTarget[key] - state.pose[key] for key in poseTarget if key in state.pose}
+                solved = _joints_of(poseTarget, jointTarget)
+                if solved is not None:
+                    jointTarget = solved
+                else:
+                    # the joints follow the cartesian move, they stay close to the last known ones
+                    segment["approximate"] = segment["approximate"] or any(key in cmd for key in CARTESIAN_KEYS[:3])
+
+            segment["distance"] = _norm(deltas)
+            segment["time"], segment["peak"] = profile_time(segment["distance"], **profile)
+            segment["joints"] = {key: value for key, value in deltas.items() if value}
+            state = _State(jointTarget, poseTarget)
+        segments.append(segment)
+
+    return {
+        "segments": segments,
+        "total": sum(segment["time"] for segment in segments),
+        "approximate": sum(segment["approximate"] for segment in segments),
+    }
+
+def action_commands(kind, pos, joints=None, extension=False):
+    """
+    Description: This function builds the commands of a grab/place action the
+    same way the robot code does, from movements.py or from the chatbot
+    extension, without connecting to the robot
+    Parameters: kind (str) e.g. grab_from_microscope, pos (dict), joints (list)
+    the joints at the start, extension (bool)
+    Returns: commands (list)
+    """
+    if kind not in ("grab_from_holder", "place_at_holder", "grab_from_microscope", "place_at_microscope"):
+        raise ValueError("Unknown action %s" % kind)
+    grab = kind.startswith("grab")
+    # the claw is open before a grab and holds the plate before a place
+    gripper = Gripper(state=OPEN if grab else HOLDING)
+
+    if extension:
+        from robotic_arm_chatbot_extension import RoboticArm
+
+        # the command builders don't use the connection, so none is opened
+        arm = RoboticArm.__new__(RoboticArm)
+        arm.gripper = gripper
+        if kind.endswith("holder"):
+            return arm.holder_commands(pos, grab, joints)
+        return arm.microscope_commands(pos, grab, joints)
+
+    import movements
+
+    # movements.py grabs or places depending on what the claw holds
+    gripper.vel = movements.CLAW_VEL
+    if kind.endswith("holder"):
+        return movements.holder_commands(pos, gripper, joints)[0]
+    return movements.microscope_commands(pos, gripper, joints)[0]
+
+def estimate_action(kind, position, positions, start=None, extension=False):
+    """
+    Description: This function predicts how long a grab/place action takes
+    Parameters: kind (str), position (str) station name, positions (dict or
+    StationIndex), start (dict) joint values at the start, extension (bool)
+    whether to use the chatbot extension's commands instead of movements.py
+    Returns: estimate (dict)
+    """
+    index = positions if isinstance(positions, StationIndex) else StationIndex(positions)
+    start = dict(START if start is None else start)
+    joints = [start.get(key, 0) for key in JOINT_KEYS]
+
+    commands = action_commands(kind, index.lookup(position), joints, extension)
+
+    return estimate(commands, start, index.stations.values())
+
+def print_estimate(result, commands=None):
+    """
+    Description: This function prints the time of every segment and the total
+    Parameters: result (dict), commands (list) printed next to the segments
+    Returns: None
+    """
+    for segment in result["segments"]:
+        line = "%4d  %-6s %-9s %8.1f  %6.2f s%s" % (segment["index"], segment["cmd"], segment["phase"] or "",
+                                                    segment["distance"], segment["time"], " ~" if segment["approximate"] else "")
+        if commands is not None:
+            line += "  " + str(commands[segment["index"]])
+        print(line)
+    print("Total: %.2f s (%d approximate segments)" % (result["total"], result["approximate"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Predicts the duration of robot command sequences without the robot."
+    )
+    subparsers = parser.add_subparsers(dest="source", required=True)
+
+    actionParser = subparsers.add_parser("action", help="a grab/place action")
+    actionParser.add_argument("kind", help="e.g. grab_from_microscope")
+    actionParser.add_argument("position", help="station name, e.g. MicroscopeLeft2")
+    actionParser.add_argument("--positions", default="positions.json", help="positions file")
+    actionParser.add_argument("--extension", action="store_true", help="use the chatbot extension's commands")
+
+    scriptParser = subparsers.add_parser("script", help="a recorded script")
+    scriptParser.add_argument("script", help="recorded script, e.g. record.txt")
+    scriptParser.add_argument("--section", help="only this section, by index or name")
+    scriptParser.add_argument("--positions", default="positions.json", help="positions file")
+    scriptParser.add_argument("--verbose", "-v", action="store_true", help="print every segment")
+
+    args = parser.parse_args()
+
+    index = StationIndex(load_positions(args.positions))
+    if args.source == "action":
+        result = estimate_action(args.kind, args.position, index, extension=args.extension)
+        print_estimate(result)
+    else:
+        macros = parse_script(args.script)
+        if args.section is not None:
+            macros = [find_macro(macros, args.section)]
+
+        # the whole script is estimated at once so every section starts where the last one ended
+        commands = [cmd for macro in macros for cmd in macro.commands]
+        result = estimate(commands, stations=index.stations.values())
+        first = 0
+        for macro in macros:
+            segments = result["segments"][first:first+len(macro.commands)]
+            first += len(macro.commands)
+            print("%3d  %-40s %3d commands  %7.2f s" % (macro.index, macro.name, len(macro.commands),
+                                                       sum(segment["time"] for segment in segments)))
+            if args.verbose:
+                for segment in segments:
+                    print("      %-6s %8.1f  %6.2f s%s  %s" % (segment["cmd"], segment["distance"], segment["time"],
+                                                            " ~" if segment["approximate"] else "", commands[segment["index"]]))
+        print("Total: %.2f s (%d approximate segments)" % (result["total"], result["approximate"]))
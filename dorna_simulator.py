@@ -0,0 +1,292 @@
+import threading
+from collections import deque
+from time import monotonic
+from cycle_time import DEFAULT_PROFILE, profile_time
+
+try:
+    from kinematics import forward, inverse
+except ImportError:
+    # without numpy the joints and the pose are simulated separately
+    forward = inverse = None
+
+JOINT_KEYS = ("j0", "j1", "j2", "j3", "j4", "j5", "j6", "j7")
+POSE_KEYS = ("x", "y", "z", "a", "b", "c", "d", "e")
+
+# joint limits of the simulated arm in degrees, j5 is the claw and j6 the rail in mm
+LIMITS = {
+    "j0": (-180, 180),
+    "j1": (-90, 180),
+    "j2": (-142, 142),
+    "j3": (-135, 135),
+    "j4": (-360, 360),
+    "j5": (-400, 20),
+    "j6": (-1500, 1500),
+    "j7": (-1000, 1000),
+}
+
+# the initial position of the arm, folded at the start of the rail with the claw open
+START_JOINTS = (0, 100, -100, -88, 0, 0, 0, 0)
+
+# stat of a command as reported by the controller
+QUEUED, RUNNING, DONE, HALTED = 0, 1, 2, -1
+
+# number of commands whose stat is remembered
+STAT_HISTORY = 10000
+
+class SimulatedDorna:
+    """
+    Description: This class stands in for dorna2.Dorna without a robot. It
+    keeps the joint and pose state, checks the joint limits and takes as long
+    as the real arm would to run each motion, following the same jerk-limited
+    profile as the cycle-time estimator, scaled by time_scale (0 runs the
+    motions instantly, 0.01 a hundred times faster than the arm). Commands
+    sent with play(timeout=0) are queued and run one after the other in a
+    worker thread, like on the controller, so the motion executor and the
+    blocking jmove/lmove calls both work. The joints and the pose are kept in
+    step through the kinematics, so cartesian targets out of reach are
+    rejected too. Without numpy, cartesian motions only change the pose and
+    joint motions only the joints.
+    Parameters: time_scale (float), joints (list), pose (list), limits (dict)
+    """
+
+    def __init__(self, time_scale=1.0, joints=START_JOINTS, pose=None, limits=LIMITS):
+        self.time_scale = time_scale
+        self.limits = limits
+        self.joints = [float(value) for value in joints]
+        if pose is not None:
+            self.pose = [float(value) for value in pose]
+        elif forward is not None:
+            self.pose = [float(value) for value in forward(self.joints)]
+        else:
+            self.pose = [0.0] * len(POSE_KEYS)
+        self.motor = 0
+        self.connected = False
+        # simulated seconds of motion run so far
+        self.motion_time = 0.0
+
+        self._queue = deque()
+        self._stat = {}
+        self._last = {}
+        self._next_id = 0
+        self._cond = threading.Condition()
+        self._halt = threading.Event()
+        self._thread = None
+        self._running = None
+        # where the arm will be once every queued command has run
+        self._planned = (list(self.joints), list(self.pose))
+
+    def connect(self, host="localhost", port=443, *args, **kwargs):
+        """
+        Description: This function starts the simulated controller, the host
+        is ignored
+        Parameters: self (obj), host (str), port (int)
+        Returns: (bool)
+        """
+        with self._cond:
+            self.connected = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+        return True
+
+    def close(self):
+        """
+        Description: This function stops the simulated controller
+        Parameters: self (obj)
+        Returns: (bool)
+        """
+        self.halt()
+        with self._cond:
+            self.connected = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        return True
+
+    def _target(self, cmd, joints, pose):
+        # the joints and pose after cmd, starting from joints and pose
+        joints, pose = list(joints), list(pose)
+        relative = cmd.get("rel", 0)
+        for values, keys in ((joints, JOINT_KEYS), (pose, POSE_KEYS)):
+            for i, key in enumerate(keys):
+                if key in cmd:
+                    values[i] = values[i] + cmd[key] if relative else float(cmd[key])
+
+        # the other coordinate system follows through the kinematics
+        if inverse is not None:
+            if any(key in cmd for key in POSE_KEYS):
+                joints = [float(value) for value in inverse(pose)]
+                if any(value != value for value in joints):
+                    raise ValueError("Pose out of reach: %s" % dict(zip(POSE_KEYS, pose)))
+            else:
+                pose = [float(value) for value in forward(joints)]
+
+        for key, value in zip(JOINT_KEYS, joints):
+            low, high = self.limits[key]
+            if not low <= value <= high:
+                raise ValueError("%s=%g is outside of its limits [%g, %g]" % (key, value, low, high))
+
+        return joints, pose
+
+    def play(self, timeout=-1, msg=None, **cmd):
+        """
+        Description: This function sends a command to the simulated
+        controller. Motions are queued, everything else answers right away.
+        Motions that would take a joint past its limits are rejected with a
+        ValueError before anything moves.
+        Parameters: self (obj), timeout (float) -1 waits for the command to
+        complete, 0 doesn't wait, msg (dict) the command as a dictionary
+        Returns: stat (int) of the command
+        """
+        if msg is not None:
+            cmd = dict(msg, **cmd)
+        with self._cond:
+            if not self.connected:
+                raise ConnectionError("The simulated robot is not connected")
+            if "id" not in cmd:
+                self._next_id += 1
+                cmd["id"] = self._next_id
+            cmd_id = cmd["id"]
+            # forgets the oldest finished commands so long runs don't grow without bound
+            while len(self._stat) > STAT_HISTORY:
+                oldest = next(iter(self._stat))
+                if self._stat[oldest] == QUEUED or oldest == self._running:
+                    break
+                del self._stat[oldest]
+
+            if cmd.get("cmd") in ("jmove", "lmove"):
+                self._planned = self._target(cmd, *self._planned)
+                self._stat[cmd_id] = QUEUED
+                self._queue.append(cmd)
+                self._cond.notify_all()
+            else:
+                if cmd.get("cmd") == "motor":
+                    self.motor = int(cmd.get("motor", 0))
+                self._stat[cmd_id] = DONE
+            self._last = {"id": cmd_id, "stat": self._stat[cmd_id]}
+
+        if timeout != 0:
+            self.wait(id=cmd_id, stat=DONE, timeout=timeout)
+
+        return self._stat[cmd_id]
+
+    def wait(self, id=None, stat=DONE, timeout=-1):
+        """
+        Description: This function waits until a command reaches the given
+        stat, or is halted
+        Parameters: self (obj), id (int), stat (int), timeout (float) -1
+        waits forever
+        Returns: stat (int), or None if it was not reached in time
+        """
+        deadline = None if timeout is None or timeout < 0 else monotonic() + timeout
+        with self._cond:
+            while True:
+                current = self._stat.get(id)
+                if current is not None and (current >= stat or current == HALTED):
+                    return current
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def _duration(self, cmd, joints, pose, target):
+        # a jmove interpolates the joints together, anything cartesian is timed in cartesian space
+        newJoints, newPose = target
+        if cmd["cmd"] == "jmove" and not any(key in cmd for key in POSE_KEYS):
+            deltas = [b - a for a, b in zip(joints, newJoints)]
+        else:
+            deltas = [b - a for a, b in zip(pose, newPose)]
+        distance = sum(delta*delta for delta in deltas) ** 0.5
+        profile = dict(DEFAULT_PROFILE[cmd["cmd"]], **{key: cmd[key] for key in ("vel", "accel", "jerk") if key in cmd})
+
+        return profile_time(distance, **profile)[0]
+
+    def _run(self):
+        # the simulated controller, runs the queued motions one after the other
+        while True:
+            with self._cond:
+                while self.connected and not self._queue:
+                    self._cond.wait()
+                if not self.connected:
+                    return
+                cmd = self._queue.popleft()
+                self._stat[cmd["id"]] = RUNNING
+                self._running = cmd["id"]
+                self._last = {"id": cmd["id"], "stat": RUNNING}
+                joints, pose = list(self.joints), list(self.pose)
+                target = self._target(cmd, joints, pose)
+
+            duration = self._duration(cmd, joints, pose, target)
+            start = monotonic()
+            halted = self.time_scale > 0 and self._halt.wait(duration * self.time_scale)
+
+            with self._cond:
+                if halted or self._halt.is_set():
+                    # stops part of the way along the motion
+                    fraction = min(1, (monotonic() - start) / (duration * self.time_scale)) if self.time_scale > 0 and duration else 0
+                    self.joints = [a + (b - a)*fraction for a, b in zip(joints, target[0])]
+                    self.pose = [a + (b - a)*fraction for a, b in zip(pose, target[1])]
+                    self.motion_time += duration * fraction
+                    self._stat[cmd["id"]] = HALTED
+                else:
+                    self.joints, self.pose = target
+                    self.motion_time += duration
+                    self._stat[cmd["id"]] = DONE
+                self._last = {"id": cmd["id"], "stat": self._stat[cmd["id"]]}
+                self._running = None
+                self._cond.notify_all()
+
+    def halt(self):
+        """
+        Description: This function stops the running motion and drops the
+        queued ones
+        Parameters: self (obj)
+        Returns: None
+        """
+        with self._cond:
+            self._halt.set()
+            while self._queue:
+                self._stat[self._queue.popleft()["id"]] = HALTED
+            self._cond.notify_all()
+        # waits for the running motion to stop before motions are accepted again
+        with self._cond:
+            while self._running is not None and self.connected:
+                self._cond.wait(0.01)
+            self._planned = (list(self.joints), list(self.pose))
+            self._halt.clear()
+
+    def jmove(self, timeout=-1, **kwargs):
+        return self.play(timeout=timeout, **dict(kwargs, cmd="jmove"))
+
+    def lmove(self, timeout=-1, **kwargs):
+        return self.play(timeout=timeout, **dict(kwargs, cmd="lmove"))
+
+    def set_motor(self, enable):
+        return self.play(cmd="motor", motor=int(enable))
+
+    def get_joint(self, index):
+        with self._cond:
+            return self.joints[index]
+
+    def get_all_joint(self):
+        with self._cond:
+            return list(self.joints)
+
+    def get_all_pose(self):
+        with self._cond:
+            return list(self.pose)
+
+    def track_cmd(self):
+        with self._cond:
+            return dict(self._last)
+
+    def sys(self):
+        with self._cond:
+            info = {"motor": self.motor, "connected": self.connected, "motion_time": self.motion_time,
+                    "queued": len(self._queue)}
+            info.update(zip(JOINT_KEYS, self.joints))
+            info.update(zip(POSE_KEYS, self.pose))
+        return info
@@ -0,0 +1,346 @@
+import os
+import json
+import asyncio
+import argparse
+from robot_session import RobotSession, DEFAULT_HOST
+from motion_executor import executor_for
+from async_motion import AsyncMotion
+from job_scheduler import JobScheduler
+from station_index import StationIndex
+from position_store import load_positions
+from dorna_simulator import SimulatedDorna, START_JOINTS, LIMITS
+from gripper import gripper_for, HOLDING, OPEN, UNKNOWN
+from tracing import span
+
+# file the arms of the bench are described in
+FLEET = "fleet.json"
+
+# half the length of the rail taken by a carriage with its folded arm, in mm,
+# two arms never come closer than twice this (estimated)
+CARRIAGE = 200
+
+# how long an arm waits for a stretch of rail held by another arm, in s
+RAIL_TIMEOUT = 120
+
+class ArmConfig:
+    """
+    Description: This class is one entry of the arm registry: where the arm
+    is reached, which stations it serves and which part of the shared rail
+    it may use. Rail positions of the bench are the arm's j6 plus its offset.
+    Parameters: name (str), host (str), positions (str) positions file of
+    the arm, stations (list) names it serves, all of them if not given,
+    rail (list) lowest and highest j6, offset (float), park (float) j6 of a
+    simulated arm at the start
+    """
+
+    def __init__(self, name, host=DEFAULT_HOST, positions="positions.json", stations=None, rail=None,
+                 offset=0, park=0):
+        self.name = name
+        self.host = host
+        self.positions = positions
+        self.stations = stations
+        self.rail = tuple(rail) if rail is not None else LIMITS["j6"]
+        self.offset = offset
+        self.park = park
+
+        if self.rail[0] > self.rail[1]:
+            raise ValueError("The rail range of %s is empty: %s" % (name, self.rail))
+
+def load_fleet(path=FLEET):
+    """
+    Description: This function reads the arm registry, a JSON file such as
+        {"arms": [{"name": "left", "host": "192.168.2.20", "rail": [-1100, 0]},
+                  {"name": "right", "host": "192.168.2.21", "rail": [-1100, 0],
+                   "offset": 1500, "positions": "positions_right.json"}]}
+    Without the file, the bench has the one arm at the default address. The
+    rail ranges of the arms, with their carriages, may not overlap on the
+    bench, or an idle arm could block the stations of another for good.
+    Parameters: path (str)
+    Returns: arms (list) of ArmConfig
+    """
+    if not os.path.exists(path):
+        return [ArmConfig("arm")]
+    with open(path, 'r') as file:
+        data = json.load(file)
+
+    arms = [ArmConfig(**entry) for entry in data.get("arms", [])]
+    names = [arm.name for arm in arms]
+    if not arms or len(set(names)) != len(names):
+        raise ValueError("The arms of %s need unique names" % path)
+
+    # the rail ranges on the bench, neighbours may not reach into each other
+    ranges = sorted((arm.rail[0] + arm.offset - CARRIAGE, arm.rail[1] + arm.offset + CARRIAGE, arm.name) for arm in arms)
+    for (low, high, name), (next_low, next_high, next_name) in zip(ranges, ranges[1:]):
+        if next_low < high:
+            raise ValueError("The rail ranges of %s and %s overlap on the bench from %g to %g" % (
+                name, next_name, next_low, min(high, next_high)))
+
+    return arms
+
+class RailReservations:
+    """
+    Description: This class hands out stretches of the shared rail. An arm
+    holds the stretch around where it stands, and has to get the whole
+    stretch it sweeps before moving along the rail, so two arms never claim
+    overlapping j6 ranges. Ranges are in rail positions of the bench and
+    include the length of the carriage.
+    Parameters: None
+    """
+
+    def __init__(self):
+        self.held = {}
+        self._changed = asyncio.Condition()
+
+    def _free(self, name, low, high):
+        return all(high <= otherLow or low >= otherHigh
+                   for other, (otherLow, otherHigh) in self.held.items() if other != name)
+
+    async def acquire(self, name, low, high, timeout=RAIL_TIMEOUT):
+        """
+        Description: This function waits until no other arm holds any part
+        of the stretch and gives it to the arm, in place of what it held
+        Parameters: self (obj), name (str), low (float), high (float),
+        timeout (float) in s
+        Returns: None
+        """
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self._free(name, low, high)), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError("%s could not get the rail from %g to %g, held by %s" % (
+                    name, low, high, {other: held for other, held in self.held.items() if other != name}))
+            self.held[name] = (low, high)
+
+    async def release(self, name, low=None, high=None):
+        """
+        Description: This function gives back the rail an arm holds, keeping
+        the stretch from low to high if given, e.g. where the arm stopped
+        Parameters: self (obj), name (str), low (float), high (float)
+        Returns: None
+        """
+        async with self._changed:
+            if low is None:
+                self.held.pop(name, None)
+            else:
+                self.held[name] = (low, high)
+            self._changed.notify_all()
+
+class ArmWorker:
+    """
+    Description: This class drives one arm of the fleet: its own connection,
+    motion executor and job queue, so the arms run their jobs at the same
+    time without waiting for each other. Before an action moves along the
+    rail, the stretch it sweeps is reserved.
+    Parameters: config (ArmConfig), rail (RailReservations), simulation
+    (bool), time_scale (float)
+    """
+
+    def __init__(self, config, rail, simulation=False, time_scale=1.0):
+        self.config = config
+        self.name = config.name
+        self.rail = rail
+
+        robot = None
+        if simulation:
+            joints = list(START_JOINTS)
+            joints[6] = config.park
+            robot = SimulatedDorna(time_scale, joints=joints)
+        self.session = RobotSession(config.host, robot=robot)
+        self.robot = self.session.robot
+        self.motion = AsyncMotion(self.robot, executor_for(self.robot))
+        self.gripper = gripper_for(self.robot)
+        self.scheduler = JobScheduler(self.run_action)
+
+        # the stations of the arm within its part of the rail
+        index = StationIndex(load_positions(config.positions))
+        low, high = config.rail
+        self.stations = {name: index.lookup(name) for name in (config.stations or index.names())
+                         if low <= index.lookup(name)["j6"] <= high}
+        # rail position of the arm and whether it will hold a plate once its queue has run
+        self.j6 = None
+        self.holding = None
+
+    async def start(self):
+        """
+        Description: This function connects to the arm and reserves the rail
+        where it stands
+        Parameters: self (obj)
+        Returns: None
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.session.start)
+        async with self.session:
+            await loop.run_in_executor(None, self.robot.set_motor, 1)
+            joints = await self.motion.joints()
+        self.j6 = joints[6]
+        self.holding = self.gripper.update(joints[5]) == HOLDING
+        await self.rail.acquire(self.name, *self._stretch(self.j6, self.j6))
+        self.scheduler.start()
+
+    async def stop(self):
+        await self.scheduler.stop()
+        await self.rail.release(self.name)
+        self.session.close()
+
+    def _stretch(self, j6, target):
+        # the rail swept going from j6 to target, with the carriage
+        low, high = sorted((j6 + self.config.offset, target + self.config.offset))
+        return low - CARRIAGE, high + CARRIAGE
+
+    def distance(self, position):
+        # how far along the rail the arm has to go to the station
+        return abs(self.stations[position]["j6"] - self.j6)
+
+    def queued(self):
+        return len(self.scheduler.pending()) + (self.scheduler.current is not None)
+
+    def submit(self, kind, position, priority=0):
+        """
+        Description: This function queues a job on the arm
+        Parameters: self (obj), kind (str), position (str), priority (int)
+        Returns: job (TransferJob)
+        """
+        self.holding = kind.startswith("grab")
+        return self.scheduler.submit(kind, position, priority)
+
+    async def run_action(self, kind, position):
+        """
+        Description: This function carries out one grab/place action, after
+        reserving the rail between the arm and the station
+        Parameters: self (obj), kind (str), position (str)
+        Returns: None
+        """
+        # imported here so that importing the fleet doesn't need the robot code
+        from movements import holder_commands, microscope_commands
+
+        pos = self.stations[position]
+        with span(kind, arm=self.name, position=position):
+            async with self.session:
+                joints = await self.motion.joints()
+                self.j6 = joints[6]
+                state = self.gripper.update(joints[5])
+                if kind.startswith("grab") and state == HOLDING:
+                    raise ValueError("%s is already holding a plate" % self.name)
+                if kind.startswith("place") and state == OPEN:
+                    raise ValueError("%s isn't holding anything to place" % self.name)
+
+                # the movements builders grab or place depending on the claw
+                if kind.endswith("holder"):
+                    commands, state = holder_commands(pos, self.gripper, joints)
+                else:
+                    commands, state = microscope_commands(pos, self.gripper, joints)
+
+                await self.rail.acquire(self.name, *self._stretch(self.j6, pos["j6"]))
+                try:
+                    await self.motion.run(commands)
+                except BaseException:
+                    # the arm may have stopped anywhere on the way, so it
+                    # keeps the whole stretch and its claw is read again
+                    self.gripper.set(UNKNOWN)
+                    self.holding = None
+                    raise
+                self.gripper.set(state)
+
+                # only the rail where the arm stopped stays held
+                self.j6 = pos["j6"]
+                await self.rail.release(self.name, *self._stretch(self.j6, self.j6))
+
+class Fleet:
+    """
+    Description: This class is the dispatcher of the fleet. Jobs are sent to
+    the nearest free arm that serves the station: a grab goes to an arm with
+    an empty claw and a place to an arm that will be holding a plate. Among
+    those, idle arms come first, then the arms closest along the rail.
+    Parameters: configs (list) of ArmConfig, simulation (bool), time_scale (float)
+    """
+
+    def __init__(self, configs, simulation=False, time_scale=1.0):
+        self.rail = RailReservations()
+        self.arms = {config.name: ArmWorker(config, self.rail, simulation, time_scale) for config in configs}
+
+    async def start(self):
+        for arm in self.arms.values():
+            await arm.start()
+
+    async def stop(self):
+        for arm in self.arms.values():
+            await arm.stop()
+
+    def choose(self, kind, position):
+        """
+        Description: This function picks the arm a job goes to
+        Parameters: self (obj), kind (str), position (str)
+        Returns: arm (ArmWorker)
+        """
+        if kind not in ("grab_from_holder", "place_at_holder", "grab_from_microscope", "place_at_microscope"):
+            raise ValueError("Unknown action %s" % kind)
+        grab = kind.startswith("grab")
+
+        serving = [arm for arm in self.arms.values() if position in arm.stations]
+        if not serving:
+            raise ValueError("No arm serves %s" % position)
+        # a plate can only be placed by the arm holding it
+        candidates = [arm for arm in serving if arm.holding != grab]
+        if not candidates:
+            raise ValueError("No arm that serves %s can %s" % (position, "grab a plate" if grab else "place a plate"))
+
+        return min(candidates, key=lambda arm: (arm.queued() > 0, arm.distance(position), arm.queued()))
+
+    def submit(self, kind, position, priority=0):
+        """
+        Description: This function sends a job to the chosen arm
+        Parameters: self (obj), kind (str), position (str), priority (int)
+        Returns: arm (str), job (TransferJob)
+        """
+        arm = self.choose(kind, position)
+
+        return arm.name, arm.submit(kind, position, priority)
+
+    async def run(self, kind, position, priority=0):
+        """
+        Description: This function runs a job on the chosen arm and waits for it
+        Parameters: self (obj), kind (str), position (str), priority (int)
+        Returns: status (dict) of the job, with the arm that ran it
+        """
+        name, job = self.submit(kind, position, priority)
+        info = await job.wait()
+        info["arm"] = name
+
+        return info
+
+    def status(self):
+        """
+        Description: This function describes every arm of the fleet
+        Parameters: self (obj)
+        Returns: status (dict) name -> rail position, claw, queued jobs and
+        the rail held
+        """
+        return {name: {
+            "j6": arm.j6,
+            "holding": arm.holding,
+            "queued": arm.queued(),
+            "rail": self.rail.held.get(name),
+        } for name, arm in self.arms.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs jobs on the arms of the bench, e.g. grab_from_holder:TestPlateHolder1"
+    )
+    parser.add_argument("jobs", nargs="+", help="kind:station, jobs for different arms run at the same time")
+    parser.add_argument("--fleet", default=FLEET, help="arm registry (default: %s)" % FLEET)
+    parser.add_argument("--simulation", action="store_true", help="drive simulated arms")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="simulated motion time (default: 1)")
+    args = parser.parse_args()
+
+    async def main():
+        fleet = Fleet(load_fleet(args.fleet), args.simulation, args.time_scale)
+        await fleet.start()
+        try:
+            jobs = [fleet.run(*job.split(":", 1)) for job in args.jobs]
+            for info in await asyncio.gather(*jobs, return_exceptions=True):
+                print(info)
+            print(fleet.status())
+        finally:
+            await fleet.stop()
+
+    asyncio.run(main())
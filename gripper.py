@@ -0,0 +1,158 @@
+import threading
+from motion_executor import executor_for
+from tracing import phase
+
+# j5 of the open and of the fully closed claw
+OPEN_J5 = 0
+CLOSED_J5 = -375
+
+# how far past the j5 it was measured closed on a plate the claw opens
+# before lifting away, the rest of the opening runs during the lift
+RELEASE_OPENING = 100
+
+# j5 readings this close to OPEN_J5 count as open, and readings this close to
+# CLOSED_J5 or past it as closed, e.g. -381.555 recorded closed on nothing
+TOLERANCE = 5
+
+# velocity of the claw moves
+CLAW_VEL = 175
+
+# states of the claw, holding is closed on a plate
+OPEN, CLOSED, HOLDING, UNKNOWN = "open", "closed", "holding", "unknown"
+
+class Gripper:
+    """
+    Description: This class is the one place that knows the state of the
+    claw: open, closed on nothing, or holding a plate. The state is taken
+    from j5 when the robot is read and kept up to date as actions finish.
+    The claw commands it builds are left out when the claw is already where
+    it has to be, so an action never sends a claw move that does nothing.
+    Parameters: robot (obj), vel (float) velocity of the claw moves, state
+    (str) the state to start from, read from the robot if unknown
+    """
+
+    def __init__(self, robot=None, vel=CLAW_VEL, state=UNKNOWN):
+        self.robot = robot
+        self.vel = vel
+        self._state = state
+        # the last j5 read, only kept until the claw is moved
+        self.j5 = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        # the robot is only asked when nothing is known
+        if self._state == UNKNOWN and self.robot is not None:
+            self.update(self.robot.get_joint(5))
+        return self._state
+
+    def update(self, j5):
+        """
+        Description: This function works out the state from a reading of j5.
+        A claw that stopped between open and closed is on a plate. A fully
+        closed claw is only taken to hold a plate if it was known to.
+        Parameters: self (obj), j5 (float)
+        Returns: state (str)
+        """
+        with self._lock:
+            self.j5 = j5
+            if abs(j5 - OPEN_J5) <= TOLERANCE:
+                self._state = OPEN
+            elif j5 <= CLOSED_J5 + TOLERANCE:
+                self._state = HOLDING if self._state == HOLDING else CLOSED
+            else:
+                self._state = HOLDING
+            return self._state
+
+    def set(self, state):
+        """
+        Description: This function records the state once the commands that
+        lead to it have run, UNKNOWN makes the next read ask the robot
+        Parameters: self (obj), state (str)
+        Returns: None
+        """
+        with self._lock:
+            self._state = state
+            self.j5 = None
+
+    def _move(self, j5):
+        return phase([{"cmd": "jmove", "rel": 0, "j5": j5, "vel": self.vel}], "grip")
+
+    def open_commands(self):
+        """
+        Description: This function builds the command that opens the claw
+        Parameters: self (obj)
+        Returns: commands (list), empty if the claw is open
+        """
+        return [] if self.state == OPEN else self._move(OPEN_J5)
+
+    def close_commands(self):
+        """
+        Description: This function builds the command that closes the claw
+        Parameters: self (obj)
+        Returns: commands (list), empty if the claw is closed already
+        """
+        return [] if self.state in (CLOSED, HOLDING) else self._move(CLOSED_J5)
+
+    def grip_commands(self):
+        """
+        Description: This function builds the command that closes the claw on
+        a plate. It is always sent, the claw has to close on the plate even if
+        it was closed before going down.
+        Parameters: self (obj)
+        Returns: commands (list)
+        """
+        if self.state == HOLDING:
+            raise ValueError("The claw is already holding a plate")
+        return self._move(CLOSED_J5)
+
+    def release_commands(self, lift):
+        """
+        Description: This function builds the commands that let go of a plate
+        and lift the claw away from it. The claw opens RELEASE_OPENING past
+        where it was read closed on the plate, and finishes opening during the
+        lift. Without a reading it opens fully before lifting.
+        Parameters: self (obj), lift (dict) the lmove lifting the claw
+        Returns: commands (list)
+        """
+        if self.state == OPEN:
+            raise ValueError("The claw isn't holding anything to place")
+        release = OPEN_J5 if self.j5 is None else min(OPEN_J5, self.j5 + RELEASE_OPENING)
+        # c is the claw in cartesian moves
+        return self._move(release) + [dict(lift, c=OPEN_J5)]
+
+    def open(self):
+        """
+        Description: This function opens the claw if it isn't open
+        Parameters: self (obj)
+        Returns: None
+        """
+        commands = self.open_commands()
+        if commands:
+            executor_for(self.robot).run(commands)
+        self.set(OPEN)
+
+    def close(self):
+        """
+        Description: This function closes the claw if it isn't closed
+        Parameters: self (obj)
+        Returns: None
+        """
+        commands = self.close_commands()
+        if commands:
+            executor_for(self.robot).run(commands)
+        self.set(CLOSED if self._state != HOLDING else HOLDING)
+
+def gripper_for(robot, vel=CLAW_VEL):
+    """
+    Description: This function returns the gripper attached to the robot,
+    creating it the first time
+    Parameters: robot (obj), vel (float)
+    Returns: gripper (Gripper)
+    """
+    gripper = getattr(robot, "gripper", None)
+    if gripper is None:
+        gripper = Gripper(robot, vel)
+        robot.gripper = gripper
+
+    return gripper
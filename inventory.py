@@ -0,0 +1,242 @@
+import os
+import json
+import argparse
+import threading
+
+# file the changes to the inventory are logged to
+INVENTORY = "inventory.jsonl"
+
+# the log is rewritten as a single snapshot after this many records
+COMPACT_EVERY = 500
+
+# where a plate is while the arm carries it
+CLAW = "claw"
+
+class Inventory:
+    """
+    Description: This class knows which plate is at which station, both
+    ways round, with a dictionary for each direction. Stations it has never
+    seen are unknown, stations a plate was taken from are known to be empty.
+    Every change is appended to a log, one JSON line each, which is replayed
+    when the inventory is created and rewritten as one snapshot every so
+    often. Grab and place requests are checked against it before the arm
+    moves.
+    Parameters: path (str) the log, None keeps the inventory in memory only,
+    compact_every (int)
+    """
+
+    def __init__(self, path=INVENTORY, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        # plate -> station and station -> plate, None for a known empty station
+        self.plates = {}
+        self.stations = {}
+        self._logged = 0
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            self._replay()
+
+    def _replay(self):
+        with open(self.path, 'r') as log:
+            for line in log:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may have been cut off by a crash
+                    continue
+                self._apply(entry)
+                self._logged += 1
+
+    def _apply(self, entry):
+        # carries out one log entry on the dictionaries
+        op = entry["op"]
+        if op == "snapshot":
+            self.stations = dict(entry["stations"])
+            self.plates = {plate: station for station, plate in self.stations.items() if plate is not None}
+        elif op == "move":
+            plate, station = entry["plate"], entry["station"]
+            previous = self.plates.get(plate)
+            if previous is not None:
+                self.stations[previous] = None
+            self.plates[plate] = station
+            self.stations[station] = plate
+        elif op == "remove":
+            station = self.plates.pop(entry["plate"], None)
+            if station is not None:
+                self.stations[station] = None
+        elif op == "clear":
+            self.stations[entry["station"]] = None
+
+    def _log(self, entry):
+        # applies the entry and appends it to the log, the caller holds the lock
+        if self.path is not None:
+            with open(self.path, 'a') as log:
+                log.write(json.dumps(entry) + "\n")
+                log.flush()
+                os.fsync(log.fileno())
+            self._logged += 1
+        self._apply(entry)
+
+    def _compact(self):
+        # rewrites the log as one snapshot, the caller holds the lock
+        temp = self.path + ".tmp"
+        with open(temp, 'w') as log:
+            log.write(json.dumps({"op": "snapshot", "stations": self.stations}) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+        os.replace(temp, self.path)
+        self._logged = 1
+
+    def where(self, plate):
+        """
+        Description: This function finds the station of a plate
+        Parameters: self (obj), plate (str)
+        Returns: station (str), CLAW while it is carried, None if unknown
+        """
+        return self.plates.get(plate)
+
+    def plate_at(self, station):
+        """
+        Description: This function finds the plate at a station
+        Parameters: self (obj), station (str)
+        Returns: plate (str), None if the station is empty or unknown
+        """
+        return self.stations.get(station)
+
+    def check(self, kind, position):
+        """
+        Description: This function rejects a grab or place that can't work
+        with what is known: grabbing from an empty station or while carrying
+        a plate, placing onto an occupied station or with nothing carried
+        Parameters: self (obj), kind (str) e.g. grab_from_holder, position (str)
+        Returns: None
+        """
+        with self._lock:
+            carried = self.stations.get(CLAW)
+            if kind.startswith("grab"):
+                if carried is not None:
+                    raise ValueError("The arm is already carrying %s" % carried)
+                if position in self.stations and self.stations[position] is None:
+                    raise ValueError("There is no plate at %s" % position)
+            else:
+                if CLAW in self.stations and carried is None:
+                    raise ValueError("The arm isn't carrying a plate to place at %s" % position)
+                if self.stations.get(position) is not None:
+                    raise ValueError("%s is already holding %s" % (position, self.stations[position]))
+
+    def record(self, kind, position):
+        """
+        Description: This function records a grab or place that was carried
+        out. A plate grabbed from a station that wasn't known gets a new ID.
+        Parameters: self (obj), kind (str), position (str)
+        Returns: plate (str) that was moved
+        """
+        with self._lock:
+            if kind.startswith("grab"):
+                plate = self.stations.get(position)
+                if plate is None:
+                    # the plate was there before it was known, the move
+                    # below then leaves the station empty
+                    plate = self._new_id()
+                    self._log({"op": "move", "plate": plate, "station": position})
+                self._log({"op": "move", "plate": plate, "station": CLAW})
+            else:
+                plate = self.stations.get(CLAW) or self._new_id()
+                self._log({"op": "move", "plate": plate, "station": position})
+
+            if self.path is not None and self._logged >= self.compact_every:
+                self._compact()
+
+        return plate
+
+    def add(self, plate, station):
+        """
+        Description: This function puts a plate in the inventory, e.g. when it
+        is loaded onto a holder by hand
+        Parameters: self (obj), plate (str), station (str)
+        Returns: None
+        """
+        with self._lock:
+            if self.stations.get(station) not in (None, plate):
+                raise ValueError("%s is already holding %s" % (station, self.stations[station]))
+            self._log({"op": "move", "plate": plate, "station": station})
+
+    def remove(self, plate):
+        """
+        Description: This function takes a plate out of the inventory, its
+        station becomes empty
+        Parameters: self (obj), plate (str)
+        Returns: None
+        """
+        with self._lock:
+            if plate not in self.plates:
+                raise ValueError("Unknown plate %s" % plate)
+            self._log({"op": "remove", "plate": plate})
+
+    def clear(self, station):
+        """
+        Description: This function marks a station as empty, e.g. when a
+        plate was taken away by hand
+        Parameters: self (obj), station (str)
+        Returns: None
+        """
+        with self._lock:
+            plate = self.stations.get(station)
+            self._log({"op": "remove", "plate": plate} if plate is not None else {"op": "clear", "station": station})
+
+    def _new_id(self):
+        counter = len(self.plates) + 1
+        while "plate %d" % counter in self.plates:
+            counter += 1
+
+        return "plate %d" % counter
+
+    def copy(self):
+        """
+        Description: This function makes a copy kept in memory only, e.g. to
+        try out a sequence of requests without logging anything
+        Parameters: self (obj)
+        Returns: inventory (Inventory)
+        """
+        inventory = Inventory(None)
+        with self._lock:
+            inventory.plates = dict(self.plates)
+            inventory.stations = dict(self.stations)
+
+        return inventory
+
+    def snapshot(self):
+        """
+        Description: This function lists every known station with its plate
+        Parameters: self (obj)
+        Returns: stations (dict) station -> plate, None if empty
+        """
+        with self._lock:
+            return dict(self.stations)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Shows and edits the plate inventory."
+    )
+    parser.add_argument("--inventory", default=INVENTORY, help="inventory log (default: %s)" % INVENTORY)
+    commands = parser.add_subparsers(dest="command")
+    add = commands.add_parser("add", help="a plate was put on a station by hand")
+    add.add_argument("plate")
+    add.add_argument("station")
+    remove = commands.add_parser("remove", help="a plate was taken away by hand")
+    remove.add_argument("plate")
+    clear = commands.add_parser("clear", help="a station is empty")
+    clear.add_argument("station")
+    args = parser.parse_args()
+
+    inventory = Inventory(args.inventory)
+    if args.command == "add":
+        inventory.add(args.plate, args.station)
+    elif args.command == "remove":
+        inventory.remove(args.plate)
+    elif args.command == "clear":
+        inventory.clear(args.station)
+
+    for station, plate in sorted(inventory.snapshot().items()):
+        print("%-20s %s" % (station, plate if plate is not None else "-"))
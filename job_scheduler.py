@@ -0,0 +1,343 @@
+import asyncio
+import heapq
+import itertools
+from time import monotonic
+
+class TransferJob:
+    """
+    Description: This class holds one request for the robotic arm, such as
+    grabbing from a holder, and keeps track of its status
+    Parameters: job_id (int), kind (str), position (str), priority (int),
+    estimate (float) how long the job is expected to take in s
+    """
+
+    __slots__ = ("id", "kind", "position", "priority", "status", "error", "result",
+                 "submitted", "started", "finished", "requests", "estimate",
+                 "phase", "step", "events", "_remaining", "_reported", "_future")
+
+    def __init__(self, job_id, kind, position, priority=0, estimate=None):
+        self.id = job_id
+        self.kind = kind
+        self.position = position
+        self.priority = priority
+        # queued -> running -> done/failed, or cancelled
+        self.status = "queued"
+        self.error = None
+        # what run_action returned, if anything
+        self.result = None
+        self.submitted = monotonic()
+        self.started = None
+        self.finished = None
+        # how many identical requests were collapsed into this job
+        self.requests = 1
+        # progress reported by the action while it runs: the phase it is in,
+        # when each phase started and the time left when it was last reported
+        self.estimate = estimate
+        self.phase = None
+        self.step = None
+        self.events = []
+        self._remaining = None
+        self._reported = None
+        self._future = asyncio.get_running_loop().create_future()
+
+    @property
+    def key(self):
+        return (self.kind, self.position)
+
+    def report(self, phase, remaining=None, step=None):
+        """
+        Description: This function records the progress of the running job
+        Parameters: self (obj), phase (str) e.g. approach, remaining (float)
+        time left in s, step (int) of a sequence
+        Returns: None
+        """
+        now = monotonic()
+        if phase != self.phase or step != self.step:
+            event = {"phase": phase, "at": now - self.started}
+            if step is not None:
+                event["step"] = step
+            self.events.append(event)
+        self.phase = phase
+        self.step = step
+        if remaining is not None:
+            self._remaining = remaining
+            self._reported = now
+
+    def remaining(self):
+        """
+        Description: This function estimates how long the job still takes
+        Parameters: self (obj)
+        Returns: time (float) in s, None if nothing is known
+        """
+        if self._reported is not None:
+            return max(0.0, self._remaining - (monotonic() - self._reported))
+        if self.started is not None and self.estimate is not None:
+            return max(0.0, self.estimate - (monotonic() - self.started))
+
+        return self.estimate
+
+    async def wait(self):
+        """
+        Description: This function waits until the job has been run
+        Parameters: self (obj)
+        Returns: status (dict)
+        """
+        await asyncio.shield(self._future)
+
+        return self.info()
+
+    def info(self):
+        """
+        Description: This function describes the job
+        Parameters: self (obj)
+        Returns: status (dict)
+        """
+        info = {
+            "id": self.id,
+            "kind": self.kind,
+            "position": self.position,
+            "priority": self.priority,
+            "status": self.status,
+            "requests": self.requests,
+        }
+        if self.started is not None:
+            info["waited"] = self.started - self.submitted
+        if self.finished is not None and self.started is not None:
+            info["duration"] = self.finished - self.started
+        if self.phase is not None:
+            info["phase"] = self.phase
+        if self.step is not None:
+            info["step"] = self.step
+        if self.events:
+            info["events"] = list(self.events)
+        if self.error is not None:
+            info["error"] = self.error
+        if self.result is not None:
+            info["result"] = self.result
+
+        return info
+
+class JobScheduler:
+    """
+    Description: This class owns the robotic arm. Requests from any number of
+    chat sessions are put in a priority queue and a single worker runs them
+    one after the other, so commands for different requests never interleave
+    on the arm. A request that is identical to one still waiting in the queue
+    is collapsed into it instead of moving the arm twice.
+    Parameters: run_action (coroutine function) called as
+    run_action(kind, position) to carry out a job, what it returns is kept
+    with the job, history (int), estimate (function) called as
+    estimate(kind, position) for the time a job takes in s, used for the ETAs
+    """
+
+    def __init__(self, run_action, history=100, estimate=None):
+        self.run_action = run_action
+        self.history = history
+        self.estimate = estimate
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._ids = itertools.count(1)
+        # every job by id, and the queued ones by (kind, position)
+        self._jobs = {}
+        self._queued = {}
+        self._wakeup = None
+        self._worker = None
+        self._task = None
+        self.current = None
+
+    def start(self):
+        """
+        Description: This function starts the worker on the running event loop
+        Parameters: self (obj)
+        Returns: None
+        """
+        if self._worker is None:
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._work())
+
+    async def stop(self):
+        """
+        Description: This function stops the worker once the current job is
+        finished. Jobs still in the queue are cancelled.
+        Parameters: self (obj)
+        Returns: None
+        """
+        for job in list(self._queued.values()):
+            self.cancel(job.id)
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def submit(self, kind, position, priority=0):
+        """
+        Description: This function queues a job, higher priorities run first
+        and equal priorities run in the order they were submitted
+        Parameters: self (obj), kind (str), position (str), priority (int)
+        Returns: job (TransferJob)
+        """
+        self.start()
+
+        # collapses a duplicate of a job that hasn't started yet
+        job = self._queued.get((kind, position))
+        if job is not None:
+            job.requests += 1
+            if priority > job.priority:
+                # re-queues it with the higher priority, the old entry is skipped
+                job.priority = priority
+                heapq.heappush(self._queue, (-priority, next(self._counter), job))
+            return job
+
+        estimate = None
+        if self.estimate is not None:
+            try:
+                estimate = self.estimate(kind, position)
+            except Exception as e:
+                print("Could not estimate %s %s: %s" % (kind, position, e))
+        job = TransferJob(next(self._ids), kind, position, priority, estimate)
+        self._jobs[job.id] = job
+        self._queued[job.key] = job
+        heapq.heappush(self._queue, (-priority, next(self._counter), job))
+        self._wakeup.set()
+
+        return job
+
+    async def run(self, kind, position, priority=0):
+        """
+        Description: This function queues a job and waits for it to be run
+        Parameters: self (obj), kind (str), position (str), priority (int)
+        Returns: status (dict)
+        """
+        return await self.submit(kind, position, priority).wait()
+
+    def cancel(self, job_id):
+        """
+        Description: This function cancels a job. A running job is stopped
+        where it is, which halts the robot.
+        Parameters: self (obj), job_id (int)
+        Returns: (bool) whether the job was cancelled
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.status not in ("queued", "running"):
+            return False
+        if job.status == "running":
+            # the worker marks the job as cancelled once the action has stopped
+            job.status = "cancelling"
+            self._task.cancel()
+            return True
+        job.status = "cancelled"
+        del self._queued[job.key]
+        job._future.set_result(job.status)
+
+        return True
+
+    def _waiting(self):
+        # the queued jobs in the order they will run
+        return sorted(self._queued.values(), key=lambda job: (-job.priority, job.submitted))
+
+    def eta(self, job_id):
+        """
+        Description: This function estimates how long until a job is
+        finished: what is left of the running job plus the jobs ahead of it
+        Parameters: self (obj), job_id (int)
+        Returns: time (float) in s, None if it can't be told
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.status not in ("queued", "running", "cancelling"):
+            return None
+
+        total = 0.0
+        for other in ([self.current] if self.current is not None else []) + self._waiting():
+            remaining = other.remaining()
+            if remaining is None:
+                return None
+            total += remaining
+            if other is job:
+                return total
+
+        return None
+
+    def _info(self, job):
+        info = job.info()
+        eta = self.eta(job.id)
+        if eta is not None:
+            info["eta"] = eta
+
+        return info
+
+    def status(self, job_id):
+        """
+        Description: This function gives the status of one job, with its ETA
+        while it is queued or running
+        Parameters: self (obj), job_id (int)
+        Returns: status (dict) or None if the job is unknown
+        """
+        job = self._jobs.get(job_id)
+
+        return self._info(job) if job is not None else None
+
+    def pending(self):
+        """
+        Description: This function lists the jobs that are still waiting, in
+        the order they will run
+        Parameters: self (obj)
+        Returns: jobs (list)
+        """
+        return [self._info(job) for job in self._waiting()]
+
+    def _next_job(self):
+        while self._queue:
+            priority, count, job = heapq.heappop(self._queue)
+            # skips cancelled jobs and entries left behind by a priority raise
+            if job.status == "queued" and -priority == job.priority:
+                return job
+
+        return None
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status not in ("queued", "running", "cancelling")]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    async def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            del self._queued[job.key]
+            job.status = "running"
+            job.started = monotonic()
+            self.current = job
+            # the action runs as a task of its own so it can be cancelled
+            # without stopping the worker
+            self._task = asyncio.ensure_future(self.run_action(job.kind, job.position))
+            try:
+                job.result = await self._task
+                job.status = "done"
+            except asyncio.CancelledError as e:
+                job.result = getattr(e, "result", None)
+                if job.status != "cancelling":
+                    # the worker itself is being stopped
+                    job.status = "cancelled"
+                    self._task.cancel()
+                    raise
+                job.status = "cancelled"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                # an action may tell how far it got before it failed
+                job.result = getattr(e, "result", None)
+            finally:
+                job.finished = monotonic()
+                self.current = None
+                self._task = None
+                if not job._future.done():
+                    job._future.set_result(job.status)
+                self._forget_old_jobs()
@@ -0,0 +1,134 @@
+import numpy as np
+
+# link lengths of the Dorna 2 in mm, with the claw mounted: the offset of the
+# shoulder from the base axis, the upper arm, the forearm, the wrist to the
+# tip of the claw and the height of the shoulder above the table. They were
+# fitted to the joint/cartesian pairs recorded by the controller in
+# positions.txt, which they reproduce within 0.1 mm.
+L0 = 95.48
+L1 = 203.2
+L2 = 152.4
+L3 = 49.46
+H = 218.96
+
+# order of the values given by get_all_joint() and get_all_pose()
+JOINT_KEYS = ("j0", "j1", "j2", "j3", "j4", "j5", "j6", "j7")
+POSE_KEYS = ("x", "y", "z", "a", "b", "c", "d", "e")
+
+def _pad(values):
+    # makes sure there are 8 values in the last dimension, missing ones are 0
+    values = np.asarray(values, dtype=float)
+    if values.shape[-1] < 8:
+        padding = np.zeros(values.shape[:-1] + (8 - values.shape[-1],))
+        values = np.concatenate([values, padding], axis=-1)
+    return values
+
+def forward(joints):
+    """
+    Description: This function works out the cartesian pose from the joints.
+    Any number of joint states can be given at once as the rows of an array.
+    a is the pitch of the claw (j1+j2+j3) and b its roll (j4), the claw (c),
+    the rail (d) and the spare axis (e) are the joints j5, j6 and j7.
+    Parameters: joints (array) shape (..., 8) in the order of get_all_joint(),
+    j5 to j7 may be left out
+    Returns: pose (array) shape (..., 8) in the order of get_all_pose()
+    """
+    joints = _pad(joints)
+    j0, j1, j2, j3 = np.radians(joints[..., :4]).swapaxes(0, -1)
+    j12 = j1 + j2
+    j123 = j12 + j3
+
+    # distance from the base axis and height of the tip of the claw
+    r = L0 + L1*np.cos(j1) + L2*np.cos(j12) + L3*np.cos(j123)
+    z = H + L1*np.sin(j1) + L2*np.sin(j12) + L3*np.sin(j123)
+
+    pose = np.empty_like(joints)
+    pose[..., 0] = r * np.cos(j0)
+    pose[..., 1] = r * np.sin(j0)
+    pose[..., 2] = z
+    pose[..., 3] = np.degrees(j123)
+    pose[..., 4] = joints[..., 4]
+    pose[..., 5:] = joints[..., 5:]
+
+    return pose
+
+def inverse(pose):
+    """
+    Description: This function works out the joints from the cartesian pose,
+    with the elbow up as the arm is used on the table. Any number of poses
+    can be solved at once as the rows of an array, such as every station or a
+    grid of holder positions. Poses out of reach give NaN joints.
+    Parameters: pose (array) shape (..., 8) in the order of get_all_pose(),
+    c to e may be left out
+    Returns: joints (array) shape (..., 8) in the order of get_all_joint()
+    """
+    pose = _pad(pose)
+    x, y, z, a = pose[..., 0], pose[..., 1], pose[..., 2], np.radians(pose[..., 3])
+
+    # the wrist is found by going back along the claw
+    j0 = np.arctan2(y, x)
+    r = np.hypot(x, y) - L0 - L3*np.cos(a)
+    h = z - H - L3*np.sin(a)
+
+    # the elbow angle from the law of cosines, out of reach when |cos| > 1
+    cosine = (r*r + h*h - L1*L1 - L2*L2) / (2*L1*L2)
+    with np.errstate(invalid="ignore"):
+        j2 = -np.arccos(np.where(np.abs(cosine) <= 1, cosine, np.nan))
+    j1 = np.arctan2(h, r) - np.arctan2(L2*np.sin(j2), L1 + L2*np.cos(j2))
+
+    joints = np.empty_like(pose)
+    joints[..., 0] = np.degrees(j0)
+    joints[..., 1] = np.degrees(j1)
+    joints[..., 2] = np.degrees(j2)
+    joints[..., 3] = np.degrees(a - j1 - j2)
+    joints[..., 4] = pose[..., 4]
+    joints[..., 5:] = pose[..., 5:]
+
+    return joints
+
+def reachable(pose):
+    """
+    Description: This function tells which poses the arm can reach
+    Parameters: pose (array) shape (..., 8)
+    Returns: mask (array) of bools
+    """
+    return ~np.isnan(inverse(pose)).any(axis=-1)
+
+def forward_dict(pos):
+    """
+    Description: This function works out the cartesian coordinates of a
+    position given by its joints, such as an entry of positions.json
+    Parameters: pos (dict) with j0 to j4, and j5 to j7 if known
+    Returns: pose (dict) x, y, z, a, b and c, d, e for the joints given
+    """
+    pose = forward([pos.get(key, 0) for key in JOINT_KEYS])
+    return {key: float(value) for key, joint, value in zip(POSE_KEYS, JOINT_KEYS, pose)
+            if joint in pos or key in ("x", "y", "z", "a", "b")}
+
+def inverse_dict(pos):
+    """
+    Description: This function works out the joints of a position given by
+    its cartesian coordinates, unreachable positions are rejected
+    Parameters: pos (dict) with x, y, z, a, b, and c, d, e if known
+    Returns: joints (dict) j0 to j4 and j5, j6, j7 for the coordinates given
+    """
+    joints = inverse([pos.get(key, 0) for key in POSE_KEYS])
+    if np.isnan(joints).any():
+        raise ValueError("Position out of reach: %s" % pos)
+    return {key: float(value) for key, coordinate, value in zip(JOINT_KEYS, POSE_KEYS, joints)
+            if coordinate in pos or key in ("j0", "j1", "j2", "j3", "j4")}
+
+def solve_positions(positions):
+    """
+    Description: This function solves the joints of every position that has
+    cartesian coordinates in one go, e.g. to check the stations of
+    positions.json against their recorded joints
+    Parameters: positions (dict) name -> position
+    Returns: joints (dict) name -> array of 8 joints, NaN if out of reach
+    """
+    names = [name for name, pos in positions.items() if all(key in pos for key in ("x", "y", "z", "a", "b"))]
+    if not names:
+        return {}
+    solved = inverse([[positions[name].get(key, 0) for key in POSE_KEYS] for name in names])
+
+    return dict(zip(names, solved))
@@ -0,0 +1,259 @@
+import threading
+from time import monotonic_ns
+from tracing import TRACER, PHASE_KEY
+
+# corner radius in mm through which blended moves go from one to the next
+CORNER = 10
+
+# phases that need the arm to stand still before and after them, the claw
+# touches the sample or the plate there, and the lift out of the microscope
+# stage is too short to start moving sideways before it ends
+STOP_PHASES = ("descend", "grip", "lift")
+
+def blend(commands, corner=CORNER, stops=STOP_PHASES):
+    """
+    Description: This function lets the controller run consecutive moves as
+    one continuous path: each move is sent with cont so the arm doesn't stop
+    at its end, and turns into the next one through a corner of the given
+    radius. The moves of the stop phases, the moves leading into them and
+    the last move still stop exactly at their target. This relies on the
+    next move being queued on the controller in time, which the executor's
+    lookahead does.
+    Parameters: commands (list), corner (float) in mm, 0 keeps every stop,
+    stops (list) phases that stay exact
+    Returns: commands (list) the same list
+    """
+    if not corner:
+        return commands
+
+    for cmd, nextCmd in zip(commands, commands[1:]):
+        if cmd.get("cmd") not in ("jmove", "lmove") or nextCmd.get("cmd") not in ("jmove", "lmove"):
+            continue
+        if cmd.get(PHASE_KEY) in stops or nextCmd.get(PHASE_KEY) in stops:
+            continue
+        cmd["cont"] = 1
+        cmd["corner"] = corner
+
+    return commands
+
+class MotionHandle:
+    """
+    Description: This class is the single completion handle for an action that
+    was submitted to the motion executor. It can be polled, waited on or
+    cancelled while the commands are still streaming to the robot.
+    Parameters: commands (list), progress (function) called with the handle
+    each time a command has completed, on the streaming thread
+    """
+
+    def __init__(self, commands, progress=None):
+        self.commands = commands
+        self.progress = progress
+        # number of commands handed to the controller and finished by it
+        self.sent = 0
+        self.completed = 0
+        self.cancelled = False
+        self.error = None
+        self._done = threading.Event()
+        self._cancel = threading.Event()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def done(self):
+        """
+        Description: This function tells whether the action has finished,
+        failed or been cancelled
+        Parameters: self (obj)
+        Returns: (bool)
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Description: This function blocks until every command of the action
+        has completed on the controller. Errors from the streaming thread are
+        raised here.
+        Parameters: self (obj), timeout (float)
+        Returns: (bool) whether the action finished within the timeout
+        """
+        finished = self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return finished
+
+    def cancel(self):
+        """
+        Description: This function stops the action. Commands that have not
+        been sent yet are dropped and the robot is halted.
+        Parameters: self (obj)
+        Returns: None
+        """
+        self._cancel.set()
+
+    def add_done_callback(self, callback):
+        """
+        Description: This function registers a function to be called with the
+        handle once the action is over. It is called right away if the action
+        is already over.
+        Parameters: self (obj), callback (function)
+        Returns: None
+        """
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _completed(self):
+        self.completed += 1
+        if self.progress is not None:
+            try:
+                self.progress(self)
+            except Exception as e:
+                print("Motion progress callback failed: %s" % e)
+
+    def _finish(self):
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print("Motion callback failed: %s" % e)
+
+class MotionExecutor:
+    """
+    Description: This class streams a whole action, given as an ordered list
+    of commands such as {"cmd": "jmove", "rel": 0, "j0": 90, "vel": 200}, to
+    the robot. Up to `lookahead` commands are kept queued on the controller so
+    it can plan the next segment while the current one is running, instead of
+    idling for a round-trip between every move.
+    Parameters: robot (obj), lookahead (int), timeout (float), poll (float)
+    """
+
+    def __init__(self, robot, lookahead=4, timeout=60, poll=0.05):
+        self.robot = robot
+        self.lookahead = max(1, lookahead)
+        self.timeout = timeout
+        self.poll = poll
+        # only one action may be streaming to the arm at a time
+        self._lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._next_id = 1000
+
+    def submit(self, commands, progress=None):
+        """
+        Description: This function starts streaming the commands in the
+        background and returns straight away
+        Parameters: self (obj), commands (list), progress (function) called
+        with the handle each time a command has completed
+        Returns: handle (MotionHandle)
+        """
+        handle = MotionHandle(list(commands), progress)
+        thread = threading.Thread(target=self._stream, args=(handle,), daemon=True)
+        thread.start()
+
+        return handle
+
+    def run(self, commands):
+        """
+        Description: This function streams the commands and waits until the
+        robot has finished all of them
+        Parameters: self (obj), commands (list)
+        Returns: handle (MotionHandle)
+        """
+        handle = self.submit(commands)
+        handle.wait()
+
+        return handle
+
+    def _new_id(self):
+        with self._id_lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _wait_for(self, handle, cmd_id):
+        """
+        Description: This function waits for one queued command to complete,
+        checking for a cancellation in between
+        Parameters: self (obj), handle (MotionHandle), cmd_id (int)
+        Returns: (bool) False if the action was cancelled
+        """
+        waited = 0
+        while not handle._cancel.is_set():
+            # stat 2 is reported by the controller once a command is done
+            if self.robot.wait(id=cmd_id, stat=2, timeout=self.poll):
+                return True
+            waited += self.poll
+            if waited >= self.timeout:
+                raise TimeoutError("Command %d did not complete in %s s" % (cmd_id, self.timeout))
+
+        return False
+
+    def _stream(self, handle):
+        with self._lock:
+            # ids of the commands that are queued on the controller
+            pending = []
+            # when each command was sent and finished, only kept while tracing
+            trace = TRACER.enabled
+            sent, finished = [], []
+            try:
+                for cmd in handle.commands:
+                    # keeps at most `lookahead` commands queued on the controller
+                    while len(pending) >= self.lookahead:
+                        if not self._wait_for(handle, pending.pop(0)):
+                            break
+                        handle._completed()
+                        if trace:
+                            finished.append(monotonic_ns())
+                    if handle._cancel.is_set():
+                        break
+
+                    # sends the command without waiting for it to finish,
+                    # the phase tag is only for tracing and stays here
+                    cmd_id = self._new_id()
+                    cmd = dict(cmd, id=cmd_id)
+                    cmd.pop(PHASE_KEY, None)
+                    self.robot.play(timeout=0, **cmd)
+                    pending.append(cmd_id)
+                    handle.sent += 1
+                    if trace:
+                        sent.append(monotonic_ns())
+
+                # waits for the remaining commands to finish
+                while pending and not handle._cancel.is_set():
+                    if not self._wait_for(handle, pending.pop(0)):
+                        break
+                    handle._completed()
+                    if trace:
+                        finished.append(monotonic_ns())
+            except Exception as e:
+                handle.error = e
+                handle._cancel.set()
+            finally:
+                # stops the robot if the action did not run to completion
+                if handle._cancel.is_set():
+                    handle.cancelled = handle.error is None
+                    try:
+                        self.robot.halt()
+                    except Exception:
+                        pass
+                if trace and finished:
+                    # a command starts once it is sent and the one before it is done
+                    started = [max(sent[i], finished[i-1]) if i else sent[0] for i in range(len(finished))]
+                    TRACER.add_phases(handle.commands, started, finished)
+                handle._finish()
+
+def executor_for(robot, lookahead=4):
+    """
+    Description: This function returns the motion executor attached to the
+    robot, creating it the first time
+    Parameters: robot (obj), lookahead (int)
+    Returns: executor (MotionExecutor)
+    """
+    executor = getattr(robot, "motion_executor", None)
+    if executor is None:
+        executor = MotionExecutor(robot, lookahead=lookahead)
+        robot.motion_executor = executor
+
+    return executor
@@ -1,10 +1,20 @@
-from dorna2 import Dorna
 from time import sleep
+from motion_executor import executor_for, blend, CORNER
+from route_planner import plan_route, load_envelopes
+from robot_session import DEFAULT_HOST
+from position_store import load_positions
+from station_index import MICROSCOPE_SPACING, parse_microscope, microscope_position
+from tracing import span, phase
+from gripper import gripper_for, HOLDING, OPEN, UNKNOWN
+
+# velocity of the claw moves
+CLAW_VEL = 80
 
 def robot_info(robot, funcname):
     """
     Description: This function displays the commands sent to the robot and
-    information stored about the robot
+    information stored about the robot. It asks the robot, so it is only for
+    debugging, the actions record their timing with tracing.span() instead.
     Parameters: robot (obj), funcname (str)
     Returns: None
     """
@@ -14,30 +24,8 @@ def robot_info(robot, funcname):
     print(robot.track_cmd())
 
 def calculateDeltaD():
-    # distance between microscopes in mm
-    dist = 800
-    # converst the distance between microscopes to the change in d
-    deltaD = dist * (256.76-254.2)/7
-
-    return deltaD
-
-def move_claw(clawOpen):
-    """
-    Description: This function determines whether or not the claw is open.
-    If the claw is open, it closes it. If the claw is closed, it opens it. 
-    Parameters: clawOpen (bool)
-    Returns: j5 (float) clawOpen (bool)
-    """
-
-    # if the claw is open, it sets the claw to close and vise versa
-    if clawOpen:
-        j5 = -375
-        clawOpen = False
-    else:
-        j5 = 0
-        clawOpen = True
-
-    return j5, clawOpen
+    # change in d between two microscopes
+    return MICROSCOPE_SPACING
 
 def counter_j0(robot):
     """
@@ -61,113 +49,105 @@ def counter_j0(robot):
         vel=200
     )
 
-def pickup(robot, pos, clawOpen, microscope):
+def pickup_commands(pos, gripper, microscope):
     """
-    Description:
-    Parameters: robot (obj), pos (dict), clawOpen (bool)
-    Return: clawOpen (bool)
+    Description: This function builds the commands that lower the claw, 
+    grab or release the sample and lift it back up. A claw holding a plate
+    releases it, otherwise it grabs one.
+    Parameters: pos (dict), gripper (Gripper), microscope (bool)
+    Return: commands (list), state (str) of the claw once they have run
     """
-    # lowers the claw
-    robot.lmove(
-        z = pos["z"]-59,
-        vel = 50
-    )
-    # displays robot information
-    robot_info(robot, "pickup")
+    grab = gripper.state != HOLDING
 
-    # gets the position to which the claw needs to go
-    j5, clawOpen = move_claw(clawOpen)
-    print(j5)
-    print(clawOpen)
+    # the claw has to be open to go down around the plate
+    commands = gripper.open_commands() if grab else []
 
-    # closes the claw
-    robot.jmove(
-        rel=0,
-        j5 = j5,
-        vel = 80
-    )
-    # displays robot information
-    robot_info(robot, "pickup close claw")
+    # lowers the claw
+    commands += phase([{"cmd": "lmove", "z": pos["z"]-59, "vel": 50}], "descend")
 
-    # lifts up the claw
+    # lifts up the claw, if it's for the microscope, it doesn't lift as much
     if microscope:
-        robot.lmove(
-            z=pos["z"]-57+24,
-            vel = 50
-        )
+        lift = phase([{"cmd": "lmove", "z": pos["z"]-57+24, "vel": 50}], "lift")
     else:
-        robot.lmove(
-        z = pos["z"], 
-        vel = 50
-    )
-    # displays robot information
-    robot_info(robot, "pickup lifts claw")
+        lift = phase([{"cmd": "lmove", "z": pos["z"], "vel": 50}], "lift")
+
+    # closes the claw on the plate, or lets go of it and opens during the lift
+    if grab:
+        commands += gripper.grip_commands() + lift
+    else:
+        commands += gripper.release_commands(lift[0])
+
+    return commands, HOLDING if grab else OPEN
+
+def _run_action(robot, name, commands, state, **args):
+    # runs the commands of an action and keeps track of the claw, the args
+    # are recorded on its span
+    gripper = gripper_for(robot, CLAW_VEL)
+    try:
+        with span(name, **args):
+            executor_for(robot).run(commands)
+    except Exception:
+        # the claw may have stopped anywhere, it is read again next time
+        gripper.set(UNKNOWN)
+        raise
+    gripper.set(state)
+
+    return state
 
-    return clawOpen
+def pickup(robot, pos, microscope):
+    """
+    Description: This function lowers the claw, grabs or releases the
+    sample, then lifts back up
+    Parameters: robot (obj), pos (dict), microscope (bool)
+    Return: state (str) of the claw
+    """
+    commands, state = pickup_commands(pos, gripper_for(robot, CLAW_VEL), microscope)
+
+    return _run_action(robot, "pickup", commands, state)
+
+def transport_commands(pos, joints=None):
+    """
+    Description: This function builds the commands that bring the robotic arm
+    to the station on the sliding rail. The route planner skips the fold into
+    the transportation position when the current joints show it isn't needed,
+    and moves the joints that are safe to move during the rail move with it.
+    Parameters: pos (dict), joints (list)
+    Returns: commands (list)
+    """
+    route, commands = plan_route(joints, pos, envelopes=load_envelopes())
+
+    return commands
 
 def transport(robot, pos):
     """
     Description: This function moves the robotic arm into the transportation
     position and then moves the robotic arm along the sliding rail to where it 
-    needs to go. 
+    needs to go. The fold is skipped when the route planner shows it's safe.
     Parameters: robot (obj), pos (dict)
     Returns: None
     """
+    route, commands = plan_route(robot.get_all_joint(), pos, envelopes=load_envelopes())
+    with span("transport", route=route):
+        executor_for(robot).run(commands)
 
-    # rotates the robot to the transportation position
-    robot.jmove(
-        timeout=10, 
-        rel=0, 
-        j0=0,
-        j1=100, 
-        j2=-100, 
-        j3=-88, 
-        j4=0, 
-        vel=200
-    )
-    # displays robot information
-    robot_info(robot, "transport")
-
-    # moves the sliding rail to the position given
-    robot.jmove(
-        rel=0,
-        j6=pos["j6"],
-        vel=120,
-        accel=500,
-        jerk=2000
-    )
-    # displays robot information
-    robot_info(robot, "transport")
-
-def action_from_microscope(robot, pos, clawOpen):
+def microscope_commands(pos, gripper, joints=None, corner=CORNER):
     """
-    Description: This function performs the action of picking-up/placing a 
-    sample to the microscope. It first moves the claw to a position in front 
-    and above the microscope, then moves forward to be ontop of the microscope,
-    it then lowers into the tray, then picks-up or releases the sample, then
-    lifts back up, moves away from the microscope, and then lifts back up. 
-    Parameters: robot (obj), pos (dict), clawOpen(bool)
-    Returns: clawOpen(bool)
-    -1021
+    Description: This function builds the full command list for picking-up/
+    placing a sample at the microscope, from transport to the initial position.
+    The moves are blended into one continuous path, the arm only stops where
+    the claw goes down to the sample and grips or releases it.
+    Parameters: pos (dict), gripper (Gripper), joints (list), corner (float)
+    radius of the blends in mm, 0 stops after every move
+    Returns: commands (list), state (str) of the claw once they have run
     """
-
     # this is to lower the claw compared to initial holder position as to not hit the light
     microOffset = -33
 
-    # displays whether or not the claw is open for debugging purposes
-    print("Claw Open: %s" % clawOpen)
-
     # moves the robot to the position it needs to be on the slide rail
-    transport(robot, pos)
+    commands = transport_commands(pos, joints)
 
     # robots the robotic arm first to avoid any obstables
-    robot.jmove(
-        rel=0,
-        j0=pos["j0"],
-        vel = 200
-    )
-    # displays robot information
-    robot_info(robot, "action_from_microscope")
+    approach = [{"cmd": "jmove", "rel": 0, "j0": pos["j0"], "vel": 200}]
 
     # determines whether to move forward or backward based on which side of the table it's on
     if pos["y"] > 0:
@@ -176,93 +156,132 @@ def action_from_microscope(robot, pos, clawOpen):
         deltaY = -90
 
     # moves the rest of the robotic arm to the initial microscope position
-    robot.jmove(
-        rel=0,
-        x = pos["x"],
-        y = pos["y"]-deltaY,
-        z = pos["z"]+microOffset,
-        a = pos["a"],
-        d = pos["d"],
-        vel = 100
-    )
-    # displays robot information
-    robot_info(robot, "action_from_microscope")
+    approach.append({
+        "cmd": "jmove",
+        "rel": 0,
+        "x": pos["x"],
+        "y": pos["y"]-deltaY,
+        "z": pos["z"]+microOffset,
+        "a": pos["a"],
+        "d": pos["d"],
+        "vel": 100
+    })
 
     # moves the robotic arm into the microscope to be able to pick-up/place
-    robot.lmove(
-        rel=0,
-        y = pos["y"],
-        b = pos["b"],
-        vel = 50
-    )
-    # displays robot information
-    robot_info(robot, "action_from_microscope")
+    approach.append({"cmd": "lmove", "rel": 0, "y": pos["y"], "b": pos["b"], "vel": 50})
+    commands += phase(approach, "approach")
 
     # pickups/places the sample
-    clawOpen = pickup(robot, pos, clawOpen, True)
+    pickupCommands, state = pickup_commands(pos, gripper, True)
+    commands += pickupCommands
 
     # moves the robotic arm out of the microscope
-    robot.lmove(
-        rel=0,
-        y = pos["y"]-deltaY,
-        z = pos["z"]+microOffset,
-        b = pos["b"],
-        vel = 50
-    )
-    # displays robot information
-    robot_info(robot, "action_from_microscope")
+    commands += phase([{
+        "cmd": "lmove",
+        "rel": 0,
+        "y": pos["y"]-deltaY,
+        "z": pos["z"]+microOffset,
+        "b": pos["b"],
+        "vel": 50
+    }], "retract")
 
     # moves the robotic arm back to the initial position
-    move_to_initial(robot)
+    commands += move_to_initial_commands()
 
-    return clawOpen
+    return blend(commands, corner), state
 
-def action_from_holder(robot, pos, clawOpen):
+def action_from_microscope(robot, pos):
     """
-    Description: This function performs the action of pickup/placing something
-    at a holder on the table. It firsts moves the claw to a position above the 
-    holder, lowers itself into the holder, picks up or releases the something 
-    and lifts back up. 
-    Parameters: robot (obj), pos (dict), clawOpen(bool)
-    Returns: clawOpen (bool)
+    Description: This function performs the action of picking-up/placing a 
+    sample to the microscope. It first moves the claw to a position in front 
+    and above the microscope, then moves forward to be ontop of the microscope,
+    it then lowers into the tray, then picks-up or releases the sample, then
+    lifts back up, moves away from the microscope, and then lifts back up. 
+    The whole action is streamed to the robot as one command list.
+    Parameters: robot (obj), pos (dict)
+    Returns: state (str) of the claw
+    -1021
     """
-    # displays whether or not the claw is open for debugging purposes
-    print("Claw Open: %s" % clawOpen)
+    # the current joints let the route planner skip unneeded moves and tell
+    # the state of the claw
+    joints = robot.get_all_joint()
+    gripper = gripper_for(robot, CLAW_VEL)
+    claw = gripper.update(joints[5])
+
+    commands, state = microscope_commands(pos, gripper, joints)
 
+    return _run_action(robot, "action_from_microscope", commands, state, claw=claw)
+
+def holder_commands(pos, gripper, joints=None):
+    """
+    Description: This function builds the full command list for picking-up/
+    placing something at a holder, from transport to the initial position
+    Parameters: pos (dict), gripper (Gripper), joints (list)
+    Returns: commands (list), state (str) of the claw once they have run
+    """
     # moves the robot to the position it needs to be on the slide rail
-    transport(robot, pos)
+    commands = transport_commands(pos, joints)
 
     # rotates the robotic arm first to avoid any obstables
-    robot.jmove(
-        rel=0,
-        j0=pos["j0"],
-        vel = 250
-    )
+    approach = [{"cmd": "jmove", "rel": 0, "j0": pos["j0"], "vel": 250}]
 
-    # displays robot information
-    robot_info(robot, "action_from_holder")
-    
     # moves the rest of the robot arm to the initial holder position
-    robot.jmove(
-            rel=0,
-            j0=pos["j0"],
-            j1=pos["j1"],
-            j2=pos["j2"],
-            j3=pos["j3"],
-            j4=pos["j4"],
-            j6=pos["j6"],
-            vel = 200
-        )
-    # displays robot information
-    robot_info(robot, "action_from_holder")
+    approach.append({
+        "cmd": "jmove",
+        "rel": 0,
+        "j0": pos["j0"],
+        "j1": pos["j1"],
+        "j2": pos["j2"],
+        "j3": pos["j3"],
+        "j4": pos["j4"],
+        "j6": pos["j6"],
+        "vel": 200
+    })
+    commands += phase(approach, "approach")
 
     # picks up the sample with the claw
-    clawOpen = pickup(robot, pos, clawOpen, False)
+    pickupCommands, state = pickup_commands(pos, gripper, False)
+    commands += pickupCommands
 
     # moves the robotic arm back to the initial position
-    move_to_initial(robot)
+    commands += move_to_initial_commands()
+
+    return commands, state
+
+def action_from_holder(robot, pos):
+    """
+    Description: This function performs the action of pickup/placing something
+    at a holder on the table. It firsts moves the claw to a position above the 
+    holder, lowers itself into the holder, picks up or releases the something 
+    and lifts back up. The whole action is streamed to the robot as one 
+    command list.
+    Parameters: robot (obj), pos (dict)
+    Returns: state (str) of the claw
+    """
+    # the current joints let the route planner skip unneeded moves and tell
+    # the state of the claw
+    joints = robot.get_all_joint()
+    gripper = gripper_for(robot, CLAW_VEL)
+    claw = gripper.update(joints[5])
 
-    return clawOpen
+    commands, state = holder_commands(pos, gripper, joints)
+
+    return _run_action(robot, "action_from_holder", commands, state, claw=claw)
+
+def move_to_initial_commands():
+    """
+    Description: This function builds the commands that move the robotic arm 
+    to the initial position
+    Parameters: None
+    Returns: commands (list)
+    """
+    return phase([
+        # For some reason, if the all motors besides the slide rail move first, 
+        # there will be no operational issues with the slide rail
+        {"cmd": "jmove", "rel": 1, "j1": 0.5, "j2": 0.5, "j3": 0.5, "j4": 0.5, "vel": 100, "accel": 500, "jerk": 2000},
+        # moves the robotic arm to the initial starting position
+        {"cmd": "jmove", "rel": 0, "j1": 100, "j2": -100, "j3": -88, "j4": 0, "vel": 250},
+    ], "home")
 
 def move_to_initial(robot):
     """
@@ -270,154 +289,59 @@ def move_to_initial(robot):
     Parameters: robot (obj)
     Returns: None
     """
-
-    # For some reason, if the all motors besides the slide rail move first, 
-    # there will be no operational issues with the slide rail
-    robot.jmove(
-        rel=1, 
-        j1=0.5, 
-        j2=0.5, 
-        j3=0.5, 
-        j4=0.5, 
-        vel=100, 
-        accel=500,
-        jerk=2000
-    )
-    # displays robot information
-    robot_info(robot, "move_to_initial")
-
-    # moves the robotic arm to the initial starting position
-    robot.jmove(
-        timeout=10, 
-        rel=0, 
-        j1=100, 
-        j2=-100, 
-        j3=-88, 
-        j4=0, 
-        vel=250
-    )
-    # displays robot information
-    robot_info(robot, "move_to_initial")
+    with span("move_to_initial"):
+        executor_for(robot).run(move_to_initial_commands())
 
 def get_microscope_position(microLeft1Pos, name):
-    if "Left" in name:
-        y = microLeft1Pos["y"]
-        j0 = microLeft1Pos["j0"]
-    elif "Right" in name:
-        y = abs(microLeft1Pos["y"])
-        j0 = abs(microLeft1Pos["j0"])
-    else:
-        print("Wrong Name Input")
-        raise ValueError
-    
-    deltaD = calculateDeltaD()
-    try:
-        num = int(name[-1])
-        d = microLeft1Pos["d"] + deltaD*(num-1)
-    except ValueError:
+    """
+    Description: This function determines the position of another microscope
+    based on the position of the first left one, assuming equal spacing
+    between the microscopes.
+    Parameters: microLeft1Pos (dict), name (str) e.g. MicroscopeRight3 or MR3
+    Returns: microscopePos (dict)
+    """
+    microscope = parse_microscope(name)
+    if microscope is None:
         print("Wrong Name Input")
+        raise ValueError("Wrong microscope name %s" % name)
 
-    microscopePos = {}
-    microscopePos["x"] = microLeft1Pos["x"]
-    microscopePos["y"] = y
-    microscopePos["z"] = microLeft1Pos["z"]
-    microscopePos["a"] = microLeft1Pos["a"]
-    microscopePos["b"] = microLeft1Pos["b"]
-    microscopePos["d"] = d
-    microscopePos["j0"] = j0
-    microscopePos["j1"] = microLeft1Pos["j1"]
-    microscopePos["j2"] = microLeft1Pos["j2"]
-    microscopePos["j3"] = microLeft1Pos["j3"]
-    microscopePos["j4"] = microLeft1Pos["j4"]
-    microscopePos["j6"] = d
-
-    return microscopePos
+    return microscope_position(microLeft1Pos, *microscope)
 
 def get_positions():
     """
     Description: This function reads a file that contains the joint and cartesian coordinate
     positions of all microscopes and sample holders on the table and saves that information. 
+    The file is only parsed again when it changes.
     Parameters: None
     Returns: positions (dict)
     """
-
-    # positions is a dictionary of dictionaries that holds the positions
-    positions = {}
-    lineCount = 0
-    with open("keyPositions.csv", 'r') as file:
-        lineCount += 1
-
-        for line in file:
-            # each line contains the cartesian and joint system coordinates for each position
-            line = line.split(",")
-            print(line)
-
-            # position is a dictionary that holds the cartesian and joint system coordinates
-            position = {}
-            try:
-                # reads in the cartesian coordinates
-                # a is rotating up&down of claw
-                # b is rotating side-to-side of claw
-                # c (not included) is opening/closing of claw
-                # d is left/right of sliding rail
-                if line[1] == "c":
-                    try:
-                        position["x"] = float(line[2])
-                        position["y"] = float(line[3])
-                        position["z"] = float(line[4])
-                        position["a"] = float(line[5])
-                        position["b"] = float(line[6])
-                        position["d"] = float(line[7])
-                    except ValueError:
-                        print("Values for %s are incorrect" % line[0])
-                else:
-                    print("Values for %s are incorrect" % line[0])
-
-                # reads in the joint coordinates
-                # j0, j1, j2, j3, j4 are the robot's 5 main joints
-                # j6 is the position of the claw
-                # j7 is the position of the sliding rail
-                if line[8] == "j":
-                    try:
-                        position["j0"] = float(line[9])
-                        position["j1"] = float(line[10])
-                        position["j2"] = float(line[11])
-                        position["j3"] = float(line[12])
-                        position["j4"] = float(line[13])
-                        position["j6"] = float(line[14])
-                    except ValueError:
-                        print("Values for %s are incorrect" % line[0])
-                else:
-                    print("Values for %s are incorrect" % line[0])
-            except IndexError:
-                print("Improper position on line %d" % lineCount)
-
-            # adds each position to the positions dicitonary
-            positions[line[0]] = position
-
-    return positions
-
-def testingHolder(robot, positions, clawOpen):
+    # reads in the cartesian coordinates
+    # a is rotating up&down of claw
+    # b is rotating side-to-side of claw
+    # c (not included) is opening/closing of claw
+    # d is left/right of sliding rail
+    # and the joint coordinates
+    # j0, j1, j2, j3, j4 are the robot's 5 main joints
+    # j6 is the position of the sliding rail
+    return load_positions("keyPositions.csv")
+
+def testingHolder(robot, positions):
     # test actions
     move_to_initial(robot)
     for i in range(4):
-        clawOpen = action_from_holder(robot, positions["TestPlateHolder3"], clawOpen)
-        clawOpen = action_from_holder(robot, positions["TestPlateHolder1"], clawOpen)
-        clawOpen = action_from_holder(robot, positions["TestPlateHolder4"], clawOpen)
-
-    return clawOpen
+        action_from_holder(robot, positions["TestPlateHolder3"])
+        action_from_holder(robot, positions["TestPlateHolder1"])
+        action_from_holder(robot, positions["TestPlateHolder4"])
 
-def testingMicroscope(robot, positions, clawOpen):
+def testingMicroscope(robot, positions):
     # test actions
     move_to_initial(robot)
-    clawOpen = action_from_microscope(robot, positions["MicroscopeLeft1"], clawOpen)
-    clawOpen = action_from_holder(robot, positions["TestPlateHolder3"], clawOpen)
+    action_from_microscope(robot, positions["MicroscopeLeft1"])
+    action_from_holder(robot, positions["TestPlateHolder3"])
 
-    return clawOpen
-
-def testing_get_microscope_position(robot, positions, clawOpen):
+def testing_get_microscope_position(robot, positions):
     move_to_initial(robot)
-    clawOpen = action_from_microscope(robot, positions["MicroscopeLeft1"], clawOpen)
+    action_from_microscope(robot, positions["MicroscopeLeft1"])
     pos1 = get_microscope_position(positions["MicroscopeLeft1"], "MicroscopeLeft2")
     pos2 = get_microscope_position(positions["MicroscopeLeft1"], "MicroscopeRight3")
     pos3 = get_microscope_position(positions["MicroscopeLeft1"], "MicroscopeRight4")
@@ -467,35 +391,34 @@ def testing_get_microscope_position(robot, positions, clawOpen):
     sleep(5)
 
 if __name__ == "__main__":
+    # the client library is only needed when running on the robot, the
+    # command builders above also work with the simulator
+    from dorna2 import Dorna
+
     # connects to the robot and engages the motors
     robot = Dorna()
-    print(robot.connect("192.168.2.20"))
+    print(robot.connect(DEFAULT_HOST))
     robot.set_motor(1)
-    clawOpen = True
 
-    # making sure the claw is open
-    robot.jmove(
-        rel=0,
-        j5 = 0,
-        vel = 70
-    )
+    # making sure the claw is open, it only moves if it isn't
+    gripper_for(robot, CLAW_VEL).open()
 
     # gets the positions of the microscopes and plate holders
     positions = get_positions()
     print(positions)
 
-    # testingHolder(robot, positions, clawOpen)
-    # testingMicroscope(robot, positions, clawOpen)
-    testing_get_microscope_position(robot, positions, clawOpen)
+    # testingHolder(robot, positions)
+    # testingMicroscope(robot, positions)
+    testing_get_microscope_position(robot, positions)
     """
     move_to_initial(robot)
     
-    clawOpen = action_from_holder(robot, positions["TestPlateHolder1"], clawOpen)
-    clawOpen = action_from_microscope(robot, positions["Microscope1"], clawOpen)
-    clawOpen = action_from_holder(robot, positions["TestPlateHolder3"], clawOpen)
-    clawOpen = action_from_holder(robot, positions["TestPlateHolder2"], clawOpen)
-    clawOpen = action_from_microscope(robot, positions["Microscope1"], clawOpen)
-    clawOpen = action_from_holder(robot, positions["TestPlateHolder3"], clawOpen)
+    action_from_holder(robot, positions["TestPlateHolder1"])
+    action_from_microscope(robot, positions["Microscope1"])
+    action_from_holder(robot, positions["TestPlateHolder3"])
+    action_from_holder(robot, positions["TestPlateHolder2"])
+    action_from_microscope(robot, positions["Microscope1"])
+    action_from_holder(robot, positions["TestPlateHolder3"])
     
     for i in range(2):
         robot.jmove(
@@ -1,5 +1,7 @@
 from dorna2 import Dorna
 from time import sleep
+from robot_session import DEFAULT_HOST
+from position_store import load_positions
 
 """
 TestPlateHolder1,c,0,328,20,-90,0,0,-397.4
@@ -27,7 +29,7 @@ def pickup(robot, positions, location):
                 z=pos["z"],
                 a=pos["a"],
                 b=pos["b"],
-                c=pos["c"],
+                c=pos.get("c", 0),
                 d=pos["d"],
                 vel=velocities[numSteps-1]
             )
@@ -83,46 +85,12 @@ def move_to_initial_pose(robot, clawOpen, velo):
     robot_info(robot)
 
 def get_positions():
-    positions = {}
-    with open("keyPositions.csv", 'r') as file:
-        for line in file:
-            line = line.split(",")
-            print(line)
-
-            position = {}
-            if line[1] == "j":
-                try:
-                    position["j0"] = float(line[2])
-                    position["j1"] = float(line[3])
-                    position["j2"] = float(line[4])
-                    position["j3"] = float(line[5])
-                    position["j4"] = float(line[6])
-                    position["j5"] = float(line[7])
-                    position["j6"] = float(line[8])
-                except ValueError:
-                    print("Values for %s are incorrect" % line[0])
-            elif line[1] == "c":
-                try:
-                    position["x"] = float(line[2])
-                    position["y"] = float(line[3])
-                    position["z"] = float(line[4])
-                    position["a"] = float(line[5])
-                    position["b"] = float(line[6])
-                    position["c"] = float(line[7])
-                    position["d"] = float(line[8])
-                except ValueError:
-                    print("Values for %s are incorrect" % line[0])
-            else:
-                print("Values for %s are incorrect" % line[0])
-
-            positions[line[0]] = position
-
-    return positions
+    return load_positions("keyPositions.csv")
 
 def main():
     #"""
     robot = Dorna()
-    print(robot.connect("192.168.2.20"))
+    print(robot.connect(DEFAULT_HOST))
     robot.set_motor(1)
     #"""
 
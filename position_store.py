@@ -0,0 +1,310 @@
+import os
+import json
+import threading
+
+# the coordinates a position may hold
+# x, y, z, a, b are the cartesian coordinates of the claw, c its opening and d the rail
+# j0 to j4 are the arm joints, j5 the claw, j6 the sliding rail and j7 the spare axis
+CARTESIAN = ("x", "y", "z", "a", "b", "c", "d")
+JOINTS = ("j0", "j1", "j2", "j3", "j4", "j5", "j6", "j7")
+SCHEMA = CARTESIAN + JOINTS
+
+# the journal is folded into the positions file after this many records
+COMPACT_EVERY = 50
+
+def validate(name, values):
+    """
+    Description: This function checks a position against the schema and
+    converts its values to floats
+    Parameters: name (str), values (dict)
+    Returns: position (dict)
+    """
+    if not isinstance(name, str) or not name:
+        raise ValueError("Position names must be non-empty strings")
+    position = {}
+    for key, value in values.items():
+        if key not in SCHEMA:
+            raise ValueError("Unknown coordinate %s in %s" % (key, name))
+        try:
+            position[key] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError("Value of %s in %s is not a number: %r" % (key, name, value))
+
+    return position
+
+def import_json(path):
+    """
+    Description: This function reads a positions file such as positions.json
+    Parameters: path (str)
+    Returns: positions (dict)
+    """
+    with open(path, 'r') as file:
+        data = json.load(file)
+
+    return {name: validate(name, values) for name, values in data.items()}
+
+def import_key_positions(path):
+    """
+    Description: This function reads keyPositions.csv. Two layouts are
+    understood, one line holding both coordinate systems:
+        name,c,x,y,z,a,b,d,j,j0,j1,j2,j3,j4,j6
+    and one line per coordinate system:
+        name,c,x,y,z,a,b,c,d    or    name,j,j0,j1,j2,j3,j4,j5,j6
+    Lines of the same name are merged.
+    Parameters: path (str)
+    Returns: positions (dict)
+    """
+    layouts = {
+        "c6": ("x", "y", "z", "a", "b", "d"),
+        "j6": ("j0", "j1", "j2", "j3", "j4", "j6"),
+        "c7": ("x", "y", "z", "a", "b", "c", "d"),
+        "j7": ("j0", "j1", "j2", "j3", "j4", "j5", "j6"),
+    }
+    positions = {}
+    with open(path, 'r') as file:
+        for lineCount, line in enumerate(file, 1):
+            line = [value.strip() for value in line.split(",")]
+            if len(line) < 2 or not line[0]:
+                continue
+            name = line[0]
+
+            # splits the line into (system, values) groups
+            groups = []
+            if len(line) >= 15 and line[1] == "c" and line[8] == "j":
+                groups = [("c6", line[2:8]), ("j6", line[9:15])]
+            elif line[1] in ("c", "j") and len(line) >= 9:
+                groups = [(line[1] + "7", line[2:9])]
+            else:
+                raise ValueError("Improper position on line %d of %s" % (lineCount, path))
+
+            position = positions.setdefault(name, {})
+            for layout, values in groups:
+                position.update(validate(name, dict(zip(layouts[layout], values))))
+
+    return positions
+
+def import_command_script(path):
+    """
+    Description: This function reads positions recorded as robot commands,
+    one {"cmd":"jmove",...} or {"cmd":"lmove",...} per line, as in
+    positions.txt and positions. A jmove starts a new position and the lmove
+    right after it adds the cartesian coordinates. The positions are named
+    after the label above them, or after the file when there is none.
+    Parameters: path (str)
+    Returns: positions (dict)
+    """
+    base = os.path.basename(path)
+    positions = {}
+    label = None
+    counts = {}
+    current = None
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith("{"):
+                # labels look like "///grab" or "cytomat:"
+                label = line.strip("/#: ").strip() or None
+                current = None
+                continue
+
+            cmd = json.loads(line)
+            values = {key: value for key, value in cmd.items() if key in SCHEMA}
+            if cmd.get("cmd") == "lmove" and current is not None:
+                current.update(validate(label or base, values))
+                current = None
+                continue
+
+            prefix = label or base
+            counts[prefix] = counts.get(prefix, 0) + 1
+            name = prefix if counts[prefix] == 1 else "%s %d" % (prefix, counts[prefix])
+            current = validate(name, values)
+            positions[name] = current
+
+    return positions
+
+def import_positions(path):
+    """
+    Description: This function reads positions from any of the formats used
+    in this project, chosen by the file name
+    Parameters: path (str)
+    Returns: positions (dict)
+    """
+    if path.endswith(".json"):
+        return import_json(path)
+    if path.endswith(".csv"):
+        return import_key_positions(path)
+
+    return import_command_script(path)
+
+class PositionStore:
+    """
+    Description: This class is the one place positions are loaded from and
+    recorded to. The positions file is read once and kept in memory until it
+    changes on disk. New positions are appended to a journal next to the
+    file, one JSON line each, instead of rewriting the whole file, and the
+    journal is folded back into the file every so often. The file is only
+    ever replaced atomically, so a crash leaves either the old or the new
+    version and at worst loses the last, half-written journal line.
+    Parameters: path (str), compact_every (int)
+    """
+
+    def __init__(self, path="positions.json", compact_every=COMPACT_EVERY):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compact_every = compact_every
+        self._positions = None
+        self._stamp = None
+        self._journaled = 0
+        self._lock = threading.Lock()
+
+    def _file_stamp(self):
+        stamp = []
+        for path in (self.path, self.journal_path):
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+
+        return tuple(stamp)
+
+    def _read_journal(self, positions):
+        count = 0
+        try:
+            with open(self.journal_path, 'r') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may have been cut off by a crash
+                        continue
+                    positions[entry["name"]] = validate(entry["name"], entry["position"])
+                    count += 1
+        except FileNotFoundError:
+            pass
+
+        return count
+
+    def load(self):
+        """
+        Description: This function gives the positions. They are only read
+        from disk when the file or the journal changed since the last load.
+        The same dictionary is returned every time, so it must not be changed
+        directly, use record() instead.
+        Parameters: self (obj)
+        Returns: positions (dict)
+        """
+        with self._lock:
+            stamp = self._file_stamp()
+            if self._positions is None or stamp != self._stamp:
+                # only the journal is optional, a missing file usually means
+                # the service was started from the wrong directory
+                if stamp[0] is None:
+                    raise FileNotFoundError("No positions file at %s" % os.path.abspath(self.path))
+                positions = import_positions(self.path)
+                self._journaled = self._read_journal(positions)
+                if self._positions is None:
+                    self._positions = positions
+                else:
+                    # keeps the same dictionary so everyone sees the update
+                    self._positions.clear()
+                    self._positions.update(positions)
+                self._stamp = stamp
+
+            return self._positions
+
+    def record(self, name, values):
+        """
+        Description: This function saves a position by appending it to the
+        journal
+        Parameters: self (obj), name (str), values (dict)
+        Returns: None
+        """
+        position = validate(name, values)
+        positions = self.load()
+        with self._lock:
+            line = json.dumps({"name": name, "position": position}) + "\n"
+            with open(self.journal_path, 'a+b') as journal:
+                # starts a fresh line after one that was cut off by a crash
+                if journal.tell() > 0:
+                    journal.seek(-1, os.SEEK_END)
+                    if journal.read(1) != b"\n":
+                        line = "\n" + line
+                journal.write(line.encode())
+                journal.flush()
+                os.fsync(journal.fileno())
+            positions[name] = position
+            self._journaled += 1
+            self._stamp = self._file_stamp()
+
+            compact = self._journaled >= self.compact_every
+        if compact:
+            self.compact()
+
+    def compact(self):
+        """
+        Description: This function writes all positions back into the file
+        and empties the journal. The file is replaced atomically.
+        Parameters: self (obj)
+        Returns: None
+        """
+        positions = self.load()
+        with self._lock:
+            if not self.path.endswith(".json"):
+                raise ValueError("Only .json position files can be written, not %s" % self.path)
+            temp = self.path + ".tmp"
+            with open(temp, 'w') as file:
+                json.dump(positions, file, indent = 4)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp, self.path)
+            # the journal is only dropped once the file holds its entries
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+            self._journaled = 0
+            self._stamp = self._file_stamp()
+
+    def next_name(self, prefix="New Position"):
+        """
+        Description: This function finds the first free name for a new
+        position, so recording never overwrites an earlier session
+        Parameters: self (obj), prefix (str)
+        Returns: name (str)
+        """
+        positions = self.load()
+        counter = 0
+        while "%s %d" % (prefix, counter) in positions:
+            counter += 1
+
+        return "%s %d" % (prefix, counter)
+
+# one store per file, shared by everything in the process
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(path="positions.json"):
+    """
+    Description: This function gives the shared store of a positions file
+    Parameters: path (str)
+    Returns: store (PositionStore)
+    """
+    key = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = PositionStore(path)
+
+    return store
+
+def load_positions(path="positions.json"):
+    """
+    Description: This function loads the positions of a file through its
+    shared, cached store
+    Parameters: path (str)
+    Returns: positions (dict)
+    """
+    return get_store(path).load()
@@ -0,0 +1,231 @@
+import os
+import asyncio
+import threading
+from collections import deque
+from time import sleep, monotonic
+
+# address of the robot, can be overridden with the DORNA_HOST environment variable
+DEFAULT_HOST = os.environ.get("DORNA_HOST", "192.168.2.20")
+DEFAULT_PORT = int(os.environ.get("DORNA_PORT", 443))
+
+class RobotSession:
+    """
+    Description: This class keeps one long-lived connection to the robot. A
+    heartbeat thread probes the latency of the connection while it is idle and
+    reconnects with an exponential backoff if the robot stops answering. The
+    tools share the connection through the context-manager API:
+
+        with session as robot:
+            robot.jmove(...)
+
+    which makes sure the robot is connected and that only one caller talks to
+    it at a time. Leaving the block does not close the connection. Coroutines
+    use `async with session as robot:`, which waits for the robot without
+    blocking the event loop.
+    Parameters: host (str), port (int), robot (obj) e.g. a SimulatedDorna, a
+    dorna2.Dorna is created if not given, heartbeat (float),
+    max_backoff (float), probe_timeout (float), connect_timeout (float) how
+    long to keep trying to connect before giving up, in s
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, robot=None, heartbeat=5,
+                 max_backoff=30, probe_timeout=2, connect_timeout=60):
+        self.host = host
+        self.port = port
+        if robot is None:
+            # the client library is only needed for the real robot, not the simulator
+            from dorna2 import Dorna
+            robot = Dorna()
+        self.robot = robot
+        self.heartbeat = heartbeat
+        self.max_backoff = max_backoff
+        self.probe_timeout = probe_timeout
+        self.connect_timeout = connect_timeout
+
+        self.connected = False
+        self.reconnects = 0
+        # the last few round-trip times of the heartbeat probe in seconds
+        self.latencies = deque(maxlen=50)
+
+        # held while a caller is using the robot, it is a plain lock so that
+        # async callers can take it in a worker thread and release it later
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def connect(self, retries=None, timeout=None, locked=False):
+        """
+        Description: This function connects to the robot, retrying with an
+        exponential backoff until it succeeds, runs out of retries or the
+        time is up. A caller holding the lock of the session gives it up
+        while waiting between attempts, so the others aren't held up.
+        Parameters: self (obj), retries (int) None retries until the time is
+        up, timeout (float) in s, connect_timeout if not given, locked (bool)
+        whether the caller holds the lock
+        Returns: None, raises ConnectionError if it couldn't connect
+        """
+        deadline = monotonic() + (self.connect_timeout if timeout is None else timeout)
+        delay = 0.5
+        attempt = 0
+        while not self._stop.is_set():
+            attempt += 1
+            try:
+                # drops what is left of a previous connection before reconnecting
+                if attempt > 1 or self.reconnects:
+                    self._close_robot()
+                if self.robot.connect(self.host, self.port) is not False:
+                    self.connected = True
+                    return
+            except Exception as e:
+                print("Connecting to %s failed: %s" % (self.host, e))
+
+            delay = min(delay, deadline - monotonic())
+            if (retries is not None and attempt > retries) or delay <= 0:
+                break
+            if locked:
+                self._lock.release()
+            try:
+                sleep(delay)
+            finally:
+                if locked:
+                    self._lock.acquire()
+            # another caller may have connected in the meantime
+            if self.connected:
+                return
+            delay = min(delay * 2, self.max_backoff)
+
+        self.connected = False
+        raise ConnectionError("Could not connect to the robot at %s after %d attempts" % (self.host, attempt))
+
+    def start(self):
+        """
+        Description: This function connects to the robot and starts the
+        heartbeat thread
+        Parameters: self (obj)
+        Returns: None
+        """
+        with self._lock:
+            if not self.connected:
+                self.connect(locked=True)
+        if self._thread is None and self.heartbeat:
+            self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+            self._thread.start()
+
+    def probe(self):
+        """
+        Description: This function measures one round-trip to the robot
+        Parameters: self (obj)
+        Returns: latency (float) in seconds
+        """
+        start = monotonic()
+        self.robot.play(timeout=self.probe_timeout, cmd="version")
+        latency = monotonic() - start
+        self.latencies.append(latency)
+
+        return latency
+
+    def latency(self):
+        """
+        Description: This function summarizes the measured latencies
+        Parameters: self (obj)
+        Returns: stats (dict) min, avg and max in seconds, None if unmeasured
+        """
+        if not self.latencies:
+            return None
+        samples = list(self.latencies)
+
+        return {
+            "min": min(samples),
+            "avg": sum(samples) / len(samples),
+            "max": max(samples),
+            "samples": len(samples),
+        }
+
+    def ensure_connected(self):
+        """
+        Description: This function reconnects to the robot if the connection
+        was lost, the caller holds the lock
+        Parameters: self (obj)
+        Returns: None, raises ConnectionError if it couldn't reconnect
+        """
+        if not self.connected:
+            self.reconnects += 1
+            self.connect(locked=True)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat):
+            # doesn't get in the way of a caller that is using the robot
+            if not self._lock.acquire(blocking=False):
+                continue
+            try:
+                self.probe()
+            except Exception as e:
+                print("Heartbeat to %s failed: %s" % (self.host, e))
+                self.connected = False
+                self.reconnects += 1
+                # one attempt per beat, the lock isn't held through a backoff
+                try:
+                    self.connect(retries=0)
+                except ConnectionError as e:
+                    print(e)
+            finally:
+                self._lock.release()
+
+    def _close_robot(self):
+        try:
+            self.robot.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Description: This function stops the heartbeat and closes the
+        connection to the robot
+        Parameters: self (obj)
+        Returns: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._close_robot()
+            self.connected = False
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self.ensure_connected()
+        except Exception:
+            self._lock.release()
+            raise
+
+        return self.robot
+
+    def __exit__(self, excType, exc, tb):
+        # a failed call means the connection has to be checked on the next use
+        if excType is not None and issubclass(excType, (ConnectionError, OSError)):
+            self.connected = False
+        self._lock.release()
+
+        return False
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        acquiring = loop.run_in_executor(None, self._lock.acquire)
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # gives the lock back once the worker thread gets it
+            acquiring.add_done_callback(lambda future: self._lock.release())
+            raise
+        try:
+            await loop.run_in_executor(None, self.ensure_connected)
+        except BaseException:
+            self._lock.release()
+            raise
+
+        return self.robot
+
+    async def __aexit__(self, excType, exc, tb):
+        return self.__exit__(excType, exc, tb)
@@ -1,12 +1,54 @@
+from time import sleep, monotonic
+
+# when the import of the extension started, for the startup report
+IMPORT_START = monotonic()
+
 import asyncio
-from dorna2 import Dorna
-from time import sleep
+from contextlib import contextmanager
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 import json
 from imjoy_rpc import api
 from imjoy_rpc.hypha import connect_to_server, login
 import argparse
-from  controller_calibration import RoboticArmController
+from motion_executor import executor_for, blend, CORNER
+from async_motion import AsyncMotion
+from route_planner import plan_route, load_envelopes
+from robot_session import RobotSession, DEFAULT_HOST
+from job_scheduler import JobScheduler
+from station_index import StationIndex
+from position_store import load_positions
+from tracing import span, phase, PHASE_KEY
+from gripper import Gripper, HOLDING, OPEN, UNKNOWN
+from inventory import Inventory, CLAW, INVENTORY
+
+# how long each step of starting the service took in s, the controller code
+# and pygame are only imported when calibrating and the simulator and the
+# cycle-time estimator, which load numpy, when they are used, so they aren't
+# part of it
+STARTUP = {"import": monotonic() - IMPORT_START}
+
+@contextmanager
+def timed(step):
+    # records how long the block took as a step of the startup
+    start = monotonic()
+    try:
+        yield
+    finally:
+        STARTUP[step] = monotonic() - start
+
+def startup_report():
+    """
+    Description: This function describes how long each step of starting the
+    service took, hardware bring-up runs at the same time as the login and
+    registration
+    Parameters: None
+    Returns: report (str)
+    """
+    lines = ["Startup timing:"]
+    lines += ["  %-20s %7.3f s" % (step, seconds) for step, seconds in STARTUP.items()]
+
+    return "\n".join(lines)
 
 class GrabFromHolderInput(BaseModel):
     """
@@ -14,7 +56,9 @@ class GrabFromHolderInput(BaseModel):
     holder on the table. It firsts moves the claw to a position above the holder, 
     lowers itself into the holder, picks up the object and lifts back up. 
     """
-    position: str = Field(..., description="position to travel to")
+    position: str = Field(..., description="holder to travel to, or the ID of the plate to pick up")
+    priority: int = Field(0, description="jobs with a higher priority are run first when the arm is busy")
+    wait: bool = Field(True, description="wait until the action is done, if false the job ID is returned straight away and the job can be followed with get_jobs")
 
 class PlacesAtHolderInput(BaseModel):
     """
@@ -23,6 +67,8 @@ class PlacesAtHolderInput(BaseModel):
     lowers itself into the holder, releases the object and lifts back up. 
     """
     position: str = Field(..., description="position to travel to")
+    priority: int = Field(0, description="jobs with a higher priority are run first when the arm is busy")
+    wait: bool = Field(True, description="wait until the action is done, if false the job ID is returned straight away and the job can be followed with get_jobs")
 
 class GrabFromMicroscopeInput(BaseModel):
     """
@@ -32,7 +78,9 @@ class GrabFromMicroscopeInput(BaseModel):
     then grabs the sample, then lifts back up, moves away from the microscope,
     then continues to lift back up. 
     """
-    position: str = Field(..., description="position to travel to")
+    position: str = Field(..., description="microscope to travel to, or the ID of the sample to pick up")
+    priority: int = Field(0, description="jobs with a higher priority are run first when the arm is busy")
+    wait: bool = Field(True, description="wait until the action is done, if false the job ID is returned straight away and the job can be followed with get_jobs")
 
 class PlacesAtMicroscopeInput(BaseModel):
     """
@@ -43,6 +91,48 @@ class PlacesAtMicroscopeInput(BaseModel):
     then continues to lift back up. 
     """
     position: str = Field(..., description="position to travel to")
+    priority: int = Field(0, description="jobs with a higher priority are run first when the arm is busy")
+    wait: bool = Field(True, description="wait until the action is done, if false the job ID is returned straight away and the job can be followed with get_jobs")
+
+class SequenceStep(BaseModel):
+    """
+    One grab or place action of a sequence.
+    """
+    kind: Literal["grab_from_holder", "place_at_holder", "grab_from_microscope", "place_at_microscope"] = Field(..., description="action to perform")
+    position: str = Field(..., description="station to travel to, or for a grab the ID of the plate to pick up")
+
+class RunSequenceInput(BaseModel):
+    """
+    This function performs a list of grab and place actions one after the
+    other in a single call, e.g. to move several plates between the holders
+    and the microscopes. Every step is checked before the arm moves and the time
+    each step took is returned.
+    """
+    steps: List[SequenceStep] = Field(..., description="grab and place actions in the order to perform them")
+    priority: int = Field(0, description="jobs with a higher priority are run first when the arm is busy")
+    wait: bool = Field(True, description="wait until the action is done, if false the job ID is returned straight away and the job can be followed with get_jobs")
+
+class GetJobsInput(BaseModel):
+    """
+    This function tells how a job is going: the phase it is in (e.g. 
+    transport, approach, grip, retract, home), when each phase started and 
+    the estimated time in seconds until it is done. Without a job ID it lists 
+    the running job and the jobs waiting after it.
+    """
+    job_id: Optional[int] = Field(None, description="ID of the job, all the running and waiting jobs if not given")
+
+class CancelJobInput(BaseModel):
+    """
+    This function cancels a job. A job that is running is stopped where it is 
+    and the robotic arm halts.
+    """
+    job_id: int = Field(..., description="ID of the job to cancel")
+
+class GetInventoryInput(BaseModel):
+    """
+    This function lists which plate is at which holder and microscope, and
+    which plate the claw is holding. Stations that are not listed are unknown.
+    """
 
 class RoboticArmCalibration(BaseModel):
     """
@@ -51,313 +141,217 @@ class RoboticArmCalibration(BaseModel):
     """
 
 class RoboticArm:
-    def __init__(self):
-        self.robot = Dorna()
-        self.robot.connect("192.168.2.20")
-        self.robot.set_motor(1)
-
-        # ensures the claw is open when initialized
-        self.robot.jmove(
-            rel=0,
-            j5=0,
-            vel=175
-        )
+    def __init__(self, host=DEFAULT_HOST, simulation=False, time_scale=1.0, inventory=INVENTORY, start=True):
+        # one connection to the robot is kept open and shared by all the tools,
+        # in simulation it is a simulated robot running in this process
+        robot = None
+        if simulation:
+            from dorna_simulator import SimulatedDorna
+            robot = SimulatedDorna(time_scale)
+        self.session = RobotSession(host, robot=robot)
+        self.robot = self.session.robot
+
+        # streams whole actions to the robot instead of one move at a time,
+        # awaiting them keeps the event loop free for other calls
+        self.executor = executor_for(self.robot, lookahead=4)
+        self.motion = AsyncMotion(self.robot, self.executor)
+
+        # knows whether the claw is open, closed or holding a plate
+        self.gripper = Gripper(self.robot)
+
+        # the scheduler owns the arm, requests from all chat sessions go through it,
+        # the predicted time of each job gives the ETAs
+        self._estimates = {}
+        self.scheduler = JobScheduler(self.run_action, estimate=self.estimate_job)
 
         # stores the positions into a dictionary
-        with open("positions.json", 'r') as positions_file: 
-            self.positions = json.load(positions_file)
-    
-    async def get_microscope_position(self, ML1, name):
-        """
-        Description: This function can determine the position of other 
-        microscopes based on the position of one assuming equal spacing 
-        between the microscopes. 
-        Parameters: self (obj), ML1 (dict), name (str)
-        Return Val: microscopePos (dict)
-        """
-        # setting y and j0 values depending on which side of the rail
-        if 'L' in name:
-            y = ML1["y"]
-            j0 = ML1["j0"]
-        elif 'R' in name:
-            y = abs(ML1["y"])
-            j0 = abs(ML1["j0"])
-        else:
-            print("Wrong Name Input")
-            raise ValueError
-        
-        # distance between microscopes in mm
-        dist = 800
-        # converst the distance between microscopes to the change in d
-        deltaD = dist * (256.76-254.2)/7
+        self.positions = load_positions("positions.json")
+        # every holder and microscope, worked out once
+        self.stations = StationIndex(self.positions)
 
-        # calculates the distance on the rail from ML1
-        try:
-            num = int(name[-1])
-            d = ML1["d"] + deltaD*(num-1)
-        except ValueError:
-            print("Wrong Name Input")
-
-        # sets all the values for the new position
-        microscopePos = {}
-        microscopePos["x"] = ML1["x"]
-        microscopePos["y"] = y
-        microscopePos["z"] = ML1["z"]
-        microscopePos["a"] = ML1["a"]
-        microscopePos["b"] = ML1["b"]
-        microscopePos["d"] = d
-        microscopePos["j0"] = j0
-        microscopePos["j1"] = ML1["j1"]
-        microscopePos["j2"] = ML1["j2"]
-        microscopePos["j3"] = ML1["j3"]
-        microscopePos["j4"] = ML1["j4"]
-        microscopePos["j6"] = d
-
-        return microscopePos
+        # which plate is where, replayed from its log, None keeps it in memory
+        self.inventory = Inventory(inventory)
+
+        # the hardware is brought up here unless it is done in the background
+        self._ready = None
+        if start:
+            self.start()
+
+    def start(self):
+        """
+        Description: This function brings up the hardware: connects to the 
+        robot, enables the motors and opens the claw. What the controller and 
+        the inventory show is done already is left out, so restarting the 
+        service doesn't send the robot any commands: the motors stay on, and 
+        a claw that was holding a plate when the service stopped keeps it.
+        Parameters: self (obj)
+        Returns: None
+        """
+        with timed("connect"):
+            self.session.start()
+
+        with self.session:
+            # the controller keeps the motors on between restarts
+            with timed("motors"):
+                if self.robot.sys().get("motor") != 1:
+                    self.robot.set_motor(1)
+
+            with timed("claw"):
+                state = self.gripper.update(self.robot.get_joint(5))
+                plate = self.inventory.plate_at(CLAW)
+                if plate is not None and state != OPEN:
+                    # a fully closed claw reads as closed on nothing
+                    self.gripper.set(HOLDING)
+                else:
+                    if plate is not None:
+                        print("The inventory has %s in the claw but the claw is open" % plate)
+                    # ensures the claw is open when initialized, it only moves if it isn't
+                    self.gripper.open()
+
+    def start_in_background(self):
+        """
+        Description: This function brings up the hardware in a worker thread,
+        jobs wait for it before moving the arm
+        Parameters: self (obj)
+        Returns: future (asyncio.Future) done once the hardware is up
+        """
+        self._ready = asyncio.get_running_loop().run_in_executor(None, self.start)
 
+        return self._ready
+    
     async def robot_info(self, funcname):
         """
         Description: This function displays the commands sent to the robot and
-        information stored about the robot
+        information stored about the robot. It asks the robot, so it is only
+        for debugging, the actions are timed with tracing instead.
         Parameters: robot (obj), funcname (str)
         Returns: None
         """
+        # the query runs in a worker thread so it doesn't block the event loop
+        track = await asyncio.get_running_loop().run_in_executor(None, self.robot.track_cmd)
+
         # displays the data in the command given to the robot and the function it's in
         print(f"\nTrack Command in {funcname}")
-        print(self.robot.track_cmd())
+        print(track)
 
-    async def pickup(self, pos, clawOpen, microscope):
+    def pickup_commands(self, pos, grab, microscope):
         """
-        Description: This function lowers the claw, opens/closes the claw, 
-        then lifts back up
-        Parameters: self (obj), pos (dict), clawOpen (bool), microscope (bool)
-        Return: None
+        Description: This function builds the commands that lower the claw, 
+        grab or release the object, then lift back up. The gripper leaves out 
+        the claw moves that aren't needed.
+        Parameters: self (obj), pos (dict), grab (bool), microscope (bool)
+        Return: commands (list)
         """
+        # the claw has to be open to go down around the object
+        commands = self.gripper.open_commands() if grab else []
+
         # lowers the claw
-        self.robot.lmove(
-            z = pos["z"]-55,
-            vel = 50,
-            accel=500,
-            jerk=2000
-        )
-        # displays robot information
-        await self.robot_info("pickup")
-
-        # if the claw needs to be opened
-        if clawOpen:
-            # opens the claw
-            self.robot.jmove(
-                rel=0,
-                j5 = 0,
-                vel = 175
-            )
-        # if the claw needs to be closed
-        else: 
-            # closes the claw
-            self.robot.jmove(
-                rel=0,
-                j5 = -375,
-                vel = 175
-            )
-        # displays robot information
-        await self.robot_info("pickup close claw")
-        
+        commands += phase([{"cmd": "lmove", "z": pos["z"]-55, "vel": 50, "accel": 500, "jerk": 2000}], "descend")
+
         # lifts up the claw
         # if it's for the microscope, it doesn't lift as much
         if microscope:
-            self.robot.lmove(
-                z = pos["z"]-33, 
-                vel = 50
-            )
+            lift = phase([{"cmd": "lmove", "z": pos["z"]-33, "vel": 50}], "lift")
+        else:
+            lift = phase([{"cmd": "lmove", "z": pos["z"], "vel": 50}], "lift")
+
+        # closes the claw on the object, or lets go of it and opens during the lift
+        if grab:
+            commands += self.gripper.grip_commands() + lift
         else:
-            self.robot.lmove(
-                z = pos["z"], 
-                vel = 50
-            )
-        # displays robot information
-        await self.robot_info("pickup lifts claw")
+            commands += self.gripper.release_commands(lift[0])
+
+        return commands
     
-    async def transport(self, j6):
+    def transport_commands(self, pos, joints=None):
         """
-        Description: This function moves the robotic arm into the transportation
-        position and then moves the robotic arm along the sliding rail to where it 
-        needs to go. 
-        Parameters: robot (obj), pos (dict)
-        Returns: None
+        Description: This function builds the commands that move the robotic 
+        arm along the sliding rail to where it needs to go. The route planner 
+        only folds the arm into the transportation position when the current 
+        joints don't show that a shorter route is safe, and moves the joints 
+        that are safe to move during the rail move with it.
+        Parameters: self (obj), pos (dict), joints (list)
+        Returns: commands (list)
         """
-        # rotates the robot to the transportation position
-        self.robot.jmove(
-            timeout=10, 
-            rel=0, 
-            j0=0,
-            j1=100, 
-            j2=-100, 
-            j3=-88, 
-            j4=0, 
-            vel=200
-        )
-        # displays robot information
-        await self.robot_info("transport")
-
-        # moves the sliding rail to the position given
-        self.robot.jmove(
-            rel=0,
-            j6=j6,
-            vel=120,
-            accel=500,
-            jerk=2000
-        )
-        # displays robot information
-        await self.robot_info("transport")
+        route, commands = plan_route(joints, pos, envelopes=load_envelopes())
+
+        return commands
     
-    async def move_to_initial(self):
+    def move_to_initial_commands(self):
         """
-        Description: This function moves the robotic arm to the initial position
-        Parameters: robot (obj)
-        Returns: None
+        Description: This function builds the command that moves the robotic 
+        arm to the initial position
+        Parameters: self (obj)
+        Returns: commands (list)
         """
         # moves the robotic arm to the initial starting position
-        self.robot.jmove(
-            timeout=10, 
-            rel=0, 
-            j1=100, 
-            j2=-100, 
-            j3=-88, 
-            j4=0, 
-            vel=250,
-            accel=500,
-            jerk=2000,
-        )
-        # displays robot information
-        await self.robot_info("move_to_initial")
-
-    async def grab_from_holder(self, config: GrabFromHolderInput, context=None):
+        return phase([{
+            "cmd": "jmove",
+            "rel": 0, 
+            "j1": 100, 
+            "j2": -100, 
+            "j3": -88, 
+            "j4": 0, 
+            "vel": 250,
+            "accel": 500,
+            "jerk": 2000,
+        }], "home")
+
+    def holder_commands(self, pos, grab, joints=None, home=True):
         """
-        Description: This function performs the action of picking up an object from the plate 
-        holder on the table. It firsts moves the claw to a position above the holder, 
-        lowers itself into the holder, picks up the object and lifts back up. 
-        Parameters: self (obj), config (object), context (None)
-        Return: None
+        Description: This function builds the whole command list for picking 
+        up or placing an object at a plate holder on the table
+        Parameters: self (obj), pos (dict), grab (bool), joints (list),
+        home (bool) whether to go back to the initial position at the end
+        Return: commands (list)
         """
-        self.robot.connect("192.168.2.20")
-        # gets the position of the holder
-        position = config.position
-        pos = self.positions[position]
-
         # moves the robot to the position it needs to be on the slide rail
-        await self.transport(pos["j6"])
+        commands = self.transport_commands(pos, joints)
 
         # rotates the robotic arm first to avoid any obstables
-        self.robot.jmove(
-            rel=0,
-            j0=pos["j0"],
-            vel = 250
-        )
-        # displays robot information
-        await self.robot_info("grab_from_holder")
+        approach = [{"cmd": "jmove", "rel": 0, "j0": pos["j0"], "vel": 250}]
         
         # moves the rest of the robot arm to the initial holder position
-        self.robot.jmove(
-                rel=0,
-                x=pos["x"],
-                y=pos["y"],
-                z=pos["z"],
-                a=pos["a"],
-                b=pos["b"],
-                d=pos["d"],
-                vel = 200
-            )
-        # displays robot information
-        await self.robot_info("grab_from_holder")
-
-        # picks up from the holder
-        await self.pickup(pos, False, False)
+        approach.append({
+            "cmd": "jmove",
+            "rel": 0,
+            "x": pos["x"],
+            "y": pos["y"],
+            "z": pos["z"],
+            "a": pos["a"],
+            "b": pos["b"],
+            "d": pos["d"],
+            "vel": 200
+        })
+        commands += phase(approach, "approach")
+
+        # picks up from/places at the holder
+        commands += self.pickup_commands(pos, grab, False)
 
         # moves to the initial position
-        await self.move_to_initial()
+        if home:
+            commands += self.move_to_initial_commands()
 
-        self.robot.close()
+        return commands
 
-    async def place_at_holder(self, config: PlacesAtHolderInput, context=None): 
+    def microscope_commands(self, pos, grab, joints=None, corner=CORNER, home=True):
         """
-        Description: This function performs the action of placing an object onto the plate 
-        holder on the table. It firsts moves the claw to a position above the holder, 
-        lowers itself into the holder, picks up the object and lifts back up. 
-        Parameters: self (obj), config (object), context (None)
-        Return: None
+        Description: This function builds the whole command list for picking 
+        up or placing a sample at the microscope, blended into one continuous 
+        path that only stops to go down to the sample and grip or release it
+        Parameters: self (obj), pos (dict), grab (bool), joints (list),
+        corner (float) radius of the blends in mm, 0 stops after every move,
+        home (bool) whether to go back to the initial position at the end
+        Return: commands (list)
         """
-        self.robot.connect("192.168.2.20")
-        # gets the position of the holder
-        position = config.position
-        pos = self.positions[position]
-
-        # moves the robot to the position it needs to be on the slide rail
-        await self.transport(pos["j6"])
-
-        # rotates the robotic arm first to avoid any obstables
-        self.robot.jmove(
-            rel=0,
-            j0=pos["j0"],
-            vel = 250
-        )
-        # displays robot information
-        await self.robot_info("grab_from_holder")
-        
-        # moves the rest of the robot arm to the initial holder position
-        self.robot.jmove(
-                rel=0,
-                x=pos["x"],
-                y=pos["y"],
-                z=pos["z"],
-                a=pos["a"],
-                b=pos["b"],
-                d=pos["d"],
-                vel = 200
-            )
-        # displays robot information
-        await self.robot_info("grab_from_holder")
-
-        # picks up from the holder
-        await self.pickup(pos, True, False)
-
-        # moves to the initial position
-        await self.move_to_initial()
-
-        self.robot.close()
-
-    async def grab_from_microscope(self, config: GrabFromMicroscopeInput, context=None):
-        """
-        Description: This function performs the action of picking-up a 
-        sample to the microscope. It first moves the claw to a position in front 
-        and above the microscope, then moves forward to be ontop of the microscope,
-        it then lowers into the tray, then picks-up or releases the sample, then
-        lifts back up, moves away from the microscope, and then lifts back up. 
-        Parameters: self (obj), config (object), context (None)
-        Return: None
-        """
-        self.robot.connect("192.168.2.20")
-        # gets the position of the holder
-        position = config.position
-        # this if is for testing purposes
-        if position != "TestPlateHolder4":
-            pos = await self.get_microscope_position(self.positions["ML1"], position)
-        else:
-            pos = self.positions["TestPlateHolder4"]
-
         # this is to lower the claw compared to initial holder position as to not hit the light
         microOffset = -33
 
         # moves the robot to the position it needs to be on the slide rail
-        await self.transport(pos["j6"])
+        commands = self.transport_commands(pos, joints)
 
         # robots the robotic arm first to avoid any obstables
-        self.robot.jmove(
-            rel=0,
-            j0=pos["j0"],
-            vel = 200
-        )
-        # displays robot information
-        await self.robot_info("action_from_microscope")
+        approach = [{"cmd": "jmove", "rel": 0, "j0": pos["j0"], "vel": 200}]
 
         # determines whether to move forward or backward based on which side of the table it's on
         if pos["y"] > 0:
@@ -366,46 +360,246 @@ class RoboticArm:
             deltaY = -90
 
         # moves the rest of the robotic arm to the initial microscope position
-        self.robot.jmove(
-            rel=0,
-            x = pos["x"],
-            y = pos["y"]-deltaY,
-            z = pos["z"]+microOffset,
-            a = pos["a"],
-            d = pos["d"],
-            vel = 200
-        )
-        # displays robot information
-        await self.robot_info("action_from_microscope")
+        approach.append({
+            "cmd": "jmove",
+            "rel": 0,
+            "x": pos["x"],
+            "y": pos["y"]-deltaY,
+            "z": pos["z"]+microOffset,
+            "a": pos["a"],
+            "d": pos["d"],
+            "vel": 200
+        })
 
         # moves the robotic arm into the microscope to be able to pick-up/place
-        self.robot.lmove(
-            rel=0,
-            y = pos["y"],
-            b = pos["b"],
-            vel = 75
-        )
-        # displays robot information
-        await self.robot_info("action_from_microscope")
-
-        # picks up from the microscope
-        await self.pickup(pos, False, True)
+        approach.append({"cmd": "lmove", "rel": 0, "y": pos["y"], "b": pos["b"], "vel": 75})
+        commands += phase(approach, "approach")
+
+        # picks up from/places at the microscope
+        commands += self.pickup_commands(pos, grab, True)
 
         # moves the robotic arm out of the microscope
-        self.robot.lmove(
-            rel=0,
-            y = pos["y"]-deltaY,
-            z = pos["z"]+microOffset,
-            b = pos["b"],
-            vel = 75
-        )
-        # displays robot information
-        await self.robot_info("action_from_microscope")
+        commands += phase([{
+            "cmd": "lmove",
+            "rel": 0,
+            "y": pos["y"]-deltaY,
+            "z": pos["z"]+microOffset,
+            "b": pos["b"],
+            "vel": 75
+        }], "retract")
 
         # moves to the initial position
-        await self.move_to_initial()
+        if home:
+            commands += self.move_to_initial_commands()
+
+        return blend(commands, corner)
+
+    async def run_action(self, kind, position):
+        """
+        Description: This function carries out one job on the robot, a
+        grab/place action or a whole sequence of them. It is called by the 
+        scheduler, which makes sure only one job runs on the arm at a time.
+        Parameters: self (obj), kind (str), position (str) or the steps of a
+        sequence
+        Return: steps (list) of a sequence, the plate moved otherwise
+        """
+        # a failed bring-up fails every job
+        if self._ready is not None:
+            await asyncio.shield(self._ready)
+
+        if kind == "sequence":
+            return await self.run_sequence_action(position)
+
+        async with self.session:
+            return await self.run_step(kind, position)
+
+    def estimate_job(self, kind, position):
+        """
+        Description: This function predicts how long a job takes when it
+        starts from the initial position
+        Parameters: self (obj), kind (str), position (str) or the steps of a
+        sequence
+        Return: time (float) in s
+        """
+        if kind == "sequence":
+            return sum(self.estimate_job(*step) for step in position)
+
+        # the commands only depend on the station, so each one is worked out once
+        if (kind, position) not in self._estimates:
+            from cycle_time import estimate_action
+            self._estimates[kind, position] = estimate_action(kind, position, self.stations, extension=True)["total"]
+
+        return self._estimates[kind, position]
+
+    def command_times(self, commands, joints):
+        """
+        Description: This function predicts how long each command takes
+        Parameters: self (obj), commands (list), joints (list) at the start
+        Return: times (list) in s, None if they can't be predicted
+        """
+        from cycle_time import estimate, JOINT_KEYS
+        try:
+            result = estimate(commands, dict(zip(JOINT_KEYS, joints)), self.stations.stations.values())
+        except ValueError as e:
+            print("Could not estimate the action: %s" % e)
+            return None
+
+        return [segment["time"] for segment in result["segments"]]
+
+    async def run_step(self, kind, position, home=True, step=None, later=0):
+        """
+        Description: This function carries out one grab/place action on the 
+        robot, the caller holds the session. The running job is told which 
+        phase the action is in and how long it still takes.
+        Parameters: self (obj), kind (str), position (str), home (bool)
+        whether to go back to the initial position at the end, step (int) of
+        a sequence, later (float) time taken by the steps after this one
+        Return: plate (str) that was moved
+        """
+        # whether the claw grabs an object or places the one it holds
+        grab = kind.startswith("grab")
+
+        # gets the position of the holder or microscope
+        pos = self.stations.lookup(position)
+
+        # the jobs queued before this one have changed the inventory, so the
+        # request is checked again before the arm moves
+        self.inventory.check(kind, position)
+
+        # streams the whole action to the robot over the shared connection,
+        # the executor records the time of every phase when tracing is on
+        with span(kind, position=position):
+            joints = await self.motion.joints()
+            self.gripper.update(joints[5])
+            if kind.endswith("holder"):
+                commands = self.holder_commands(pos, grab, joints, home=home)
+            else:
+                commands = self.microscope_commands(pos, grab, joints, home=home)
+
+            # reports the phase of the next command to complete and the time left
+            job = self.scheduler.current
+            times = self.command_times(commands, joints)
+            def progress(completed):
+                if job is not None:
+                    remaining = sum(times[completed:]) + later if times is not None else None
+                    job.report(commands[min(completed, len(commands) - 1)].get(PHASE_KEY), remaining, step)
+            progress(0)
+
+            try:
+                await self.motion.run(commands, progress)
+            except BaseException:
+                # the claw may have stopped anywhere, it is read again next time
+                self.gripper.set(UNKNOWN)
+                raise
+            self.gripper.set(HOLDING if grab else OPEN)
+
+            return self.inventory.record(kind, position)
+
+    async def run_sequence_action(self, steps):
+        """
+        Description: This function carries out the steps of a sequence one
+        after the other over one connection. Between a grab and the place
+        after it the arm isn't sent back to its initial position, the route
+        planner folds it on the way. A failed step stops the sequence.
+        Parameters: self (obj), steps (list) of (kind, position)
+        Return: steps (list) with the plate moved and the time each step took
+        """
+        results = []
+        # the later steps are predicted from the initial position
+        times = [self.estimate_job(kind, position) for kind, position in steps]
+        with span("sequence", steps=len(steps)):
+            async with self.session:
+                for index, (kind, position) in enumerate(steps):
+                    # a grab goes straight on to the place after it, the route
+                    # planner folds the arm in place as going home would
+                    last = index == len(steps) - 1
+                    home = last or not (kind.startswith("grab") and steps[index + 1][0].startswith("place"))
+                    start = monotonic()
+                    try:
+                        plate = await self.run_step(kind, position, home, index + 1, sum(times[index + 1:]))
+                    except BaseException as e:
+                        # the steps that were done are reported with the error,
+                        # or when the sequence is cancelled
+                        error = "cancelled" if isinstance(e, asyncio.CancelledError) else str(e)
+                        results.append({"kind": kind, "position": position, "error": error})
+                        e.result = results
+                        raise
+                    results.append({"kind": kind, "position": position, "plate": plate,
+                                    "duration": monotonic() - start})
+
+        return results
+
+    def station(self, position, inventory):
+        """
+        Description: This function finds the station a request is for
+        Parameters: self (obj), position (str) station or plate ID, inventory
+        (Inventory) that knows where the plates are
+        Return: station (str)
+        """
+        # a plate ID stands for the station the plate is at
+        station = inventory.where(position)
+        if station is not None and station != CLAW:
+            position = station
+
+        # unknown stations are rejected before anything is queued
+        return self.stations.canonical(position)
+
+    async def request(self, kind, position, priority=0, wait=True):
+        """
+        Description: This function queues a grab/place action and waits for
+        it, or returns the queued job straight away. A plate ID can be given 
+        in place of the station it is at. When nothing is queued, a request 
+        the inventory shows can't work is turned down right away.
+        Parameters: self (obj), kind (str), position (str), priority (int),
+        wait (bool)
+        Return: job (dict), with the plate that was moved once it is done
+        """
+        position = self.station(position, self.inventory)
+        if self.scheduler.current is None and not self.scheduler.pending():
+            self.inventory.check(kind, position)
+
+        job = self.scheduler.submit(kind, position, priority)
+        if not wait:
+            return self.scheduler.status(job.id)
+
+        info = await job.wait()
+        plate = info.pop("result", None)
+        if info["status"] == "done":
+            info["plate"] = plate
 
-        self.robot.close()
+        return info
+
+    async def grab_from_holder(self, config: GrabFromHolderInput, context=None):
+        """
+        Description: This function performs the action of picking up an object from the plate 
+        holder on the table. It firsts moves the claw to a position above the holder, 
+        lowers itself into the holder, picks up the object and lifts back up. 
+        Parameters: self (obj), config (object), context (None)
+        Return: job (dict)
+        """
+        return await self.request("grab_from_holder", config.position, config.priority, config.wait)
+
+    async def place_at_holder(self, config: PlacesAtHolderInput, context=None): 
+        """
+        Description: This function performs the action of placing an object onto the plate 
+        holder on the table. It firsts moves the claw to a position above the holder, 
+        lowers itself into the holder, picks up the object and lifts back up. 
+        Parameters: self (obj), config (object), context (None)
+        Return: job (dict)
+        """
+        return await self.request("place_at_holder", config.position, config.priority, config.wait)
+
+    async def grab_from_microscope(self, config: GrabFromMicroscopeInput, context=None):
+        """
+        Description: This function performs the action of picking-up a 
+        sample to the microscope. It first moves the claw to a position in front 
+        and above the microscope, then moves forward to be ontop of the microscope,
+        it then lowers into the tray, then picks-up or releases the sample, then
+        lifts back up, moves away from the microscope, and then lifts back up. 
+        Parameters: self (obj), config (object), context (None)
+        Return: job (dict)
+        """
+        return await self.request("grab_from_microscope", config.position, config.priority, config.wait)
 
     async def place_at_microscope(self, config: PlacesAtMicroscopeInput, context=None):
         """
@@ -415,79 +609,83 @@ class RoboticArm:
         it then lowers into the tray, then picks-up or releases the sample, then
         lifts back up, moves away from the microscope, and then lifts back up. 
         Parameters: self (obj), config (object), context (None)
-        Return: None
-        """
-        self.robot.connect("192.168.2.20")
-        # gets the position of the holder
-        position = config.position
-        # this if is for testing purposes
-        if position != "TestPlateHolder4":
-            pos = await self.get_microscope_position(self.positions["ML1"], position)
-        else:
-            pos = self.positions["TestPlateHolder4"]
-
-        # this is to lower the claw compared to initial holder position as to not hit the light
-        microOffset = -33
-
-        # moves the robot to the position it needs to be on the slide rail
-        await self.transport(pos["j6"])
-
-        # robots the robotic arm first to avoid any obstables
-        self.robot.jmove(
-            rel=0,
-            j0=pos["j0"],
-            vel = 200
-        )
-        # displays robot information
-        await self.robot_info("action_from_microscope")
+        Return: job (dict)
+        """
+        return await self.request("place_at_microscope", config.position, config.priority, config.wait)
 
-        # determines whether to move forward or backward based on which side of the table it's on
-        if pos["y"] > 0:
-            deltaY = 90
-        else:
-            deltaY = -90
+    async def run_sequence(self, config: RunSequenceInput, context=None):
+        """
+        Description: This function performs a list of grab and place actions
+        as one job, so other requests don't run in between. The steps are
+        tried out on a copy of the inventory first, so a plate ID stands for
+        where the plate will be by then, and a sequence that can't work is
+        turned down before the arm moves.
+        Parameters: self (obj), config (object), context (None)
+        Return: job (dict), with the plate moved and the time taken by each step
+        """
+        if not config.steps:
+            raise ValueError("The sequence has no steps")
+
+        # with other jobs queued the inventory will have changed by the time
+        # the sequence runs, every step is checked again then
+        inventory = self.inventory.copy()
+        check = self.scheduler.current is None and not self.scheduler.pending()
+        steps = []
+        for step in config.steps:
+            position = self.station(step.position, inventory)
+            if check:
+                inventory.check(step.kind, position)
+            inventory.record(step.kind, position)
+            steps.append((step.kind, position))
+
+        job = self.scheduler.submit("sequence", tuple(steps), config.priority)
+        if not config.wait:
+            return self.scheduler.status(job.id)
+
+        info = await job.wait()
+        info["steps"] = info.pop("result", [])
+
+        return info
+
+    async def get_jobs(self, config: GetJobsInput, context=None):
+        """
+        Description: This function tells how a job is going, or how all the
+        running and waiting jobs are going
+        Parameters: self (obj), config (object), context (None)
+        Return: job (dict), or the running job and the waiting jobs (dict)
+        """
+        if config.job_id is not None:
+            info = self.scheduler.status(config.job_id)
+            if info is None:
+                raise ValueError("Unknown job %s" % config.job_id)
+            return info
 
-        # moves the rest of the robotic arm to the initial microscope position
-        self.robot.jmove(
-            rel=0,
-            x = pos["x"],
-            y = pos["y"]-deltaY,
-            z = pos["z"]+microOffset,
-            a = pos["a"],
-            d = pos["d"],
-            vel = 200
-        )
-        # displays robot information
-        await self.robot_info("action_from_microscope")
+        current = self.scheduler.current
 
-        # moves the robotic arm into the microscope to be able to pick-up/place
-        self.robot.lmove(
-            rel=0,
-            y = pos["y"],
-            b = pos["b"],
-            vel = 75
-        )
-        # displays robot information
-        await self.robot_info("action_from_microscope")
-
-        # picks up from the microscope
-        await self.pickup(pos, True, True)
+        return {
+            "running": self.scheduler.status(current.id) if current is not None else None,
+            "waiting": self.scheduler.pending(),
+        }
 
-        # moves the robotic arm out of the microscope
-        self.robot.lmove(
-            rel=0,
-            y = pos["y"]-deltaY,
-            z = pos["z"]+microOffset,
-            b = pos["b"],
-            vel = 75
-        )
-        # displays robot information
-        await self.robot_info("action_from_microscope")
+    async def cancel_job(self, config: CancelJobInput, context=None):
+        """
+        Description: This function cancels a job, the robotic arm halts if the
+        job is running
+        Parameters: self (obj), config (object), context (None)
+        Return: job (dict)
+        """
+        if not self.scheduler.cancel(config.job_id):
+            raise ValueError("Job %s is not waiting or running" % config.job_id)
 
-        # moves to the initial position
-        await self.move_to_initial()
+        return self.scheduler.status(config.job_id)
 
-        self.robot.close()
+    async def get_inventory(self, config: GetInventoryInput, context=None):
+        """
+        Description: This function lists which plate is at which station
+        Parameters: self (obj), config (object), context (None)
+        Return: stations (dict) station -> plate, None if empty
+        """
+        return self.inventory.snapshot()
 
     async def calibrate(self):
         """
@@ -496,24 +694,41 @@ class RoboticArm:
         Parameters: self (obj)
         Return Val: None
         """
-        controller = RoboticArmController(self.robot, self.positions)
-        await controller.calibrate_arm()
+        # pygame is only loaded when a controller is used
+        from controller_calibration import RoboticArmController
+
+        # the controller loop blocks, so it runs in a worker thread
+        loop = asyncio.get_running_loop()
+        if self._ready is not None:
+            await asyncio.shield(self._ready)
+        async with self.session:
+            controller = await loop.run_in_executor(None, RoboticArmController, self.robot, self.positions)
+            await loop.run_in_executor(None, controller.calibrate_arm)
 
 def get_schema():
     
         return {
             "grab_from_holder": GrabFromHolderInput.schema(),
-            "place_at_holder": GrabFromHolderInput.schema(),
-            "grab_from_microscope": GrabFromHolderInput.schema(),
-            "place_at_microscope": GrabFromHolderInput.schema(),
+            "place_at_holder": PlacesAtHolderInput.schema(),
+            "grab_from_microscope": GrabFromMicroscopeInput.schema(),
+            "place_at_microscope": PlacesAtMicroscopeInput.schema(),
+            "run_sequence": RunSequenceInput.schema(),
+            "get_jobs": GetJobsInput.schema(),
+            "cancel_job": CancelJobInput.schema(),
+            "get_inventory": GetInventoryInput.schema(),
             "calibrate": RoboticArmCalibration.schema(),
         }
 
 
 
 
-async def setup():
-    robot = RoboticArm()
+async def setup(host=DEFAULT_HOST, simulation=False, time_scale=1.0):
+    start = monotonic()
+    # a simulated run keeps its inventory in memory, away from the bench's
+    robot = RoboticArm(host, simulation, time_scale, inventory=None if simulation else INVENTORY, start=False)
+    # the hardware comes up while logging in and registering the service
+    ready = robot.start_in_background()
+
     # Define an chatbot extension
     robotic_arm_control_extension = {
         "_rintf": True,
@@ -531,17 +746,31 @@ async def setup():
             "place_at_holder": robot.place_at_holder,
             "grab_from_microscope": robot.grab_from_microscope,
             "place_at_microscope": robot.place_at_microscope,
+            "run_sequence": robot.run_sequence,
+            "get_jobs": robot.get_jobs,
+            "cancel_job": robot.cancel_job,
+            "get_inventory": robot.get_inventory,
             "calibrate": robot.calibrate,
         }
     }
 
     server_url = "https://chat.bioimage.io"
-    token = await login({"server_url": server_url})
-    server = await connect_to_server({"server_url": server_url, "token": token, "method_timeout": 150})
-    svc = await server.register_service(robotic_arm_control_extension)
+    with timed("login"):
+        token = await login({"server_url": server_url})
+    with timed("connect_to_server"):
+        server = await connect_to_server({"server_url": server_url, "token": token, "method_timeout": 150})
+    with timed("register"):
+        svc = await server.register_service(robotic_arm_control_extension)
 
     print(f"Extension service registered with id: {svc.id}, you can visit the service at:\n https://bioimage.io/chat?server={server_url}&extension={svc.id}&assistant=Skyler")
 
+    try:
+        await ready
+    except Exception as e:
+        print("The robotic arm could not be brought up, jobs will fail: %s" % e)
+    STARTUP["setup"] = monotonic() - start
+    print(startup_report())
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Robotic Arm Control services for Hypha."
@@ -550,19 +779,32 @@ if __name__ == "__main__":
         "--simulation",
         dest="simulation",
         action="store_true",
-        default=True,
-        help="Run in simulation mode (default: True)"
+        default=False,
+        help="Run against the simulated robot, its moves are left out of the inventory (default: False)"
     )
     parser.add_argument(
         "--no-simulation",
         dest="simulation",
         action="store_false",
-        help="Run without simulation mode"
+        help="Run with the robot at --robot-host (default)"
+    )
+    parser.add_argument(
+        "--robot-host",
+        dest="robot_host",
+        default=DEFAULT_HOST,
+        help="Address of the robot (default: %s)" % DEFAULT_HOST
+    )
+    parser.add_argument(
+        "--time-scale",
+        dest="time_scale",
+        type=float,
+        default=1.0,
+        help="In simulation, how long motions take compared to the arm, 0 is instant (default: 1)"
     )
     # whether to run with verbose enabled or not
     parser.add_argument("--verbose", "-v", action="count")
     args = parser.parse_args()
 
     loop = asyncio.get_event_loop()
-    loop.create_task(setup())
+    loop.create_task(setup(args.robot_host, args.simulation, args.time_scale))
     loop.run_forever()
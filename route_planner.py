@@ -0,0 +1,177 @@
+import os
+import json
+from tracing import phase
+
+# the folded transportation pose of the arm (without j0), as used by transport()
+FOLD_POSE = {"j1": 100, "j2": -100, "j3": -88, "j4": 0}
+
+# how far (in degrees) a joint may be from the fold pose and still count as folded
+FOLD_TOLERANCE = 2
+
+# rail positions closer than this (in mm) count as the same station
+RAIL_TOLERANCE = 0.5
+
+# j0 values closer to 0 than this are not considered to be on either side of the table
+SIDE_TOLERANCE = 20
+
+# joints that may move together with the rail into each station, written by
+# `python workspace.py envelopes --output safe_envelopes.json` after checking
+# them against the bench. The box model's sizes are estimated, so the file
+# ships empty and every rail move starts from the folded arm until the bench
+# has been measured.
+ENVELOPES = "safe_envelopes.json"
+
+# velocities used by the transport moves
+FOLD_VEL = 200
+RAIL_VEL = 120
+RAIL_ACCEL = 500
+RAIL_JERK = 2000
+
+def is_folded(joints):
+    """
+    Description: This function checks whether the arm is in the folded
+    transportation pose, ignoring the rotation of j0
+    Parameters: joints (list)
+    Returns: (bool)
+    """
+    for key, value in FOLD_POSE.items():
+        if abs(joints[int(key[1:])] - value) > FOLD_TOLERANCE:
+            return False
+
+    return True
+
+def side(j0, y=None):
+    """
+    Description: This function determines which side of the table the arm
+    points to. The sign of y is used when it is given since it does not depend
+    on small j0 corrections.
+    Parameters: j0 (float), y (float)
+    Returns: side (int) 1, -1 or 0 if it can't be told
+    """
+    if y is not None and y != 0:
+        return 1 if y > 0 else -1
+    if j0 > SIDE_TOLERANCE:
+        return 1
+    if j0 < -SIDE_TOLERANCE:
+        return -1
+
+    return 0
+
+def fold_commands():
+    """
+    Description: This function builds the command that folds the arm into the
+    transportation position facing along the rail
+    Parameters: None
+    Returns: commands (list)
+    """
+    return phase([dict({"cmd": "jmove", "rel": 0, "j0": 0}, **FOLD_POSE, vel=FOLD_VEL)], "transport")
+
+def rail_commands(j6):
+    """
+    Description: This function builds the command that moves the sliding rail
+    Parameters: j6 (float)
+    Returns: commands (list)
+    """
+    return phase([{"cmd": "jmove", "rel": 0, "j6": j6, "vel": RAIL_VEL, "accel": RAIL_ACCEL, "jerk": RAIL_JERK}], "rail")
+
+_envelopes = {}
+
+def load_envelopes(path=ENVELOPES):
+    """
+    Description: This function reads the safe envelopes of the stations, the
+    file is only read again when it changes
+    Parameters: path (str)
+    Returns: envelopes (dict), empty if there is no file
+    """
+    if not os.path.exists(path):
+        return {}
+    stamp = os.stat(path).st_mtime_ns
+    if path not in _envelopes or _envelopes[path][0] != stamp:
+        with open(path, 'r') as file:
+            _envelopes[path] = (stamp, json.load(file))
+
+    return _envelopes[path][1]
+
+def overlap_joints(pos, envelopes):
+    """
+    Description: This function finds the joints that may move together with
+    the rail on the way to pos. The envelope only counts if it was worked
+    out for the station as it is recorded now.
+    Parameters: pos (dict), envelopes (dict)
+    Returns: joints (dict), empty if nothing may move with the rail
+    """
+    for envelope in envelopes.values():
+        station = envelope["station"]
+        if all(key in pos and abs(pos[key] - value) <= RAIL_TOLERANCE for key, value in station.items()):
+            return envelope["joints"]
+
+    return {}
+
+def plan_route(joints, pos, workspace=None, envelopes=None):
+    """
+    Description: This function plans the route to the station given by pos
+    as _plan() does. With the safe envelopes of the stations, the joints
+    that may move during the rail move are merged into it, so the arm
+    reaches its approach pose while it slides instead of after.
+    Parameters: joints (list), pos (dict), workspace (obj), envelopes (dict)
+    Returns: route (str), commands (list)
+    """
+    route, commands = _plan(joints, pos, workspace)
+
+    # the envelopes were checked from the folded arm
+    if envelopes and commands and (route == "retract" or is_folded(joints)):
+        overlap = overlap_joints(pos, envelopes)
+        if overlap:
+            commands[-1].update(overlap)
+            route += "+overlap"
+
+    return route, commands
+
+def _plan(joints, pos, workspace=None):
+    """
+    Description: This function chooses the cheapest safe way of getting from
+    the current joint state to the station given by pos:
+        "direct"  - the arm is folded at the right rail position, only j0 has
+                    to rotate, which the actions already do
+        "rail"    - the arm is folded and stays on the same side of the table,
+                    so only the rail has to move
+        "retract" - the arm is folded facing along the rail and the rail moves,
+                    which is what transport() always did
+    The full retract is used whenever the joint state is unknown. An arm that
+    isn't folded is folded in place first, without turning j0, as going back
+    to the initial position does, and the route is chosen from there ("fold+"
+    route), unless a model of the bench (workspace.Workspace) shows that the
+    rail can move with the arm as it is.
+    Parameters: joints (list), pos (dict), workspace (obj) checks the rail
+    move of an arm that isn't folded when given
+    Returns: route (str), commands (list)
+    """
+    # without the current state, nothing can be assumed
+    if joints is None:
+        return "retract", fold_commands() + rail_commands(pos["j6"])
+
+    # not folded, the rail may only move if the model shows nothing is in the way
+    if not is_folded(joints):
+        if workspace is not None and workspace.check(rail_commands(pos["j6"]), joints)["ok"]:
+            return "rail", rail_commands(pos["j6"])
+        # turning j0 while folding could sweep the claw through a station
+        fold = phase([dict({"cmd": "jmove", "rel": 0}, **FOLD_POSE, vel=FOLD_VEL)], "transport")
+        folded = list(joints)
+        for key, value in FOLD_POSE.items():
+            folded[int(key[1:])] = value
+        route, commands = _plan(folded, pos)
+        return "fold+" + route, fold + commands
+
+    sameRail = abs(joints[6] - pos["j6"]) <= RAIL_TOLERANCE
+    currentSide = side(joints[0])
+    targetSide = side(pos["j0"], pos.get("y"))
+
+    # folded at the station already, rotating j0 in place is safe
+    if sameRail:
+        return "direct", []
+
+    # folded and staying on the same side, the rail can move right away
+    if currentSide != 0 and currentSide == targetSide:
+        return "rail", rail_commands(pos["j6"])
+
+    return "retract", fold_commands() + rail_commands(pos["j6"])
@@ -0,0 +1,204 @@
+import argparse
+import json
+from motion_executor import executor_for
+
+# highest velocity a scaled command is sent with, the fastest the bench's
+# own actions move (move_to_initial), the controller's limit isn't recorded
+MAX_VEL = 250
+
+# motion profile the controller uses for commands that don't give one
+DEFAULT_PROFILE = {
+    "jmove": {"vel": 100, "accel": 500, "jerk": 2000},
+    "lmove": {"vel": 100, "accel": 500, "jerk": 2000},
+}
+
+# commands whose speed can be scaled
+SCALED_COMMANDS = tuple(DEFAULT_PROFILE)
+
+class Macro:
+    """
+    Description: This class is one section of a recorded script, e.g. the
+    commands under "# grab from Cytomat"
+    Parameters: index (int), name (str), level (int), line (int)
+    """
+
+    __slots__ = ("index", "name", "level", "line", "commands")
+
+    def __init__(self, index, name, level, line):
+        self.index = index
+        self.name = name
+        # the number of # in front of the header
+        self.level = level
+        self.line = line
+        self.commands = []
+
+    def __repr__(self):
+        return "Macro(%d, %r, %d commands)" % (self.index, self.name, len(self.commands))
+
+def split_commands(line):
+    """
+    Description: This function reads the commands on one line. Recording
+    sometimes glues two commands together or leaves stray characters behind
+    the last one, these are handled here.
+    Parameters: line (str)
+    Returns: commands (list), rest (str) whatever could not be read
+    """
+    decoder = json.JSONDecoder()
+    commands = []
+    index = 0
+    while index < len(line) and line[index] == "{":
+        cmd, index = decoder.raw_decode(line, index)
+        commands.append(cmd)
+        while index < len(line) and line[index].isspace():
+            index += 1
+
+    return commands, line[index:]
+
+def parse_script(path):
+    """
+    Description: This function reads a recorded script of JSON command lines
+    and splits it into macros at every header line such as "# grab from
+    Cytomat" or "## Init robotic arm". Commands before the first header go in
+    a macro named "start".
+    Parameters: path (str)
+    Returns: macros (list)
+    """
+    macros = []
+    with open(path, 'r') as file:
+        for lineCount, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith("{"):
+                level = len(line) - len(line.lstrip("#/"))
+                macros.append(Macro(len(macros), line.strip("#/: ").strip(), level, lineCount))
+                continue
+
+            try:
+                commands, rest = split_commands(line)
+            except ValueError:
+                raise ValueError("Line %d of %s is not a command: %s" % (lineCount, path, line))
+            if rest:
+                print("Ignoring %r after the command on line %d of %s" % (rest, lineCount, path))
+            if not macros:
+                macros.append(Macro(0, "start", 0, lineCount))
+            macros[-1].commands += commands
+
+    return macros
+
+def find_macro(macros, section):
+    """
+    Description: This function finds a macro by its index or by its name, the
+    first one is used when several macros have the same name
+    Parameters: macros (list), section (int or str)
+    Returns: macro (Macro)
+    """
+    if isinstance(section, int) or str(section).isdigit():
+        index = int(section)
+        if 0 <= index < len(macros):
+            return macros[index]
+    else:
+        for macro in macros:
+            if macro.name.lower() == str(section).strip().lower():
+                return macro
+
+    raise ValueError("Unknown section %s" % section)
+
+def scale_command(cmd, speed):
+    """
+    Description: This function scales the speed of a command. The velocity is
+    scaled by the factor, the acceleration by its square and the jerk by its
+    cube, so the whole motion profile is stretched in time. What a command
+    doesn't give is taken from the controller's default profile, and the
+    factor is lowered so the velocity stays within MAX_VEL.
+    Parameters: cmd (dict), speed (float)
+    Returns: cmd (dict)
+    """
+    if speed == 1 or cmd.get("cmd") not in SCALED_COMMANDS:
+        return cmd
+    cmd = dict(cmd)
+    for key, value in DEFAULT_PROFILE[cmd["cmd"]].items():
+        cmd.setdefault(key, value)
+    if cmd["vel"] > 0:
+        speed = min(speed, max(MAX_VEL, cmd["vel"]) / cmd["vel"])
+    cmd["vel"] = cmd["vel"] * speed
+    cmd["accel"] = cmd["accel"] * speed**2
+    cmd["jerk"] = cmd["jerk"] * speed**3
+
+    return cmd
+
+def replay_commands(macros, start=None, stop=None, speed=1):
+    """
+    Description: This function lists the commands of the macros from the
+    start section up to, but not including, the stop section
+    Parameters: macros (list), start (int or str), stop (int or str), speed (float)
+    Returns: commands (list)
+    """
+    first = find_macro(macros, start).index if start is not None else 0
+    last = find_macro(macros, stop).index if stop is not None else len(macros)
+
+    commands = []
+    for macro in macros[first:last]:
+        commands += [scale_command(cmd, speed) for cmd in macro.commands]
+
+    return commands
+
+def replay(robot, macros, start=None, stop=None, speed=1, lookahead=4, dry_run=False):
+    """
+    Description: This function streams the macros to the robot through the
+    motion executor, or only prints them in a dry run
+    Parameters: robot (obj), macros (list), start (int or str), stop (int or
+    str), speed (float), lookahead (int), dry_run (bool)
+    Returns: handle (MotionHandle) or the commands in a dry run
+    """
+    commands = replay_commands(macros, start, stop, speed)
+    if speed != 1 and not any(cmd.get("cmd") in SCALED_COMMANDS for cmd in commands):
+        print("Warning: no command could be scaled, replaying at the recorded speed")
+    if dry_run:
+        for cmd in commands:
+            print(json.dumps(cmd))
+        return commands
+
+    return executor_for(robot, lookahead).submit(commands)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replays recorded robot command scripts."
+    )
+    parser.add_argument("script", help="recorded script, e.g. record.txt")
+    parser.add_argument("--list", action="store_true", help="list the sections and exit")
+    parser.add_argument("--start", help="section to start from, by index or name")
+    parser.add_argument("--stop", help="section to stop before, by index or name")
+    parser.add_argument("--speed", type=float, default=1, help="speed scale (default: 1)")
+    parser.add_argument("--lookahead", type=int, default=4, help="commands queued on the robot (default: 4)")
+    parser.add_argument("--dry-run", action="store_true", help="print the commands instead of moving")
+    parser.add_argument("--host", help="address of the robot")
+    parser.add_argument("--simulation", action="store_true", help="replay on the simulated robot")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="in simulation, time taken compared to the arm (default: 1)")
+    args = parser.parse_args()
+
+    macros = parse_script(args.script)
+    if args.list:
+        for macro in macros:
+            print("%3d  %s%s (%d commands)" % (macro.index, "  " * max(0, macro.level-1), macro.name, len(macro.commands)))
+    elif args.dry_run:
+        replay(None, macros, args.start, args.stop, args.speed, dry_run=True)
+    else:
+        from robot_session import RobotSession, DEFAULT_HOST
+
+        robot = None
+        if args.simulation:
+            from dorna_simulator import SimulatedDorna
+            robot = SimulatedDorna(args.time_scale)
+
+        session = RobotSession(args.host or DEFAULT_HOST, robot=robot, heartbeat=0)
+        session.start()
+        with session as robot:
+            robot.set_motor(1)
+            handle = replay(robot, macros, args.start, args.stop, args.speed, args.lookahead)
+            try:
+                handle.wait()
+            except KeyboardInterrupt:
+                handle.cancel()
+                handle.wait()
+        session.close()
@@ -0,0 +1,188 @@
+import re
+
+# the cartesian and joint fields stored for every station
+FIELDS = ("x", "y", "z", "a", "b", "d", "j0", "j1", "j2", "j3", "j4", "j6")
+
+# number of microscopes on each side of the rail
+MICROSCOPES_PER_SIDE = 4
+
+# distance between microscopes in mm, converted to the change in d
+MICROSCOPE_SPACING = 800 * (256.76-254.2)/7
+
+# long and short names of the microscopes, e.g. MicroscopeLeft2 or ML2
+MICROSCOPE_NAME = re.compile(r"^(?:Microscope(Left|Right)|M(L|R))(\d+)$")
+
+class Position:
+    """
+    Description: This class is one immutable station position holding both
+    the cartesian and the joint coordinates. It can be read like the position
+    dictionaries used everywhere else, e.g. pos["j6"], without allocating.
+    Parameters: name (str), kind (str), values (dict)
+    """
+
+    __slots__ = ("name", "kind") + FIELDS
+
+    def __init__(self, name, kind, values):
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "kind", kind)
+        for field in FIELDS:
+            object.__setattr__(self, field, float(values[field]))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Position is immutable")
+
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in FIELDS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in FIELDS else default
+
+    def keys(self):
+        return FIELDS
+
+    def as_dict(self):
+        """
+        Description: This function copies the position into a dictionary
+        Parameters: self (obj)
+        Returns: pos (dict)
+        """
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __repr__(self):
+        return "Position(%s, j0=%g, j6=%g)" % (self.name, self.j0, self.j6)
+
+def parse_microscope(name):
+    """
+    Description: This function reads the side and number out of a microscope
+    name
+    Parameters: name (str)
+    Returns: side (str) "Left" or "Right", number (int), or None if the name
+    is not a microscope
+    """
+    match = MICROSCOPE_NAME.match(name)
+    if match is None:
+        return None
+    side = match.group(1) or ("Left" if match.group(2) == "L" else "Right")
+    number = int(match.group(3))
+    if number < 1:
+        return None
+
+    return side, number
+
+def microscope_position(ML1, side, number):
+    """
+    Description: This function works out the position of a microscope from
+    the first left microscope, assuming equal spacing between microscopes.
+    The right side mirrors the left one.
+    Parameters: ML1 (dict), side (str), number (int)
+    Returns: microscopePos (dict)
+    """
+    if side == "Left":
+        y = ML1["y"]
+        j0 = ML1["j0"]
+    elif side == "Right":
+        y = abs(ML1["y"])
+        j0 = abs(ML1["j0"])
+    else:
+        raise ValueError("Wrong side %s" % side)
+
+    # calculates the distance on the rail from ML1
+    d = ML1["d"] + MICROSCOPE_SPACING*(number-1)
+
+    microscopePos = {field: ML1[field] for field in FIELDS}
+    microscopePos["y"] = y
+    microscopePos["j0"] = j0
+    microscopePos["d"] = d
+    microscopePos["j6"] = d
+
+    return microscopePos
+
+class StationIndex:
+    """
+    Description: This class materializes every station once: the entries of
+    the positions file (holders, Cytomat, ...) and all the microscopes on
+    both sides, worked out from ML1. Stations are looked up by their
+    canonical name or an alias such as ML2 for MicroscopeLeft2, so names can
+    be checked before the arm moves.
+    Parameters: positions (dict), microscopes (int) per side
+    """
+
+    def __init__(self, positions, microscopes=MICROSCOPES_PER_SIDE):
+        self.stations = {}
+        self.aliases = {}
+
+        ML1 = positions.get("ML1", positions.get("MicroscopeLeft1"))
+        for name, values in positions.items():
+            # the microscopes are added below from ML1
+            if parse_microscope(name) is not None and ML1 is not None:
+                continue
+            # skips recorded entries that miss coordinates
+            if any(field not in values for field in FIELDS):
+                continue
+            kind = "cytomat" if name.lower().startswith("cytomat") else "holder"
+            self._add(Position(name, kind, values))
+
+        if ML1 is not None:
+            for side in ("Left", "Right"):
+                for number in range(1, microscopes+1):
+                    name = "Microscope%s%d" % (side, number)
+                    self._add(Position(name, "microscope", microscope_position(ML1, side, number)))
+                    self.aliases["M%s%d" % (side[0], number)] = name
+
+        # names are also accepted in any case
+        for alias, name in list(self.aliases.items()):
+            self.aliases.setdefault(alias.lower(), name)
+
+    def _add(self, position):
+        self.stations[position.name] = position
+        self.aliases[position.name] = position.name
+
+    def canonical(self, name):
+        """
+        Description: This function gives the canonical name of a station
+        Parameters: self (obj), name (str)
+        Returns: name (str)
+        """
+        canonical = self.aliases.get(name)
+        if canonical is None:
+            canonical = self.aliases.get(str(name).strip().lower())
+        if canonical is None:
+            raise ValueError("Unknown station %s" % name)
+
+        return canonical
+
+    def lookup(self, name):
+        """
+        Description: This function gives the position of a station, unknown
+        names are rejected with a ValueError
+        Parameters: self (obj), name (str)
+        Returns: position (Position)
+        """
+        position = self.stations.get(name)
+        if position is None:
+            position = self.stations[self.canonical(name)]
+
+        return position
+
+    def __getitem__(self, name):
+        return self.lookup(name)
+
+    def __contains__(self, name):
+        try:
+            self.canonical(name)
+        except ValueError:
+            return False
+        return True
+
+    def names(self, kind=None):
+        """
+        Description: This function lists the canonical station names
+        Parameters: self (obj), kind (str) only stations of this kind if given
+        Returns: names (list)
+        """
+        return [name for name, position in self.stations.items() if kind is None or position.kind == kind]
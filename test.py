@@ -1,5 +1,6 @@
 from dorna2 import Dorna
 from time import sleep
+from robot_session import DEFAULT_HOST
 
 def pickup_sample(robot, gripper, velocity):
     robot.jmove(
@@ -76,7 +77,7 @@ def move_to_initial_pose(robot, gripper, velocity):
 
 def main():
     robot = Dorna()
-    print(robot.connect("192.168.2.20"))
+    print(robot.connect(DEFAULT_HOST))
     robot.set_motor(1)
 
     # Initial position values including slide motor (j6)
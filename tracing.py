@@ -0,0 +1,242 @@
+import os
+import json
+import atexit
+import threading
+from collections import deque
+from time import monotonic_ns
+
+# the phases of a transfer, commands are tagged with them under PHASE_KEY
+PHASES = ("transport", "rail", "approach", "descend", "grip", "lift", "retract", "home")
+PHASE_KEY = "_phase"
+
+# upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+
+def phase(commands, name):
+    """
+    Description: This function tags commands with the phase of the transfer
+    they belong to. The tag is dropped by the motion executor before the
+    command is sent to the robot.
+    Parameters: commands (list), name (str) one of PHASES
+    Returns: commands (list) the same list
+    """
+    for cmd in commands:
+        cmd[PHASE_KEY] = name
+
+    return commands
+
+class _NullSpan:
+    # what span() gives when tracing is off, it does nothing
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = monotonic_ns()
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        if excType is not None:
+            self.args["error"] = repr(exc)
+        self.tracer.add(self.name, self.start, monotonic_ns(), **self.args)
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+class Tracer:
+    """
+    Description: This class records named spans, such as the phases of a
+    transfer, with monotonic timestamps in nanoseconds. Every span also goes
+    into a latency histogram of its name. The spans can be written as JSON
+    lines or in the Chrome trace format (chrome://tracing, Perfetto). While
+    the tracer is disabled, span() hands out a shared object that does
+    nothing, so tracing costs one attribute check.
+    Parameters: max_spans (int) the oldest spans, and the oldest durations
+    of each name, are dropped beyond this
+    """
+
+    def __init__(self, max_spans=100000):
+        self.enabled = False
+        self.max_spans = max_spans
+        self.spans = []
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, **args):
+        """
+        Description: This function times the block it is used in:
+            with tracer.span("transport", station="ML1"):
+                ...
+        Parameters: self (obj), name (str), args extra data kept with the span
+        Returns: span (context manager)
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def add(self, name, start, end, **args):
+        """
+        Description: This function records a span that was timed elsewhere
+        Parameters: self (obj), name (str), start (int), end (int) monotonic
+        times in nanoseconds, args extra data kept with the span
+        Returns: None
+        """
+        if not self.enabled:
+            return
+        span = {"name": name, "start": start, "end": end, "thread": threading.get_ident(), "args": args}
+        with self._lock:
+            self.spans.append(span)
+            if len(self.spans) > self.max_spans:
+                del self.spans[:len(self.spans) - self.max_spans]
+            if name not in self.durations:
+                self.durations[name] = deque(maxlen=self.max_spans)
+            self.durations[name].append((end - start) / 1e9)
+
+    def add_phases(self, commands, started, finished, **args):
+        """
+        Description: This function turns the timing of a streamed command list
+        into one span per run of commands of the same phase
+        Parameters: self (obj), commands (list), started (list), finished
+        (list) monotonic times at which each command started and finished,
+        args extra data kept with the spans
+        Returns: None
+        """
+        first = 0
+        for i in range(1, len(finished) + 1):
+            name = commands[first].get(PHASE_KEY)
+            if i < len(finished) and commands[i].get(PHASE_KEY) == name:
+                continue
+            if name is not None:
+                self.add(name, started[first], finished[i-1], commands=i - first, **args)
+            first = i
+
+    def histogram(self, name, buckets=BUCKETS):
+        """
+        Description: This function counts the spans of a name per latency bucket
+        Parameters: self (obj), name (str), buckets (list) upper bounds in seconds
+        Returns: counts (dict) upper bound -> count, with "inf" for the rest
+        """
+        counts = dict.fromkeys([str(bound) for bound in buckets] + ["inf"], 0)
+        with self._lock:
+            durations = list(self.durations.get(name, ()))
+        for duration in durations:
+            for bound in buckets:
+                if duration <= bound:
+                    counts[str(bound)] += 1
+                    break
+            else:
+                counts["inf"] += 1
+
+        return counts
+
+    def summary(self):
+        """
+        Description: This function summarizes the latency of every span name
+        Parameters: self (obj)
+        Returns: summary (dict) name -> count, total, mean, p50, p95 and max in seconds
+        """
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self.durations.items()}
+
+        summary = {}
+        for name, values in durations.items():
+            summary[name] = {
+                "count": len(values),
+                "total": sum(values),
+                "mean": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(len(values)-1, int(len(values) * 0.95))],
+                "max": values[-1],
+            }
+
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+            self.durations = {}
+
+    def export_jsonl(self, path):
+        """
+        Description: This function writes one span per line as JSON
+        Parameters: self (obj), path (str)
+        Returns: None
+        """
+        with self._lock:
+            spans = list(self.spans)
+        with open(path, 'w') as file:
+            for span in spans:
+                file.write(json.dumps(span) + "\n")
+
+    def export_chrome(self, path):
+        """
+        Description: This function writes the spans in the Chrome trace
+        format, with the histograms of the phases in the metadata
+        Parameters: self (obj), path (str)
+        Returns: None
+        """
+        with self._lock:
+            spans = list(self.spans)
+        events = [{
+            "name": span["name"],
+            "ph": "X",
+            "ts": span["start"] / 1000,
+            "dur": (span["end"] - span["start"]) / 1000,
+            "pid": os.getpid(),
+            "tid": span["thread"],
+            "args": span["args"],
+        } for span in spans]
+        with open(path, 'w') as file:
+            json.dump({"traceEvents": events, "metadata": {"summary": self.summary()}}, file, default=str)
+
+    def export(self, path):
+        """
+        Description: This function writes the spans, as JSON lines if the
+        file ends in .jsonl and in the Chrome trace format otherwise
+        Parameters: self (obj), path (str)
+        Returns: None
+        """
+        if path.endswith(".jsonl"):
+            self.export_jsonl(path)
+        else:
+            self.export_chrome(path)
+
+# the tracer shared by the whole process
+TRACER = Tracer()
+
+def span(name, **args):
+    return TRACER.span(name, **args)
+
+def enable(path=None):
+    """
+    Description: This function turns tracing on, the spans are written to
+    path when the process exits if it is given
+    Parameters: path (str)
+    Returns: tracer (Tracer)
+    """
+    TRACER.enabled = True
+    if path:
+        atexit.register(TRACER.export, path)
+
+    return TRACER
+
+def disable():
+    TRACER.enabled = False
+
+# tracing can be turned on for any script with DORNA_TRACE=trace.json
+if os.environ.get("DORNA_TRACE"):
+    enable(os.environ["DORNA_TRACE"])
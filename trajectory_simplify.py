@@ -0,0 +1,194 @@
+import argparse
+import json
+import math
+from script_replay import parse_script, find_macro
+
+JOINT_KEYS = ("j0", "j1", "j2", "j3", "j4", "j5", "j6", "j7")
+
+# profile assumed for commands that don't give one, used for the time estimate
+DEFAULT_VEL = 100
+DEFAULT_ACCEL = 500
+
+def _is_waypoint(cmd):
+    # only absolute joint moves can be merged, everything else is kept as is
+    return cmd.get("cmd") == "jmove" and cmd.get("rel", 0) == 0 and any(key in cmd for key in JOINT_KEYS)
+
+def joint_states(commands, start=None):
+    """
+    Description: This function works out the full joint state after every
+    command. Joints that a command doesn't give keep their previous value.
+    Parameters: commands (list), start (list) joint state before the first command
+    Returns: states (list) of lists of 8 joint values, None where unknown
+    """
+    state = list(start) if start is not None else [None] * len(JOINT_KEYS)
+    states = []
+    for cmd in commands:
+        if cmd.get("cmd") == "jmove":
+            for i, key in enumerate(JOINT_KEYS):
+                if key in cmd:
+                    if cmd.get("rel", 0) and state[i] is not None:
+                        state[i] += cmd[key]
+                    elif not cmd.get("rel", 0):
+                        state[i] = cmd[key]
+        states.append(list(state))
+
+    return states
+
+def _distance(point, a, b):
+    # distance from point to the segment from a to b in joint space
+    ab = [y - x for x, y in zip(a, b)]
+    ap = [y - x for x, y in zip(a, point)]
+    length = sum(v*v for v in ab)
+    t = 0 if length == 0 else max(0, min(1, sum(u*v for u, v in zip(ap, ab)) / length))
+
+    return math.sqrt(sum((p - t*v)**2 for p, v in zip(ap, ab)))
+
+def _simplify(points, tolerance):
+    # Ramer-Douglas-Peucker, returns the indices of the points to keep
+    keep = {0, len(points)-1}
+    stack = [(0, len(points)-1)]
+    while stack:
+        first, last = stack.pop()
+        worst, index = 0, None
+        for i in range(first+1, last):
+            distance = _distance(points[i], points[first], points[last])
+            if distance > worst:
+                worst, index = distance, i
+        if index is not None and worst > tolerance:
+            keep.add(index)
+            stack += [(first, index), (index, last)]
+
+    return sorted(keep)
+
+def simplify(commands, tolerance=0.5, gripper_tolerance=1.0):
+    """
+    Description: This function drops the waypoints of a recorded sequence that
+    lie within the tolerance of the path through the remaining ones. Runs of
+    absolute jmoves are simplified in joint space (j0 to j7). The claw (j5)
+    is not interpolated: the waypoints where it starts and finishes opening
+    or closing are always kept, so grabs and releases happen at exactly the
+    recorded places and end at the recorded claw value. Other commands are
+    never removed.
+    Parameters: commands (list), tolerance (float), gripper_tolerance (float)
+    Returns: commands (list)
+    """
+    states = joint_states(commands)
+    result = []
+    run = []
+
+    def flush():
+        if not run:
+            return
+        # the start and the end of every claw movement are anchors, steps in
+        # the same direction count as one movement even with pauses between
+        anchors = {0, len(run)-1}
+        direction = 0
+        last = None
+        for k in range(1, len(run)):
+            before, after = states[run[k-1]][5], states[run[k]][5]
+            if before is None or after is None or abs(after - before) <= gripper_tolerance:
+                continue
+            step = 1 if after > before else -1
+            if step != direction:
+                anchors.add(k-1)
+                direction = step
+            else:
+                # only the last step of a movement stays an anchor
+                anchors.discard(last)
+            anchors.add(k)
+            last = k
+        anchors = sorted(anchors)
+
+        kept = set(anchors)
+        for first, last in zip(anchors, anchors[1:]):
+            # the claw is left out of the distance, it only changes at anchors
+            points = [[value or 0 for j, value in enumerate(states[run[k]]) if j != 5] for k in range(first, last+1)]
+            kept.update(first + k for k in _simplify(points, tolerance))
+        result.extend(commands[run[k]] for k in sorted(kept))
+        run.clear()
+
+    for i, cmd in enumerate(commands):
+        if _is_waypoint(cmd):
+            run.append(i)
+        else:
+            flush()
+            result.append(cmd)
+    flush()
+
+    return result
+
+def _segment_time(distance, vel, accel):
+    # time of a move that starts and ends at rest with a trapezoidal profile
+    if distance <= 0:
+        return 0
+    if distance < vel*vel/accel:
+        return 2*math.sqrt(distance/accel)
+    return distance/vel + vel/accel
+
+def estimate_time(commands, start=None):
+    """
+    Description: This function gives a rough duration of a sequence of joint
+    moves, every move starting and stopping at rest and lasting as long as
+    its slowest joint
+    Parameters: commands (list), start (list) joint state before the first command
+    Returns: time (float) in seconds
+    """
+    total = 0
+    previous = list(start) if start is not None else None
+    for cmd, state in zip(commands, joint_states(commands, start)):
+        if previous is not None and cmd.get("cmd") == "jmove":
+            vel = cmd.get("vel", DEFAULT_VEL)
+            accel = cmd.get("accel", DEFAULT_ACCEL)
+            total += max([_segment_time(abs(b - a), vel, accel)
+                          for a, b in zip(previous, state) if a is not None and b is not None] or [0])
+        previous = state
+
+    return total
+
+def report(commands, simplified):
+    """
+    Description: This function compares a sequence before and after the
+    simplification
+    Parameters: commands (list), simplified (list)
+    Returns: report (dict)
+    """
+    before = estimate_time(commands)
+    after = estimate_time(simplified)
+
+    return {
+        "commands": len(commands),
+        "simplified": len(simplified),
+        "reduction": 1 - len(simplified)/len(commands) if commands else 0,
+        "time": before,
+        "simplified_time": after,
+        "time_saved": before - after,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Simplifies recorded joint trajectories."
+    )
+    parser.add_argument("script", help="recorded script, e.g. record.txt")
+    parser.add_argument("--section", help="only this section, by index or name")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed deviation in joint space (default: 0.5)")
+    parser.add_argument("--gripper-tolerance", type=float, default=1.0, help="j5 change kept exactly (default: 1)")
+    parser.add_argument("--write", help="write the simplified script to this file")
+    args = parser.parse_args()
+
+    macros = parse_script(args.script)
+    if args.section is not None:
+        macros = [find_macro(macros, args.section)]
+
+    output = []
+    for macro in macros:
+        simplified = simplify(macro.commands, args.tolerance, args.gripper_tolerance)
+        stats = report(macro.commands, simplified)
+        print("%3d  %-40s %3d -> %3d commands (-%2.0f%%), %.1f s saved" % (
+            macro.index, macro.name, stats["commands"], stats["simplified"], 100*stats["reduction"], stats["time_saved"]))
+        output.append("#" * max(1, macro.level) + macro.name)
+        output += [json.dumps(cmd, separators=(",", ":")) for cmd in simplified]
+        output.append("")
+
+    if args.write:
+        with open(args.write, 'w') as file:
+            file.write("\n".join(output))
@@ -0,0 +1,187 @@
+import argparse
+import json
+from station_index import StationIndex
+from position_store import load_positions
+
+# speeds of the rail and of j0 as used by transport() and the actions
+RAIL_VEL = 120
+J0_VEL = 250
+
+# batches up to this size are solved exactly, larger ones greedily
+EXACT_LIMIT = 12
+
+def travel(a, b):
+    """
+    Description: This function estimates the rail travel, the j0 rotation and
+    the time it takes to go from one station to another. Changing the side of
+    the table rotates j0 through the folded position at 0.
+    Parameters: a (dict), b (dict)
+    Returns: rail (float), rotation (float), time (float)
+    """
+    rail = abs(a["j6"] - b["j6"])
+    if (a["j0"] > 0) == (b["j0"] > 0):
+        rotation = abs(a["j0"] - b["j0"])
+    else:
+        rotation = abs(a["j0"]) + abs(b["j0"])
+
+    # the rail and j0 don't move at the same time
+    return rail, rotation, rail / RAIL_VEL + rotation / J0_VEL
+
+def dependencies(transfers):
+    """
+    Description: This function finds which transfers have to stay in the
+    given order. Two transfers that use the same station, as source or as
+    destination, keep their order so that a plate is never taken before it
+    arrives and never placed on a station before it has been emptied.
+    Parameters: transfers (list) of (source, destination)
+    Returns: before (list) before[i] is a bitmask of the transfers that have
+    to come before transfer i
+    """
+    before = [0] * len(transfers)
+    for j, (src, dest) in enumerate(transfers):
+        for i in range(j):
+            if {src, dest} & set(transfers[i]):
+                before[j] |= 1 << i
+
+    return before
+
+def route_cost(order, transfers, stations, start):
+    """
+    Description: This function adds up the travel of a whole batch, going to
+    the source and then the destination of each transfer in turn
+    Parameters: order (list), transfers (list), stations (dict), start (dict)
+    Returns: cost (dict) rail, rotation and time
+    """
+    cost = {"rail": 0.0, "rotation": 0.0, "time": 0.0}
+    here = start
+    for index in order:
+        for name in transfers[index]:
+            rail, rotation, time = travel(here, stations[name])
+            cost["rail"] += rail
+            cost["rotation"] += rotation
+            cost["time"] += time
+            here = stations[name]
+
+    return cost
+
+def _exact_order(transfers, stations, start, before):
+    # cost of doing transfer i when the arm is at the destination of transfer j
+    n = len(transfers)
+    inner = [travel(stations[src], stations[dest])[2] for src, dest in transfers]
+    fromStart = [travel(start, stations[src])[2] + inner[i] for i, (src, dest) in enumerate(transfers)]
+    between = [[travel(stations[transfers[j][1]], stations[transfers[i][0]])[2] + inner[i]
+                for i in range(n)] for j in range(n)]
+
+    # best[mask][last] is the cheapest time to do the transfers in mask ending with last
+    best = {}
+    for i in range(n):
+        if before[i] == 0:
+            best[(1 << i, i)] = (fromStart[i], None)
+
+    for mask in range(1, 1 << n):
+        for last in range(n):
+            entry = best.get((mask, last))
+            if entry is None:
+                continue
+            for i in range(n):
+                if mask & (1 << i) or (before[i] & mask) != before[i]:
+                    continue
+                key = (mask | (1 << i), i)
+                time = entry[0] + between[last][i]
+                if key not in best or time < best[key][0]:
+                    best[key] = (time, last)
+
+    full = (1 << n) - 1
+    last = min(range(n), key=lambda i: best.get((full, i), (float("inf"),))[0])
+
+    # walks back through the table to recover the order
+    order = []
+    mask = full
+    while last is not None:
+        order.append(last)
+        previous = best[(mask, last)][1]
+        mask &= ~(1 << last)
+        last = previous
+
+    return order[::-1]
+
+def _greedy_order(transfers, stations, start, before):
+    # always does the cheapest transfer whose dependencies are done
+    order = []
+    done = 0
+    here = start
+    while len(order) < len(transfers):
+        ready = [i for i in range(len(transfers)) if not done & (1 << i) and (before[i] & done) == before[i]]
+        index = min(ready, key=lambda i: travel(here, stations[transfers[i][0]])[2])
+        order.append(index)
+        done |= 1 << index
+        here = stations[transfers[index][1]]
+
+    # swaps neighbours while it helps and keeps the dependencies
+    improved = True
+    while improved:
+        improved = False
+        for k in range(len(order) - 1):
+            a, b = order[k], order[k + 1]
+            if before[b] & (1 << a):
+                continue
+            swapped = order[:k] + [b, a] + order[k + 2:]
+            if route_cost(swapped, transfers, stations, start)["time"] < route_cost(order, transfers, stations, start)["time"]:
+                order = swapped
+                improved = True
+
+    return order
+
+def plan_transfers(transfers, positions, start=None):
+    """
+    Description: This function reorders a batch of transfers so that the rail
+    travels as little as possible. The gripper holds one plate at a time, so
+    every transfer goes from its source straight to its destination, and
+    transfers that share a station keep their order.
+    Parameters: transfers (list) of (source, destination), positions (dict or
+    StationIndex), start (dict) where the arm starts, the first source if not given
+    Returns: plan (dict) the new order with the predicted and the first in,
+    first out (baseline) travel
+    """
+    if not transfers:
+        return {"order": [], "predicted": route_cost([], [], {}, None), "baseline": route_cost([], [], {}, None), "saved": 0.0}
+
+    # unknown station names are rejected here, aliases such as ML1 are
+    # replaced by the canonical name so they count as the same station
+    index = positions if isinstance(positions, StationIndex) else StationIndex(positions)
+    transfers = [tuple(index.canonical(name) for name in transfer) for transfer in transfers]
+    stations = {}
+    for transfer in transfers:
+        for name in transfer:
+            stations[name] = index.lookup(name)
+    if start is None:
+        start = stations[transfers[0][0]]
+
+    before = dependencies(transfers)
+    if len(transfers) <= EXACT_LIMIT:
+        order = _exact_order(transfers, stations, start, before)
+    else:
+        order = _greedy_order(transfers, stations, start, before)
+
+    baseline = route_cost(range(len(transfers)), transfers, stations, start)
+    predicted = route_cost(order, transfers, stations, start)
+
+    return {
+        "order": [transfers[i] for i in order],
+        "predicted": predicted,
+        "baseline": baseline,
+        "saved": baseline["time"] - predicted["time"],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reorders plate transfers to minimize rail travel."
+    )
+    parser.add_argument("transfers", nargs="+", help="transfers as source:destination")
+    parser.add_argument("--positions", default="positions.json", help="positions file")
+    args = parser.parse_args()
+
+    positions = load_positions(args.positions)
+
+    plan = plan_transfers([transfer.split(":") for transfer in args.transfers], positions)
+    print(json.dumps(plan, indent=4))
@@ -0,0 +1,401 @@
+import argparse
+import math
+from time import perf_counter
+import numpy as np
+from kinematics import L0, L1, L2, L3, H, forward, inverse, POSE_KEYS
+from station_index import StationIndex
+from position_store import load_positions
+from tracing import PHASE_KEY
+
+# the bench, in mm in the frame of the arm: x runs along the rail, y across
+# the table and z up from the height the tip of the claw reads 0 at. Sizes
+# marked as estimated have to be measured on the bench before the model is
+# trusted to allow a route the choreography avoids.
+
+# top of the table, the claw grips plates at 59 mm below the holder stations (estimated)
+TABLE_Z = -65
+
+# plate holders: outer footprint along x and y, wall thickness and the top of
+# the walls below the station height (estimated)
+HOLDER_SIZE = (140, 100)
+HOLDER_WALL = 8
+HOLDER_TOP = -45
+
+# microscopes: the body and stage stand under the station, from STAGE_REACH
+# towards the arm, and the light arm above it starts beyond the station seen
+# from the arm, as the claw reaches the stage from above and from the side of
+# the arm (estimated)
+MICROSCOPE_SIZE = (100, 220)
+MICROSCOPE_INSET = 40
+STAGE_REACH = 60
+STAGE_DROP = 80
+LIGHT_CLEARANCE = 60
+LIGHT_HEIGHT = 150
+LIGHT_WIDTH = 60
+
+# radius of the arm around the upper arm, the forearm and the claw
+LINK_RADII = (35, 30, 20)
+# points checked along each link
+LINK_POINTS = 6
+
+# pairs of a state of the arm and an obstacle further apart than this are not
+# checked sphere by sphere, in mm
+MARGIN = 50
+
+# largest step between two checked states of a move, in degrees or mm
+STEP = 2.0
+
+class Workspace:
+    """
+    Description: This class is a model of the bench made of boxes: the
+    table, the walls of every plate holder, and the body and light arm of
+    every microscope, placed from the stations. The arm is modelled as
+    spheres along its links. Whole trajectories are checked at once with
+    the signed distance of every sphere to every box, so a plan can be
+    validated offline before it is sent to the robot.
+    Parameters: None, boxes are added with add_box() or from_stations()
+    """
+
+    def __init__(self):
+        self.names = []
+        self._lo = []
+        self._hi = []
+        self._arrays = None
+
+    def add_box(self, name, lo, hi):
+        """
+        Description: This function adds an obstacle
+        Parameters: self (obj), name (str), lo (list) and hi (list) opposite
+        corners (x, y, z)
+        Returns: None
+        """
+        self.names.append(name)
+        self._lo.append([min(a, b) for a, b in zip(lo, hi)])
+        self._hi.append([max(a, b) for a, b in zip(lo, hi)])
+        self._arrays = None
+
+    @classmethod
+    def from_stations(cls, stations):
+        """
+        Description: This function builds the model of the bench from the
+        stations. Each station is placed where the kinematics put the tip of
+        the claw at its recorded joints.
+        Parameters: stations (StationIndex or dict)
+        Returns: workspace (Workspace)
+        """
+        index = stations if isinstance(stations, StationIndex) else StationIndex(stations)
+        workspace = cls()
+        workspace.add_box("table", (-1e4, -1e4, TABLE_Z - 100), (1e4, 1e4, TABLE_Z))
+
+        places = {}
+        for name in index.names():
+            station = index.lookup(name)
+            pose = forward([station[key] for key in ("j0", "j1", "j2", "j3", "j4")])
+            places[name] = (pose[0] + station["j6"], pose[1], pose[2])
+
+        holders = [places[name] for name in index.names("holder")]
+        for name in index.names("holder"):
+            workspace._add_holder(name, *places[name])
+        for name in index.names("microscope"):
+            # the microscope stations are worked out from ML1, a holder
+            # recorded where one would stand means it isn't on the bench
+            x, y, z = places[name]
+            if any(abs(hx - x) < MICROSCOPE_SIZE[0] / 2 and -STAGE_REACH < (hy - y) * np.sign(y) < MICROSCOPE_SIZE[1] + MICROSCOPE_INSET
+                   for hx, hy, hz in holders):
+                print("Leaving out %s, a holder stands where it would be" % name)
+                continue
+            workspace._add_microscope(name, x, y, z)
+
+        return workspace
+
+    def _add_holder(self, name, x, y, z):
+        # four walls around the pocket the plate sits in
+        sizeX, sizeY = HOLDER_SIZE[0] / 2, HOLDER_SIZE[1] / 2
+        top = z + HOLDER_TOP
+        self.add_box(name + " wall -x", (x - sizeX, y - sizeY, TABLE_Z), (x - sizeX + HOLDER_WALL, y + sizeY, top))
+        self.add_box(name + " wall +x", (x + sizeX - HOLDER_WALL, y - sizeY, TABLE_Z), (x + sizeX, y + sizeY, top))
+        self.add_box(name + " wall -y", (x - sizeX, y - sizeY, TABLE_Z), (x + sizeX, y - sizeY + HOLDER_WALL, top))
+        self.add_box(name + " wall +y", (x - sizeX, y + sizeY - HOLDER_WALL, TABLE_Z), (x + sizeX, y + sizeY, top))
+
+    def _add_microscope(self, name, x, y, z):
+        # the microscope stands on the far side of the station, seen from the arm
+        side = 1 if y > 0 else -1
+        near = y + side * MICROSCOPE_INSET
+        far = y + side * (MICROSCOPE_SIZE[1] + MICROSCOPE_INSET)
+        sizeX = MICROSCOPE_SIZE[0] / 2
+        self.add_box(name + " body", (x - sizeX, y - side * STAGE_REACH, TABLE_Z), (x + sizeX, far, z - STAGE_DROP))
+        self.add_box(name + " light", (x - LIGHT_WIDTH / 2, near, z + LIGHT_CLEARANCE),
+                     (x + LIGHT_WIDTH / 2, far, z + LIGHT_CLEARANCE + LIGHT_HEIGHT))
+
+    def _boxes(self):
+        if self._arrays is None:
+            lo, hi = np.array(self._lo, dtype=float), np.array(self._hi, dtype=float)
+            self._arrays = ((lo + hi) / 2, (hi - lo) / 2)
+        return self._arrays
+
+    def distance(self, points):
+        """
+        Description: This function gives the signed distance of every point to
+        every box, negative inside the box
+        Parameters: self (obj), points (array) shape (M, 3)
+        Returns: distances (array) shape (M, B)
+        """
+        center, half = self._boxes()
+        return _box_distance(points[:, None, :], center[None], half[None])
+
+    def check_joints(self, joints, owners=None):
+        """
+        Description: This function checks a whole trajectory of joint states
+        against the bench. The states are first boxed as a whole, only the
+        pairs of a state and an obstacle closer than MARGIN are then checked
+        sphere by sphere.
+        Parameters: self (obj), joints (array) shape (N, 8), owners (array)
+        the command each state belongs to
+        Returns: result (dict) ok, the clearance in mm (at most MARGIN) and
+        the collisions, one per command and obstacle
+        """
+        joints = np.asarray(joints, dtype=float)
+        owners = np.arange(len(joints)) if owners is None else np.asarray(owners)
+        points, radii = arm_points(joints)
+        unreachable = np.isnan(points).any(axis=(1, 2))
+
+        # the states whose bounding box comes near an obstacle
+        center, half = self._boxes()
+        reached = points[~unreachable]
+        low = reached.min(axis=1) - radii.max()
+        high = reached.max(axis=1) + radii.max()
+        gap = np.maximum(np.maximum(center - half - high[:, None], low[:, None] - center - half), 0)
+        states, boxes = np.nonzero((gap**2).sum(axis=-1) < MARGIN**2)
+        states = np.nonzero(~unreachable)[0][states]
+
+        # sphere by sphere for those
+        clearance = _box_distance(points[states], center[boxes][:, None], half[boxes][:, None]) - radii
+
+        collisions = []
+        seen = set()
+        for pair, point in zip(*np.nonzero(clearance < 0)):
+            state, box = states[pair], boxes[pair]
+            key = (int(owners[state]), box)
+            if key in seen:
+                continue
+            seen.add(key)
+            collisions.append({
+                "command": int(owners[state]),
+                "obstacle": self.names[box],
+                "link": ("upper arm", "forearm", "claw")[point // LINK_POINTS],
+                "depth": float(-clearance[pair, point]),
+            })
+        for state in np.nonzero(unreachable)[0]:
+            if ("unreachable", int(owners[state])) not in seen:
+                seen.add(("unreachable", int(owners[state])))
+                collisions.append({"command": int(owners[state]), "obstacle": "out of reach", "link": None, "depth": None})
+
+        return {
+            "ok": not collisions,
+            "clearance": float(min(clearance.min(), MARGIN)) if clearance.size else float(MARGIN),
+            "states": len(joints),
+            "collisions": collisions,
+        }
+
+    def check(self, commands, start):
+        """
+        Description: This function checks a command list, as sent to the
+        robot, against the bench
+        Parameters: self (obj), commands (list), start (list) joints before
+        the first command
+        Returns: result (dict) as check_joints(), with the phase of each
+        colliding command
+        """
+        joints, owners = sample_commands(commands, start)
+        result = self.check_joints(joints, owners)
+        for collision in result["collisions"]:
+            collision["phase"] = commands[collision["command"]].get(PHASE_KEY)
+
+        return result
+
+def _box_distance(points, center, half):
+    # signed distance of points (..., 3) to boxes given by their center and
+    # half size, one axis at a time as reducing over a last axis of 3 is slow
+    qx, qy, qz = [np.abs(points[..., axis] - center[..., axis]) - half[..., axis] for axis in range(3)]
+    outside = np.sqrt(np.maximum(qx, 0)**2 + np.maximum(qy, 0)**2 + np.maximum(qz, 0)**2)
+    inside = np.minimum(np.maximum(np.maximum(qx, qy), qz), 0)
+
+    return outside + inside
+
+def arm_points(joints):
+    """
+    Description: This function places spheres along the upper arm, the
+    forearm and the claw for every joint state
+    Parameters: joints (array) shape (N, 8)
+    Returns: points (array) shape (N, 3*LINK_POINTS, 3), radii (array)
+    """
+    joints = np.asarray(joints, dtype=float)
+    j0, j1, j2, j3 = np.radians(joints[:, :4]).T
+    j12 = j1 + j2
+    j123 = j12 + j3
+
+    # distance from the base axis and height of the shoulder, elbow, wrist and tip
+    r = np.stack([np.full_like(j1, L0), L1*np.cos(j1), L2*np.cos(j12), L3*np.cos(j123)], axis=1).cumsum(axis=1)
+    z = np.stack([np.full_like(j1, H), L1*np.sin(j1), L2*np.sin(j12), L3*np.sin(j123)], axis=1).cumsum(axis=1)
+
+    t = np.linspace(0, 1, LINK_POINTS)
+    r = (r[:, :-1, None] + (r[:, 1:, None] - r[:, :-1, None]) * t).reshape(len(joints), -1)
+    z = (z[:, :-1, None] + (z[:, 1:, None] - z[:, :-1, None]) * t).reshape(len(joints), -1)
+
+    # the rail moves the whole arm along x
+    points = np.stack([r * np.cos(j0)[:, None] + joints[:, 6:7], r * np.sin(j0)[:, None], z], axis=-1)
+    radii = np.repeat(np.array(LINK_RADII, dtype=float), LINK_POINTS)
+
+    return points, radii
+
+def sample_commands(commands, start, step=STEP):
+    """
+    Description: This function lists the joint states the arm goes through
+    while running the commands. A jmove is interpolated in joint space and an
+    lmove in cartesian space, like on the controller. States out of reach are
+    NaN.
+    Parameters: commands (list), start (list) 8 joints, step (float) largest
+    change between two states in degrees or mm
+    Returns: joints (array) shape (N, 8), owners (array) the command of each state
+    """
+    current = np.asarray(list(start) + [0] * (8 - len(start)), dtype=float)
+    samples = [current[None]]
+    owners = [np.array([-1])]
+
+    for index, cmd in enumerate(commands):
+        if cmd.get("cmd") not in ("jmove", "lmove"):
+            continue
+        relative = cmd.get("rel", 0)
+        cartesian = any(key in cmd for key in POSE_KEYS)
+        keys = POSE_KEYS if cartesian else ["j%d" % i for i in range(8)]
+        begin = forward(current) if cartesian else current
+        end = begin.copy()
+        for i, key in enumerate(keys):
+            if key in cmd:
+                end[i] = end[i] + cmd[key] if relative else cmd[key]
+
+        # an lmove is followed in cartesian space, a jmove in joint space
+        solve = None
+        if cartesian and cmd["cmd"] == "lmove":
+            solve = inverse
+        elif cartesian:
+            begin, end = current, inverse(end)
+
+        delta = np.nan_to_num(np.abs(end - begin))
+        count = max(1, int(math.ceil(delta.max() / step)))
+        states = begin + (end - begin) * np.linspace(0, 1, count + 1)[1:, None]
+        if solve is not None:
+            states = solve(states)
+        samples.append(states)
+        owners.append(np.full(len(states), index))
+        if not np.isnan(states[-1]).any():
+            current = states[-1]
+
+    return np.concatenate(samples), np.concatenate(owners)
+
+def safe_envelopes(workspace, stations, extension=False):
+    """
+    Description: This function works out, for every holder and microscope,
+    which joints can move together with the rail on the way to it. The arm
+    leaves from folded at any other station or at the start of the rail,
+    facing any station's side. The widest overlap the model allows is kept:
+    reaching the pose at the end of the approach during the rail move, or
+    only turning j0 to the station's side, or nothing.
+    Parameters: workspace (Workspace), stations (StationIndex or dict),
+    extension (bool) whether to use the chatbot extension's approach
+    Returns: envelopes (dict) name -> station joints, joints that may move
+    with the rail and clearance in mm
+    """
+    from cycle_time import START, JOINT_KEYS, action_commands
+    from route_planner import rail_commands
+
+    index = stations if isinstance(stations, StationIndex) else StationIndex(stations)
+    folded = [START.get(key, 0) for key in JOINT_KEYS]
+    rails = sorted({0.0} | {index.lookup(name)["j6"] for name in index.names()})
+    turns = sorted({0.0} | {index.lookup(name)["j0"] for name in index.names()})
+
+    envelopes = {}
+    for name in index.names():
+        station = index.lookup(name)
+        if station.kind not in ("holder", "microscope"):
+            continue
+
+        # the pose at the end of the approach, from folded at the station
+        start = list(folded)
+        start[6] = station["j6"]
+        commands = action_commands("grab_from_" + station.kind, station, start, extension)
+        joints, owners = sample_commands(commands, start)
+        last = max(i for i, cmd in enumerate(commands) if cmd.get(PHASE_KEY) == "approach" and cmd["cmd"] == "jmove")
+        approach = joints[owners == last][-1]
+
+        candidates = [
+            {key: round(float(approach[i]), 3) for i, key in enumerate(JOINT_KEYS[:5])},
+            {"j0": round(float(approach[0]), 3)},
+        ]
+        chosen, clearance = {}, None
+        for candidate in candidates:
+            move = [dict(rail_commands(station["j6"])[0], **candidate)]
+            # every start is checked in one go
+            samples = []
+            for rail in rails:
+                if abs(rail - station["j6"]) < 1:
+                    continue
+                for turn in turns:
+                    begin = list(folded)
+                    begin[0], begin[6] = turn, rail
+                    samples.append(sample_commands(move, begin)[0])
+            result = workspace.check_joints(np.concatenate(samples))
+            if result["ok"]:
+                chosen, clearance = candidate, result["clearance"]
+                break
+
+        envelopes[name] = {
+            "station": {key: station[key] for key in ("j0", "j1", "j2", "j3", "j4", "j6")},
+            "joints": chosen,
+            "clearance": clearance,
+        }
+
+    return envelopes
+
+if __name__ == "__main__":
+    import json
+    from cycle_time import START, JOINT_KEYS, action_commands
+    from route_planner import ENVELOPES
+
+    parser = argparse.ArgumentParser(
+        description="Checks the actions of the arm against a model of the bench."
+    )
+    parser.add_argument("--positions", default="positions.json", help="positions file")
+    parser.add_argument("--extension", action="store_true", help="use the chatbot extension's commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("check", help="checks one grab/place action")
+    check.add_argument("kind", help="e.g. grab_from_microscope")
+    check.add_argument("position", help="station name, e.g. MicroscopeLeft2")
+    envelopes = commands.add_parser("envelopes", help="works out the joints that may move with the rail")
+    envelopes.add_argument("--output", help="file to write, writing %s turns on moving the joints with the "
+                           "rail, only do so once the bench has been measured" % ENVELOPES)
+    args = parser.parse_args()
+
+    index = StationIndex(load_positions(args.positions))
+    workspace = Workspace.from_stations(index)
+
+    if args.command == "envelopes":
+        began = perf_counter()
+        result = safe_envelopes(workspace, index, args.extension)
+        for name, envelope in result.items():
+            print("%-18s %s" % (name, ", ".join(sorted(envelope["joints"])) or "-"))
+        print("Worked out in %.1f s" % (perf_counter() - began))
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(result, file, indent = 4)
+    else:
+        start = [START.get(key, 0) for key in JOINT_KEYS]
+        commands = action_commands(args.kind, index.lookup(args.position), start, args.extension)
+
+        began = perf_counter()
+        result = workspace.check(commands, start)
+        print("%d boxes, %d states checked in %.1f ms, clearance %.1f mm" % (
+            len(workspace.names), result["states"], 1000 * (perf_counter() - began), result["clearance"]))
+        for collision in result["collisions"]:
+            print("Command %(command)d (%(phase)s): %(link)s hits %(obstacle)s" % collision)
+        print("OK" if result["ok"] else "COLLISION")